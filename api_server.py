@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from aiohttp import web
+from PIL import Image
+
+import gemini_client
+import language
+import metrics
+import usage
+import vision
+from pipeline import is_error, run_pipeline
+
+HOST = os.getenv("GEMINI_SERVER_HOST", "127.0.0.1")
+PORT = int(os.getenv("GEMINI_SERVER_PORT", "8080"))
+# Pipeline calls run at once; further requests wait for a free slot
+CONCURRENCY = int(os.getenv("GEMINI_SERVER_CONCURRENCY", "8"))
+# Requests allowed to wait for a slot before new ones are turned away with 503
+MAX_PENDING = int(os.getenv("GEMINI_SERVER_MAX_PENDING", "64"))
+MAX_IMAGE_BYTES = int(os.getenv("GEMINI_SERVER_MAX_IMAGE_BYTES", str(20 * 1024 * 1024)))
+BATCH_MAX_IMAGES = int(os.getenv("GEMINI_SERVER_BATCH_MAX_IMAGES", "20"))
+# Cap on all images of one request together, which are held in memory until they are processed
+BATCH_MAX_BYTES = int(os.getenv("GEMINI_SERVER_BATCH_MAX_BYTES", str(64 * 1024 * 1024)))
+READ_CHUNK = 64 * 1024
+
+
+def _error(exception_class, message, **kwargs):
+    return exception_class(text=json.dumps({"error": message}), content_type="application/json", **kwargs)
+
+
+def _upstream_error(message):
+    """
+    The HTTP error for a failed pipeline call: 429 if a token budget refused
+    it, otherwise 502.
+    """
+    if usage.is_budget_error(message):
+        return _error(web.HTTPTooManyRequests, message)
+    return _error(web.HTTPBadGateway, message)
+
+
+def _session(request):
+    # Clients name their session to get a session budget and per-session usage
+    return request.headers.get("X-Session-Id", "")
+
+
+def _in_session(session, function, *args):
+    with usage.session_scope(session):
+        return function(*args)
+
+
+def _with_usage(function, *args):
+    """
+    Runs `function(*args)` and returns (result, model, usage) for the calls
+    it made (see usage.summarize).
+    """
+    with usage.collect_calls() as calls:
+        result = function(*args)
+    return (result, *usage.summarize(calls))
+
+
+class Reservation:
+    """
+    Places a request holds among those allowed to wait for a slot. Each
+    Limiter.run() made with it uses one place.
+    """
+
+    def __init__(self, limiter, places):
+        self.limiter = limiter
+        self.places = places
+
+    def extend(self, places):
+        """
+        Claims `places` more, turning the request away with 503 if there is no room.
+        """
+        self.limiter.claim(places)
+        self.places += places
+
+    def use(self):
+        if self.places:
+            self.places -= 1
+            self.limiter.pending -= 1
+
+    def release(self):
+        self.limiter.pending -= self.places
+        self.places = 0
+
+
+class Limiter:
+    """
+    Runs blocking pipeline calls on a thread pool, at most `concurrency` at
+    a time, and tracks how many requests are waiting for a slot. Requests
+    reserve their places before they are admitted, so concurrent ones can't
+    together go over `max_pending`.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.running = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="api")
+
+    def claim(self, places):
+        # Checked and taken in one step on the event loop, with no await in between
+        if self.pending + places > self.max_pending:
+            raise _error(web.HTTPServiceUnavailable, "Server is busy, please retry shortly.",
+                         headers={"Retry-After": "1"})
+        self.pending += places
+
+    @contextmanager
+    def reserve(self, places=1):
+        """
+        Claims `places` for a request and returns those it did not use on exit.
+        """
+        self.claim(places)
+        reservation = Reservation(self, places)
+        try:
+            yield reservation
+        finally:
+            reservation.release()
+
+    async def run(self, reservation, function, *args, session=""):
+        """
+        Runs `function(*args)` once a slot is free, using one place of
+        `reservation` while it waits and attributing its token usage to
+        `session`.
+        """
+        try:
+            await self._semaphore.acquire()
+        finally:
+            reservation.use()
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, _in_session, session, function, *args)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    async def offload(self, function, *args):
+        """
+        Runs a short blocking call, like verifying an image, off the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+LIMITER = web.AppKey("limiter", Limiter)
+
+
+def _is_image(data):
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            image.verify()
+        return True
+    except Exception:
+        return False
+
+
+def _has_image_header(data):
+    try:
+        with Image.open(io.BytesIO(data)):
+            return True
+    except Exception:
+        return False
+
+
+async def read_upload(request, max_images, limiter):
+    """
+    Streams a multipart upload, returning ([(filename, image_bytes)], fields).
+    Each image is read in chunks and rejected as soon as its first chunk has
+    no image header, it exceeds MAX_IMAGE_BYTES or the request's images
+    together exceed BATCH_MAX_BYTES. Images are verified off the event loop.
+    """
+    if not request.content_type.startswith("multipart/"):
+        raise _error(web.HTTPUnsupportedMediaType, "Send images as multipart/form-data.")
+
+    images, fields = [], {}
+    total = 0
+    reader = await request.multipart()
+    while (part := await reader.next()) is not None:
+        if part.filename is None:
+            fields[part.name] = await part.text()
+            continue
+        if len(images) == max_images:
+            raise _error(web.HTTPBadRequest, f"At most {max_images} image(s) per request.")
+        data = bytearray()
+        while chunk := await part.read_chunk(READ_CHUNK):
+            if not data and not await limiter.offload(_has_image_header, chunk):
+                raise _error(web.HTTPBadRequest, f"{part.filename} is not a supported image.")
+            data.extend(chunk)
+            total += len(chunk)
+            if len(data) > MAX_IMAGE_BYTES:
+                raise _error(web.HTTPRequestEntityTooLarge, f"{part.filename} is larger than {MAX_IMAGE_BYTES} bytes.",
+                             max_size=MAX_IMAGE_BYTES, actual_size=len(data))
+            if total > BATCH_MAX_BYTES:
+                raise _error(web.HTTPRequestEntityTooLarge, f"The images are larger than {BATCH_MAX_BYTES} bytes together.",
+                             max_size=BATCH_MAX_BYTES, actual_size=total)
+        data = bytes(data)
+        if not await limiter.offload(_is_image, data):
+            raise _error(web.HTTPBadRequest, f"{part.filename} is not a supported image.")
+        images.append((part.filename, data))
+
+    if not images:
+        raise _error(web.HTTPBadRequest, "No image was uploaded.")
+    return images, fields
+
+
+def _package(filename, image_bytes, fused):
+    start = time.perf_counter()
+    (description, content_package), model, call_usage = _with_usage(run_pipeline, io.BytesIO(image_bytes), fused)
+    record = {"filename": filename}
+    if is_error(description) or is_error(content_package):
+        record["error"] = description if is_error(description) else content_package
+    else:
+        record["description"] = description
+        record["content_package"] = content_package
+    record["model"] = model
+    record["usage"] = call_usage
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _is_true(value):
+    return (value or "").lower() in ("1", "true", "yes", "on")
+
+
+async def analyze(request):
+    limiter = request.app[LIMITER]
+    with limiter.reserve() as reservation:
+        [(filename, image_bytes)], _ = await read_upload(request, max_images=1, limiter=limiter)
+        description, model, call_usage = await limiter.run(reservation, _with_usage, vision.analyze_image,
+                                                           io.BytesIO(image_bytes), session=_session(request))
+    if is_error(description):
+        raise _upstream_error(description)
+    return web.json_response({"filename": filename, "description": description, "model": model, "usage": call_usage})
+
+
+async def generate(request):
+    limiter = request.app[LIMITER]
+    try:
+        body = await request.json()
+    except ValueError:
+        body = None
+    description = body.get("description") if isinstance(body, dict) else None
+    if not isinstance(description, str) or not description.strip():
+        raise _error(web.HTTPBadRequest, 'Send a JSON object with a non-empty "description" string.')
+    with limiter.reserve() as reservation:
+        content_package, model, call_usage = await limiter.run(reservation, _with_usage, language.generate_content,
+                                                               description, session=_session(request))
+    if is_error(content_package):
+        raise _upstream_error(content_package)
+    return web.json_response({"content_package": content_package, "model": model, "usage": call_usage})
+
+
+async def package(request):
+    limiter = request.app[LIMITER]
+    with limiter.reserve() as reservation:
+        [(filename, image_bytes)], fields = await read_upload(request, max_images=1, limiter=limiter)
+        record = await limiter.run(reservation, _package, filename, image_bytes, _is_true(fields.get("fused")),
+                                   session=_session(request))
+    if "error" in record:
+        raise _upstream_error(record["error"])
+    return web.json_response(record)
+
+
+async def package_batch(request):
+    """
+    Content packages for several images, run concurrently within the server's
+    limit. Returns {"results": [...]} in upload order, or with ?stream=1 one
+    NDJSON line per image as each finishes.
+    """
+    limiter = request.app[LIMITER]
+    with limiter.reserve() as reservation:
+        images, fields = await read_upload(request, max_images=BATCH_MAX_IMAGES, limiter=limiter)
+        # Every image of the batch may have to wait for a slot
+        reservation.extend(len(images) - 1)
+        fused = _is_true(fields.get("fused"))
+        session = _session(request)
+
+        async def run(index, filename, image_bytes):
+            record = await limiter.run(reservation, _package, filename, image_bytes, fused, session=session)
+            return dict(record, index=index)
+
+        tasks = [asyncio.ensure_future(run(index, *image)) for index, image in enumerate(images)]
+        try:
+            if not _is_true(request.query.get("stream")):
+                return web.json_response({"results": await asyncio.gather(*tasks)})
+
+            response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+            await response.prepare(request)
+            for task in asyncio.as_completed(tasks):
+                await response.write((json.dumps(await task) + "\n").encode("utf-8"))
+            await response.write_eof()
+            return response
+        finally:
+            # A client that went away leaves no images waiting for a slot
+            for task in tasks:
+                task.cancel()
+
+
+async def health(request):
+    limiter = request.app[LIMITER]
+    return web.json_response({
+        "status": "ok" if gemini_client.API_KEY else "no_api_key",
+        "running": limiter.running,
+        "pending": limiter.pending,
+        "breakers": gemini_client.breakers.snapshot(),
+    })
+
+
+async def usage_report(request):
+    """
+    Today's token usage and estimated cost, in total and by model and
+    session, with the configured budgets. ?day=YYYY-MM-DD picks another day.
+    """
+    ledger = usage.get_ledger()
+    day = request.query.get("day") or usage.today()
+    return web.json_response({
+        "day": day,
+        "totals": ledger.totals(day=day),
+        "by_model": ledger.breakdown("model", day=day),
+        "by_session": ledger.breakdown("session", day=day),
+        "budgets": {
+            "daily_tokens": usage.DAILY_TOKEN_BUDGET,
+            "session_tokens": usage.SESSION_TOKEN_BUDGET,
+            "model_tokens": usage.MODEL_TOKEN_BUDGETS,
+        },
+    })
+
+
+async def metrics_text(request):
+    return web.Response(text=metrics.render_prometheus(), content_type="text/plain")
+
+
+async def metrics_json(request):
+    return web.json_response(metrics.snapshot())
+
+
+def create_app(concurrency=CONCURRENCY, max_pending=MAX_PENDING):
+    """
+    Builds the aiohttp application. Uploads are streamed per part, so the
+    whole-body limit only has to cover a full batch.
+    """
+    app = web.Application(client_max_size=BATCH_MAX_BYTES)
+
+    async def start_limiter(app):
+        app[LIMITER] = Limiter(concurrency, max_pending)
+
+    async def stop_limiter(app):
+        app[LIMITER].close()
+
+    app.on_startup.append(start_limiter)
+    app.on_cleanup.append(stop_limiter)
+    app.add_routes([
+        web.post("/v1/analyze", analyze),
+        web.post("/v1/generate", generate),
+        web.post("/v1/packages", package),
+        web.post("/v1/packages/batch", package_batch),
+        web.get("/v1/usage", usage_report),
+        web.get("/healthz", health),
+        web.get("/metrics", metrics_text),
+        web.get("/metrics.json", metrics_json),
+    ])
+    return app
+
+
+def serve_in_background(host="127.0.0.1", port=0, **kwargs):
+    """
+    Runs the server on its own event loop thread, for benchmarks and local
+    load tests. Returns (base_url, stop).
+    """
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(create_app(**kwargs))
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, host, port)
+    loop.run_until_complete(site.start())
+    bound_port = runner.addresses[0][1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    return f"http://{host}:{bound_port}", stop
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP API for image analysis and content packages.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("-c", "--concurrency", type=int, default=CONCURRENCY,
+                        help="Pipeline calls to run at once")
+    parser.add_argument("--max-pending", type=int, default=MAX_PENDING,
+                        help="Requests that may wait for a slot before the server answers 503")
+    parser.add_argument("--mock", action="store_true",
+                        help="Call a local mock of the Gemini API instead of the real one, for load tests")
+    parser.add_argument("--mock-latency", type=float, default=0.2, help="Seconds the mock takes per request")
+    args = parser.parse_args()
+
+    if args.mock:
+        from mock_server import MockGeminiServer
+
+        mock = MockGeminiServer(latency=args.mock_latency).start()
+        gemini_client.API_BASE = mock.base_url
+        for module in (gemini_client, vision, language):
+            module.API_KEY = module.API_KEY or "mock-key"
+        print(f"🧪 Using the mock Gemini API at {mock.base_url}")
+
+    if not gemini_client.API_KEY:
+        print("⚠️ GOOGLE_API_KEY is not set; requests will fail until it is.")
+    gemini_client.warm_up(connections=2)
+    web.run_app(create_app(args.concurrency, args.max_pending), host=args.host, port=args.port)
@@ -1,21 +1,206 @@
 import streamlit as st
-from PIL import Image
+import hashlib
+import os
+import threading
 import time
-from vision import analyze_image
-from language import generate_content
-import google.generativeai as genai  # <-- ADD THIS IMPORT
+import uuid
+from collections import OrderedDict
+
+# Heavy modules (PIL, requests and the Gemini pipeline) are imported on first
+# use so a cold start only pays for Streamlit itself
 
 # --- API KEY CONFIGURATION ---
 # This block reads the secret key from the Streamlit dashboard
 try:
     api_key = st.secrets["GOOGLE_API_KEY"]
-    genai.configure(api_key=api_key)
 except (KeyError, FileNotFoundError):
     st.error("❌ Error: GOOGLE_API_KEY is not set in Streamlit secrets.")
     st.info("Please add your Google API key to the Streamlit secrets manager.")
     st.stop()  # Stops the app from running further if the key is not found
+# The API modules read their key from the environment when first imported
+os.environ.setdefault("GOOGLE_API_KEY", api_key)
+
+
+def _start_services():
+    import gemini_client
+    import metrics
+    import pipeline  # noqa: F401 -- preloads vision, language and PIL before the first click
+
+    # Open pooled connections to the API host
+    gemini_client.warm_up(connections=2)
+    # Optionally find out which models are down before the first user request
+    if gemini_client.PROBE_ON_START:
+        gemini_client.start_probe()
+    # Expose /metrics for scraping when GEMINI_METRICS_PORT is set
+    if metrics.PORT:
+        metrics.start_server()
+
+
+@st.cache_resource(show_spinner=False)
+def start_services():
+    """
+    Imports the API modules and warms up the client on a background thread,
+    once per process, so the first render does not wait for them.
+    """
+    thread = threading.Thread(target=_start_services, daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_resource(show_spinner=False)
+def load_css():
+    """
+    Reads the stylesheet once per process.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "style.css")
+    with open(path, encoding="utf-8") as css_file:
+        return f"<style>\n{css_file.read()}</style>"
+
+
 # -----------------------------
 
+# Uploads (preview, metadata and results) kept per session; oldest are dropped first
+MAX_SESSION_UPLOADS = 5
+# Seconds between checks on a running background job
+JOB_POLL_INTERVAL = 0.5
+
+
+def get_upload_entry(uploaded_file):
+    """
+    Returns this session's state for an upload, keyed by its content hash.
+    The image is decoded once per upload (see vision.ingest_image) and only
+    its bounded preview is kept and sent to the browser.
+    """
+    hashes = st.session_state.setdefault("upload_hashes", {})
+    file_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    if file_id not in hashes:
+        hashes.clear()  # Only the current upload's hash is needed
+        hashes[file_id] = hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+    upload_hash = hashes[file_id]
+
+    uploads = st.session_state.setdefault("uploads", OrderedDict())
+    if upload_hash not in uploads:
+        import history
+        from vision import ingest_image
+
+        ingested = ingest_image(uploaded_file.getvalue())
+        # An image generated for before starts with its newest package from the history
+        earlier = history.get_history().latest_for_image(upload_hash) if history.ENABLED else None
+        uploads[upload_hash] = {
+            "preview": ingested.preview,
+            "width": ingested.width,
+            "height": ingested.height,
+            "description": earlier and earlier["description"],
+            "content_package": earlier and earlier["content_package"],
+            "package": earlier and earlier["package"],
+            "breakdown": None,
+            "model": None,
+            "usage": None,
+            "history_id": earlier and earlier["id"],
+            "restored_at": earlier and earlier["created_at"],
+            "job_id": None,
+        }
+        while len(uploads) > MAX_SESSION_UPLOADS:
+            uploads.popitem(last=False)
+    uploads.move_to_end(upload_hash)
+    return uploads[upload_hash]
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_progress(job_id):
+    """
+    Shows a background job's progress and any partial output, polling until
+    the job finishes and then rerunning the page to show its results.
+    """
+    from jobs import QUEUED, RUNNING, get_job_queue
+
+    job = get_job_queue().status(job_id)
+    if job is None or job["status"] not in (QUEUED, RUNNING):
+        st.rerun()
+    st.progress(job["progress"], text=job["message"] or "⏳ Waiting for a free worker...")
+    if job["partial"]:
+        st.markdown(job["partial"])
+
+
+def session_id():
+    """
+    Random ID of this browser session, under which its token usage is
+    recorded and its budget applied.
+    """
+    return st.session_state.setdefault("session_id", uuid.uuid4().hex)
+
+
+def open_history_entry(entry_id):
+    st.session_state["history_entry"] = entry_id
+
+
+def history_panel():
+    """
+    Sidebar list of earlier content packages, newest first, with search
+    over their captions, hashtags and descriptions. Opening one shows it
+    from the local history without any API call.
+    """
+    from history import get_history
+
+    st.markdown("### 📚 History")
+    query = st.text_input("Search captions and hashtags", key="history_query", placeholder="e.g. sunset #travel")
+    # Cursors of the pages before this one, reset whenever the search changes
+    pages = st.session_state.setdefault("history_pages", {"query": query, "cursors": [None]})
+    if pages["query"] != query:
+        pages.update(query=query, cursors=[None])
+
+    entries, next_cursor = get_history().page(query, before=pages["cursors"][-1])
+    if not entries:
+        st.caption("No matching packages yet." if query else "Packages you generate will be kept here.")
+    for entry in entries:
+        thumbnail, details = st.columns([1, 3])
+        if entry["thumbnail"]:
+            thumbnail.image(entry["thumbnail"], use_container_width=True)
+        caption = entry["captions"].split("\n", 1)[0]
+        details.markdown(f"**{entry['filename'] or 'Image'}** · {time.strftime('%d %b %H:%M', time.localtime(entry['created_at']))}")
+        details.caption(caption[:90] + ("…" if len(caption) > 90 else ""))
+        details.button("Open", key=f"history_open_{entry['id']}", on_click=open_history_entry, args=(entry["id"],))
+
+    newer, older = st.columns(2)
+    if newer.button("← Newer", disabled=len(pages["cursors"]) == 1, use_container_width=True):
+        pages["cursors"].pop()
+        st.rerun()
+    if older.button("Older →", disabled=next_cursor is None, use_container_width=True):
+        pages["cursors"].append(next_cursor)
+        st.rerun()
+
+
+def show_history_entry(entry_id):
+    """
+    Shows a content package from the history, as generated.
+    """
+    from history import get_history
+
+    entry = get_history().get(entry_id)
+    if entry is None:
+        st.session_state["history_entry"] = None
+        return
+
+    st.markdown('<div class="content-section">', unsafe_allow_html=True)
+    header, close = st.columns([5, 1])
+    header.markdown(f"### 📚 {entry['filename'] or 'Earlier package'} · "
+                    f"{time.strftime('%d %b %Y %H:%M', time.localtime(entry['created_at']))}")
+    close.button("✖ Close", key="history_close", on_click=open_history_entry, args=(None,), use_container_width=True)
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if entry["thumbnail"]:
+            st.image(entry["thumbnail"], use_container_width=True)
+    with col2:
+        tab1, tab2 = st.tabs(["📝 Content Package", "🔍 Image Analysis"])
+        with tab1:
+            st.markdown(entry["content_package"])
+        with tab2:
+            st.markdown(f"**Image Description:** {entry['description']}")
+            if entry["timings"]:
+                st.caption("Generated in " + ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in entry["timings"].items()))
+    st.markdown('</div>', unsafe_allow_html=True)
+
+
 # --- Page Configuration ---
 st.set_page_config(
     page_title="Social Spark AI",
@@ -24,101 +209,7 @@ st.set_page_config(
 )
 
 # --- Custom CSS for better styling ---
-st.markdown("""
-<style>
-    /* Force dark theme for better visibility */
-    .stApp {
-        background-color: #0E1117;
-        color: #FFFFFF;
-    }
-    
-    .main-header {
-        text-align: center;
-        background: linear-gradient(90deg, #667eea 0%, #764ba2 100%);
-        padding: 2rem;
-        border-radius: 10px;
-        margin-bottom: 2rem;
-    }
-    .main-header h1 {
-        color: white !important;
-        margin: 0;
-        font-size: 3rem;
-    }
-    .main-header p {
-        color: #f0f0f0 !important;
-        margin: 0.5rem 0 0 0;
-        font-size: 1.2rem;
-    }
-    
-    .feature-box {
-        background: #1E2130 !important;
-        padding: 1.5rem;
-        border-radius: 10px;
-        border-left: 4px solid #667eea;
-        margin: 1rem 0;
-        color: #FFFFFF !important;
-    }
-    .feature-box h4 {
-        color: #FFFFFF !important;
-        margin-bottom: 0.5rem;
-    }
-    .feature-box p {
-        color: #CCCCCC !important;
-    }
-    
-    .content-section {
-        background: #1E2130 !important;
-        padding: 2rem;
-        border-radius: 10px;
-        box-shadow: 0 2px 4px rgba(0,0,0,0.3);
-        margin: 1rem 0;
-        color: #FFFFFF !important;
-    }
-    .content-section h3, .content-section h4, .content-section p {
-        color: #FFFFFF !important;
-    }
-    
-    .success-banner {
-        background: linear-gradient(90deg, #56ab2f 0%, #a8e6cf 100%);
-        padding: 1rem;
-        border-radius: 8px;
-        color: white !important;
-        text-align: center;
-        margin: 1rem 0;
-    }
-    .success-banner h3 {
-        color: white !important;
-    }
-    
-    /* Fix all Streamlit text elements */
-    .stMarkdown, .stMarkdown p, .stMarkdown div {
-        color: #FFFFFF !important;
-    }
-    
-    /* Fix file uploader text */
-    .stFileUploader label {
-        color: #FFFFFF !important;
-    }
-    
-    /* Fix tab text */
-    .stTabs [data-baseweb="tab-list"] button {
-        color: #FFFFFF !important;
-    }
-    
-    /* Fix info boxes */
-    .stAlert {
-        background-color: #1E2130 !important;
-        color: #FFFFFF !important;
-    }
-    
-    /* Fix footer text */
-    .footer-text {
-        color: #CCCCCC !important;
-        text-align: center;
-        padding: 2rem;
-    }
-</style>
-""", unsafe_allow_html=True)
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # --- App Header ---
 st.markdown("""
@@ -166,65 +257,149 @@ with col4:
 # --- Main Content Area ---
 st.write("---")
 
+import history  # noqa: E402 -- SQLite only, cheap enough for the first render
+
+if history.ENABLED:
+    with st.sidebar:
+        history_panel()
+    if st.session_state.get("history_entry") is not None:
+        show_history_entry(st.session_state["history_entry"])
+
 # --- Image Upload Section ---
-uploaded_file = st.file_uploader(
+uploaded_files = st.file_uploader(
     "📤 **Choose an image to get started...**",
     type=["jpg", "jpeg", "png"],
-    help="Upload JPG, JPEG, or PNG files (max 200MB)"
-)
+    accept_multiple_files=True,
+    help="Upload JPG, JPEG, or PNG files (max 200MB). Upload several to create one package for a carousel post."
+) or []
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
 
 # --- Main Logic ---
-if uploaded_file is not None:
+if len(uploaded_files) > 1:
+    # Carousel mode: every image is analyzed and one package written in a single request
+    carousel_id = tuple(getattr(f, "file_id", None) or (f.name, f.size) for f in uploaded_files)
+    carousel = st.session_state.get("carousel")
+    if carousel is not None and carousel["id"] != carousel_id:
+        carousel = None
+
+    # Pick up the results of a background job that finished since the last run
+    carousel_job = st.session_state.get("carousel_job")
+    if carousel_job is not None and carousel_job["id"] != carousel_id:
+        carousel_job = st.session_state["carousel_job"] = None
+    if carousel_job is not None:
+        from jobs import QUEUED, RUNNING, get_job_queue
+
+        job = get_job_queue().status(carousel_job["job_id"])
+        if job is None or job["status"] not in (QUEUED, RUNNING):
+            carousel_job = st.session_state["carousel_job"] = None
+            result = (job or {}).get("result") or {}
+            if job is None:
+                st.error("❌ The carousel job has expired. Please try again.")
+            elif job["error"] is not None or "error" in result:
+                st.error(f"❌ Carousel Analysis Failed: {job['error'] or result['error']}")
+            else:
+                carousel = st.session_state["carousel"] = dict(result, id=carousel_id)
+
+    st.markdown('<div class="content-section">', unsafe_allow_html=True)
+    st.markdown(f"### 🎠 Carousel of {len(uploaded_files)} images")
+    previews = st.session_state.get("carousel_previews")
+    if previews is None or previews["id"] != carousel_id:
+        from vision import ingest_image
+
+        previews = st.session_state["carousel_previews"] = {
+            "id": carousel_id,
+            "images": [ingest_image(f.getvalue()).preview for f in uploaded_files],
+        }
+    st.image(previews["images"], caption=[f"{number}. {f.name}" for number, f in enumerate(uploaded_files, 1)], width=180)
+
+    button_label = "🔄 Regenerate Carousel Package" if carousel else "🚀 Generate Carousel Package"
+    if st.button(button_label, type="primary", use_container_width=True, disabled=carousel_job is not None):
+        from jobs import get_job_queue
+        from pipeline import run_carousel_job
+
+        job_id = get_job_queue().submit(
+            run_carousel_job, [f.getvalue() for f in uploaded_files], session=session_id()
+        )
+        carousel_job = st.session_state["carousel_job"] = {"id": carousel_id, "job_id": job_id}
+
+    if carousel_job is not None:
+        job_progress(carousel_job["job_id"])
+    st.markdown('</div>', unsafe_allow_html=True)
+
+    if carousel is not None:
+        st.write("---")
+        st.markdown('<div class="content-section">', unsafe_allow_html=True)
+        tab1, tab2 = st.tabs(["📝 Content Package", "🔍 Carousel Analysis"])
+
+        with tab1:
+            st.markdown("### ✨ Your AI-Generated Carousel Content")
+            st.markdown(carousel["content_package"])
+
+        with tab2:
+            st.markdown("### 🔍 AI Carousel Analysis")
+            st.markdown(f"**The set as a whole:** {carousel['summary']}")
+            for number, (image_file, description) in enumerate(zip(uploaded_files, carousel["descriptions"]), 1):
+                with st.expander(f"🖼️ Image {number}: {image_file.name}"):
+                    st.markdown(description)
+
+        st.markdown('</div>', unsafe_allow_html=True)
+
+elif uploaded_file is not None:
+    upload = get_upload_entry(uploaded_file)
+
     # Create two columns for better layout
     col1, col2 = st.columns([1, 1])
 
     with col1:
         st.markdown('<div class="content-section">', unsafe_allow_html=True)
-        image = Image.open(uploaded_file)
-        st.image(image, caption="Your Uploaded Image", use_column_width=True)
+        st.image(upload["preview"], caption="Your Uploaded Image", use_container_width=True)
 
         # Image info
         st.write(f"**File name:** {uploaded_file.name}")
         st.write(f"**File size:** {uploaded_file.size / 1024:.1f} KB")
-        st.write(f"**Image dimensions:** {image.size[0]} x {image.size[1]}")
+        st.write(f"**Image dimensions:** {upload['width']} x {upload['height']}")
         st.markdown('</div>', unsafe_allow_html=True)
 
     with col2:
         st.markdown('<div class="content-section">', unsafe_allow_html=True)
 
         # Processing section
-        if st.button("🚀 Generate Content Package", type="primary", use_container_width=True):
-            # Progress bar
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-
-            # Step 1: Analyze the image
-            status_text.text("🔍 Analyzing your image...")
-            progress_bar.progress(25)
-            time.sleep(1)
-
-            description = analyze_image(uploaded_file)
-
-            if description.startswith("Error"):
-                st.error(f"❌ Image Analysis Failed: {description}")
-            else:
-                progress_bar.progress(50)
-                status_text.text("🎨 Generating creative content...")
-                time.sleep(1)
-
-                # Step 2: Generate content based on the description
-                content_package = generate_content(description)
-
-                if content_package.startswith("Error"):
-                    st.error(f"❌ Content Generation Failed: {content_package}")
+        fused_mode = st.toggle(
+            "⚡ Single-request mode",
+            help="Analyze the image and write the content package in one API call instead of two"
+        )
+        structured_mode = st.toggle(
+            "🧩 Editable sections",
+            disabled=fused_mode,
+            help="Generate the package as separate sections so individual ones can be regenerated later"
+        )
+
+        # Pick up the results of a background job that finished since the last run
+        job = None
+        if upload["job_id"] is not None:
+            from jobs import QUEUED, RUNNING, get_job_queue
+
+            job = get_job_queue().status(upload["job_id"])
+            if job is None or job["status"] not in (QUEUED, RUNNING):
+                upload["job_id"] = None
+                result = (job or {}).get("result") or {}
+                if job is None:
+                    st.error("❌ The generation job has expired. Please try again.")
+                elif job["error"] is not None:
+                    st.error(f"❌ Content Generation Failed: {job['error']}")
+                elif result.get("stage") == "analysis":
+                    st.error(f"❌ Image Analysis Failed: {result['error']}")
+                elif "error" in result:
+                    st.error(f"❌ Content Generation Failed: {result['error']}")
                 else:
-                    progress_bar.progress(100)
-                    status_text.text("✅ Content package ready!")
-                    time.sleep(1)
-
-                    # Clear progress indicators
-                    progress_bar.empty()
-                    status_text.empty()
+                    upload["description"] = result["description"]
+                    upload["content_package"] = result["content_package"]
+                    upload["package"] = result["package"]
+                    upload["breakdown"] = result["breakdown"]
+                    upload["model"] = result["model"]
+                    upload["usage"] = result["usage"]
+                    upload["history_id"] = result["history_id"]
+                    upload["restored_at"] = None
 
                     # Success message
                     st.markdown("""
@@ -233,10 +408,34 @@ if uploaded_file is not None:
                     </div>
                     """, unsafe_allow_html=True)
 
+        if upload["restored_at"]:
+            st.info(f"📚 Restored from your history ({time.strftime('%d %b %Y %H:%M', time.localtime(upload['restored_at']))})"
+                    " - regenerate for a fresh take.")
+
+        # Results survive reruns, so generating again is an explicit action
+        has_results = upload["content_package"] is not None
+        button_label = "🔄 Regenerate Content Package" if has_results else "🚀 Generate Content Package"
+
+        if st.button(button_label, type="primary", use_container_width=True, disabled=upload["job_id"] is not None):
+            from jobs import get_job_queue
+            from pipeline import run_package_job
+
+            # Runs on a worker thread, so the work carries on through reruns and closed tabs
+            upload["job_id"] = get_job_queue().submit(
+                run_package_job, uploaded_file.getvalue(), fused=fused_mode, structured=structured_mode,
+                session=session_id(), filename=uploaded_file.name
+            )
+
+        if upload["job_id"] is not None:
+            job_progress(upload["job_id"])
+
         st.markdown('</div>', unsafe_allow_html=True)
 
     # Results section (full width)
-    if 'content_package' in locals() and not content_package.startswith("Error"):
+    if upload["content_package"] is not None:
+        description = upload["description"]
+        content_package = upload["content_package"]
+
         st.write("---")
         st.markdown('<div class="content-section">', unsafe_allow_html=True)
 
@@ -246,6 +445,28 @@ if uploaded_file is not None:
 
         with tab1:
             st.markdown("### ✨ Your AI-Generated Content")
+
+            # Packages generated as sections can have just some of them rewritten
+            if upload["package"] is not None:
+                from content_package import LABELS
+                from language import generate_package
+                from usage import session_scope
+
+                with st.form("regenerate_sections"):
+                    selected = st.multiselect("Sections to regenerate", list(LABELS), format_func=LABELS.get)
+                    if st.form_submit_button("🔁 Regenerate selected sections") and selected:
+                        with st.spinner("Rewriting the selected sections..."), session_scope(session_id()):
+                            package = generate_package(description, selected)
+                        if isinstance(package, str):
+                            st.error(f"❌ Section Regeneration Failed: {package}")
+                        else:
+                            upload["package"] = package
+                            upload["content_package"] = content_package = package.to_markdown()
+                            if upload["history_id"] is not None:
+                                from history import get_history
+
+                                get_history().update(upload["history_id"], content_package, package)
+
             st.markdown(content_package)
 
             # Copy button simulation
@@ -256,6 +477,28 @@ if uploaded_file is not None:
             st.markdown("### 🔍 AI Image Analysis")
             st.markdown(f"**Image Description:** {description}")
 
+            breakdown = upload.get("breakdown")
+            if breakdown and breakdown["timings"]:
+                with st.expander("⏱️ Timing breakdown"):
+                    st.table({
+                        "Stage": list(breakdown["timings"]),
+                        "Seconds": [f"{seconds:.3f}" for seconds in breakdown["timings"].values()],
+                    })
+                    if breakdown["counters"]:
+                        st.write(", ".join(f"**{name}:** {count}" for name, count in breakdown["counters"].items()))
+
+            package_usage = upload.get("usage")
+            if package_usage and package_usage["calls"]:
+                st.caption(f"🤖 Written by {upload['model']}: {package_usage['total_tokens']:,} tokens in"
+                           f" {len(package_usage['calls'])} calls (about ${package_usage['cost']:.4f})")
+
+            from usage import get_ledger, today
+
+            totals = get_ledger().totals(day=today(), session=session_id())
+            if totals["calls"]:
+                st.caption(f"🧮 This session today: {totals['total_tokens']:,} tokens in {totals['calls']} calls"
+                           f" (about ${totals['cost']:.4f})")
+
         with tab3:
             st.markdown("### 💡 How to Use Your Content Package")
             st.markdown("""
@@ -301,3 +544,6 @@ st.markdown("""
     <p><small>Upload images responsibly and ensure you have the right to use them in your social media posts.</small></p>
 </div>
 """, unsafe_allow_html=True)
+
+# Started after the page is laid out so background imports don't slow the first render
+start_services()
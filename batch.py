@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from pipeline import is_error, run_pipeline
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def find_images(source):
+    """
+    Lists image paths from a directory (recursively) or a manifest file with
+    one path per line, relative paths being resolved against the manifest.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files
+                         if name.lower().endswith(IMAGE_EXTENSIONS))
+        return sorted(paths)
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding="utf-8") as manifest:
+        return [os.path.join(base, line.strip()) for line in manifest
+                if line.strip() and not line.startswith("#")]
+
+
+def load_checkpoint(path):
+    """
+    Returns the set of image paths already finished in an earlier run.
+    """
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as checkpoint:
+        return {line.rstrip("\n") for line in checkpoint if line.strip()}
+
+
+def process_image(path, fused=False):
+    """
+    Runs the pipeline for one image file and returns its output record.
+    """
+    record = {"image": path}
+    start = time.perf_counter()
+    try:
+        with open(path, "rb") as image_file:
+            description, content_package = run_pipeline(image_file, fused=fused)
+        if is_error(description) or is_error(content_package):
+            record["error"] = description if is_error(description) else content_package
+        else:
+            record["description"] = description
+            record["content_package"] = content_package
+    except OSError as e:
+        record["error"] = f"Error reading image: {str(e)}"
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def run_batch(paths, output_path, checkpoint_path=None, workers=4, fused=False, skip_errors=False):
+    """
+    Processes images with a bounded worker pool, appending one JSON line per
+    image to `output_path` as results arrive. Successful images are recorded
+    in the checkpoint file, so an interrupted run resumes without redoing them
+    and failed ones are retried; with `skip_errors` failed images are recorded
+    too and not retried. Returns (succeeded, failed).
+    """
+    done = load_checkpoint(checkpoint_path)
+    todo = [path for path in paths if path not in done]
+    succeeded = failed = 0
+
+    with open(output_path, "a", encoding="utf-8") as output, \
+            open(checkpoint_path or os.devnull, "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=workers) as pool:
+
+        # Keep only a bounded number of images queued so huge directories stay cheap
+        pending = set()
+        queue = iter(todo)
+        try:
+            while True:
+                for path in queue:
+                    pending.add(pool.submit(process_image, path, fused))
+                    if len(pending) >= workers * 2:
+                        break
+                if not pending:
+                    break
+
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record = future.result()
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                    if "error" not in record or skip_errors:
+                        checkpoint.write(record["image"] + "\n")
+                        checkpoint.flush()
+                    if "error" in record:
+                        failed += 1
+                    else:
+                        succeeded += 1
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            raise
+
+    return succeeded, failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate content packages for a directory of images.")
+    parser.add_argument("source", help="Image directory or manifest file (one path per line)")
+    parser.add_argument("-o", "--output", default="packages.jsonl", help="JSONL file to append results to")
+    parser.add_argument("--checkpoint", help="File of finished images (default: <output>.done)")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="Concurrent images in flight")
+    parser.add_argument("--fused", action="store_true", help="Use one request per image instead of two")
+    parser.add_argument("--skip-errors", action="store_true", help="Don't retry failed images on the next run")
+    args = parser.parse_args()
+
+    images = find_images(args.source)
+    checkpoint_file = args.checkpoint or args.output + ".done"
+    print(f"🗂️  {len(images)} images found, {len(load_checkpoint(checkpoint_file))} already done")
+
+    start_time = time.perf_counter()
+    try:
+        ok, errors = run_batch(images, args.output, checkpoint_file, args.workers, args.fused, args.skip_errors)
+    except KeyboardInterrupt:
+        print("\n⏸️  Interrupted - rerun the same command to resume")
+        sys.exit(130)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"✅ {ok} succeeded, ❌ {errors} failed in {elapsed:.1f}s "
+          f"({(ok + errors) / elapsed if elapsed else 0:.2f} images/s)")
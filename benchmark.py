@@ -0,0 +1,1086 @@
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from PIL import Image
+
+import batch
+import cache
+import content_package
+import gemini_client
+import history
+import image_features
+import image_index
+import jobs
+import language
+import pipeline
+import usage
+import vision
+from circuit_breaker import BreakerRegistry
+from mock_server import MockGeminiServer, make_text
+from model_stats import ModelStats, percentile
+from pipeline import analyze_and_generate_carousel, is_error, run_pipeline
+from rate_limiter import RateLimiter
+
+PAYLOAD = {"contents": [{"parts": [{"text": "Hello"}]}]}
+
+# Cold-start budgets in seconds; the run exits non-zero when the startup scenario exceeds them
+STARTUP_IMPORT_BUDGET = float(os.getenv("BENCH_STARTUP_IMPORT_BUDGET", "0.75"))
+STARTUP_RENDER_BUDGET = float(os.getenv("BENCH_STARTUP_RENDER_BUDGET", "1.0"))
+
+
+def _run_sessions(send, sessions, calls_per_session):
+    """Runs `sessions` concurrent workers that each make `calls_per_session` calls."""
+    url = gemini_client.model_url("gemini-2.0-flash")
+
+    def session_worker(_):
+        for _ in range(calls_per_session):
+            send(url, json=PAYLOAD, timeout=30).json()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        list(pool.map(session_worker, range(sessions)))
+    return time.perf_counter() - start
+
+
+def bench_connections(sessions=8, calls_per_session=6, latency=0.01):
+    """
+    Compares one-off requests.post calls with the shared pooled session
+    under concurrent sessions, counting the TCP connections the server accepts.
+    """
+    results = {}
+    with MockGeminiServer(latency=latency) as server:
+        gemini_client.API_BASE = server.base_url
+
+        for name, send in (("unpooled", requests.post), ("pooled", gemini_client.post)):
+            server.reset_stats()
+            elapsed = _run_sessions(send, sessions, calls_per_session)
+            results[name] = {
+                "seconds": round(elapsed, 4),
+                "requests": server.stats["requests"],
+                "connections": server.stats["connections"],
+            }
+
+    results["handshakes_saved"] = results["unpooled"]["connections"] - results["pooled"]["connections"]
+    return results
+
+
+def make_corpus(long_edges=(640, 1280, 2048, 4032, 6000), formats=("JPEG", "PNG")):
+    """
+    Builds a fixed corpus of synthetic photos (gradients plus noise) as
+    in-memory files, returning a list of (name, file) pairs.
+    """
+    corpus = []
+    for long_edge in long_edges:
+        size = (long_edge, long_edge * 3 // 4)
+        gradient = Image.linear_gradient("L").resize(size)
+        noise = Image.effect_noise(size, 40)
+        image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.FLIP_LEFT_RIGHT)))
+        for image_format in formats:
+            image_file = io.BytesIO()
+            image.save(image_file, format=image_format, quality=92)
+            image_file.seek(0)
+            corpus.append((f"{size[0]}x{size[1]}.{image_format.lower()}", image_file))
+    return corpus
+
+
+def _legacy_encode(image_file):
+    """The pre-preprocessing behaviour: full-resolution PNG or JPEG q85 re-save."""
+    image_file.seek(0)
+    image = Image.open(image_file)
+    byte_arr = io.BytesIO()
+    if image.format == "PNG":
+        image.save(byte_arr, format="PNG")
+        return byte_arr.getvalue(), "image/png"
+    image.convert("RGB").save(byte_arr, format="JPEG", quality=85)
+    return byte_arr.getvalue(), "image/jpeg"
+
+
+def bench_preprocess():
+    """
+    Compares base64 payload bytes and encode time of the legacy full-resolution
+    re-save with vision.prepare_image across the image corpus.
+    """
+    results = {}
+    for name, image_file in make_corpus():
+        row = {"original_bytes": len(image_file.getvalue())}
+        for label, encode in (("legacy", _legacy_encode), ("prepared", vision.prepare_image)):
+            start = time.perf_counter()
+            image_bytes, mime_type = encode(image_file)
+            payload = base64.b64encode(image_bytes)
+            row[label] = {
+                "seconds": round(time.perf_counter() - start, 4),
+                "payload_bytes": len(payload),
+                "mime_type": mime_type,
+            }
+        results[name] = row
+    return results
+
+
+def _legacy_ingest(image_bytes):
+    """
+    The pre-ingestion behaviour: a full-resolution decode for st.image (which
+    re-encodes it for the browser), then a second decode to prepare and hash it.
+    """
+    image = Image.open(io.BytesIO(image_bytes))
+    image.load()
+    shown = io.BytesIO()
+    image.convert("RGB").save(shown, format="JPEG", quality=100)
+    vision.prepare_image(io.BytesIO(image_bytes))
+    hashed = Image.open(io.BytesIO(image_bytes))
+    if hashed.format == "JPEG":
+        hashed.draft("L", (64, 64))
+    image_index.dhash(hashed)
+    return shown.tell()
+
+
+def bench_ingest():
+    """
+    Compares decode work and bytes sent to the browser for one upload: the
+    legacy double decode with a full-resolution preview against
+    vision.ingest_image, and against a repeat ingest served from its cache.
+    """
+    results = {}
+    for name, image_file in make_corpus():
+        image_bytes = image_file.getvalue()
+        row = {"original_bytes": len(image_bytes)}
+
+        start = time.perf_counter()
+        preview_bytes = _legacy_ingest(image_bytes)
+        row["legacy"] = {"seconds": round(time.perf_counter() - start, 4), "preview_bytes": preview_bytes}
+
+        vision._ingested.clear()
+        start = time.perf_counter()
+        ingested = vision.ingest_image(image_bytes)
+        row["ingest"] = {"seconds": round(time.perf_counter() - start, 4), "preview_bytes": len(ingested.preview)}
+
+        start = time.perf_counter()
+        vision.ingest_image(image_bytes)
+        row["reuse_seconds"] = round(time.perf_counter() - start, 4)
+        results[name] = row
+    return results
+
+
+def bench_features(latency=0.2, word_delay=0.004, repeats=20):
+    """
+    Local feature extraction time per image (on the preview-sized image that
+    ingest_image measures) against the upstream time it saves: each image is
+    analyzed with features off and on, against a mock that fills the whole
+    output budget at `word_delay` seconds per token.
+    """
+    corpus = make_corpus(long_edges=(640, 2048, 6000), formats=("JPEG",))
+    results = {"extraction": {}}
+    for name, image_file in corpus:
+        image = Image.open(image_file)
+        exif = image.getexif()
+        image = image.convert("RGB")
+        image.thumbnail((vision.PREVIEW_EDGE, vision.PREVIEW_EDGE))
+        start = time.perf_counter()
+        for _ in range(repeats):
+            image_features.extract_features(image, exif=exif)
+        results["extraction"][name] = round((time.perf_counter() - start) / repeats, 5)
+
+    images = [image_file.getvalue() for _, image_file in corpus]
+    enabled = vision.IMAGE_FEATURES
+    with MockGeminiServer(latency=latency, word_delay=word_delay, response_text=make_text(2000)) as server:
+        gemini_client.API_BASE = server.base_url
+        cache._analysis_cache = cache.AnalysisCache(memory_entries=0)
+        image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+        try:
+            for label, flag in (("model_only", False), ("with_features", True)):
+                vision.IMAGE_FEATURES = flag
+                _, generation_config = vision.analysis_request(vision.ingest_image(images[0]))
+                start = time.perf_counter()
+                for data in images:
+                    vision.analyze_image(io.BytesIO(data))
+                results[label] = {
+                    "seconds_per_image": round((time.perf_counter() - start) / len(images), 4),
+                    "max_output_tokens": generation_config["maxOutputTokens"],
+                }
+        finally:
+            vision.IMAGE_FEATURES = enabled
+            cache._analysis_cache = None
+            image_index._image_index = None
+
+    results["saved_seconds_per_image"] = round(
+        results["model_only"]["seconds_per_image"] - results["with_features"]["seconds_per_image"], 4)
+    results["extraction_seconds_max"] = max(results["extraction"].values())
+    return results
+
+
+def bench_stream(latency=0.2, chunks=16, chunk_delay=0.05):
+    """
+    Compares time-to-first-token and total time of the blocking and the
+    streaming content generation paths against the SSE stand-in.
+    """
+    text = " ".join(f"word{i}" for i in range(400))
+    results = {}
+    with MockGeminiServer(latency=latency, response_text=text,
+                          stream_chunks=chunks, chunk_delay=chunk_delay) as server:
+        gemini_client.API_BASE = server.base_url
+
+        start = time.perf_counter()
+        blocking_text = language.generate_content("A mock image")
+        blocking_seconds = time.perf_counter() - start
+        results["blocking"] = {"first_token_seconds": round(blocking_seconds, 4),
+                               "total_seconds": round(blocking_seconds, 4)}
+
+        start = time.perf_counter()
+        first_token = None
+        streamed = []
+        for chunk in language.generate_content_stream("A mock image"):
+            if first_token is None:
+                first_token = time.perf_counter() - start
+            streamed.append(chunk)
+        results["streaming"] = {"first_token_seconds": round(first_token, 4),
+                                "total_seconds": round(time.perf_counter() - start, 4),
+                                "chunks": len(streamed)}
+
+    results["matches_blocking"] = "".join(streamed) == blocking_text == text
+    return results
+
+
+def _latency_summary(latencies):
+    return {
+        "p50": round(percentile(latencies, 0.5), 4),
+        "p95": round(percentile(latencies, 0.95), 4),
+        "p99": round(percentile(latencies, 0.99), 4),
+    }
+
+
+def bench_hedge(calls=200, slow_fraction=0.04, seed=7):
+    """
+    Compares sequential and hedged fallback when the primary model has a slow
+    tail (`slow_fraction` of its calls take 2 s) and the secondary is steady.
+    """
+    rng = random.Random(seed)
+    model_latency = {
+        "gemini-2.0-flash": lambda: 2.0 if rng.random() < slow_fraction else 0.05,
+        "gemini-2.5-flash": 0.15,
+    }
+    results = {}
+    default_delay = gemini_client.HEDGE_DEFAULT_DELAY
+    with MockGeminiServer(model_latency=model_latency) as server:
+        gemini_client.API_BASE = server.base_url
+        # Hedge early while there is no history yet, as a warmed-up process would
+        gemini_client.HEDGE_DEFAULT_DELAY = gemini_client.HEDGE_MIN_DELAY
+
+        try:
+            for name, hedge in (("sequential", False), ("hedged", True)):
+                gemini_client.model_stats = ModelStats()
+                server.reset_stats()
+                latencies = []
+                for _ in range(calls):
+                    start = time.perf_counter()
+                    gemini_client.generate(PAYLOAD, hedge=hedge)
+                    latencies.append(time.perf_counter() - start)
+                results[name] = dict(_latency_summary(latencies), upstream_requests=server.stats["requests"])
+        finally:
+            gemini_client.HEDGE_DEFAULT_DELAY = default_delay
+            gemini_client.model_stats = ModelStats()
+
+    return results
+
+
+def bench_batch(images=48, worker_counts=(1, 2, 4, 8, 16), latency=0.1):
+    """
+    Measures batch.run_batch throughput at increasing concurrency.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        paths = []
+        for index, (name, image_file) in enumerate(make_corpus(long_edges=(640,), formats=("JPEG",)) * images):
+            path = os.path.join(workdir, f"{index}-{name}")
+            with open(path, "wb") as out:
+                out.write(image_file.getvalue())
+            paths.append(path)
+
+        results = {}
+        with MockGeminiServer(latency=latency) as server:
+            gemini_client.API_BASE = server.base_url
+            for workers in worker_counts:
+                # Every image is identical, so bypass the analysis cache and the near-duplicate index
+                cache._analysis_cache = cache.AnalysisCache()
+                image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+                output = os.path.join(workdir, f"out-{workers}.jsonl")
+                start = time.perf_counter()
+                succeeded, failed = batch.run_batch(paths, output, workers=workers)
+                elapsed = time.perf_counter() - start
+                cache._analysis_cache = None
+                image_index._image_index = None
+                results[f"workers_{workers}"] = {
+                    "images_per_second": round(len(paths) / elapsed, 2),
+                    "succeeded": succeeded,
+                    "failed": failed,
+                }
+    return results
+
+
+def bench_retry(calls=100, error_rate=0.3, requests_per_minute=1200):
+    """
+    Sends `calls` concurrent requests at a server that rejects `error_rate`
+    of them with 429, with and without backoff-and-retry, under a shared
+    requests-per-minute limit. Reports successes and wall time.
+    """
+    results = {}
+    retry_deadline = gemini_client.RETRY_DEADLINE
+    with MockGeminiServer(latency=0.02, error_rate=error_rate, seed=1) as server:
+        gemini_client.API_BASE = server.base_url
+        try:
+            for name, deadline in (("no_retry", 0.0), ("retry", retry_deadline)):
+                gemini_client.RETRY_DEADLINE = deadline
+                gemini_client.rate_limiter = RateLimiter(requests_per_minute=requests_per_minute)
+                server.reset_stats()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=16) as pool:
+                    texts = list(pool.map(lambda _: gemini_client.generate(PAYLOAD), range(calls)))
+                results[name] = {
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "succeeded": sum(1 for text in texts if not text.startswith("Error")),
+                    "upstream_requests": server.stats["requests"],
+                    "upstream_errors": server.stats["errors"],
+                }
+        finally:
+            gemini_client.RETRY_DEADLINE = retry_deadline
+            gemini_client.rate_limiter = RateLimiter()
+    return results
+
+
+def bench_breaker(calls=20, latency=0.2):
+    """
+    Calls generate repeatedly while the primary model answers 404, with the
+    circuit breakers remembering that and with them reset before every call.
+    Latency stats are reset before every call so model ordering stays fixed.
+    """
+    results = {}
+    with MockGeminiServer(latency=latency, unavailable_models=[gemini_client.MODELS[0]]) as server:
+        gemini_client.API_BASE = server.base_url
+        try:
+            for name, remember in (("without_breaker", False), ("with_breaker", True)):
+                gemini_client.breakers = BreakerRegistry()
+                server.reset_stats()
+                start = time.perf_counter()
+                for _ in range(calls):
+                    gemini_client.model_stats = ModelStats()
+                    if not remember:
+                        gemini_client.breakers = BreakerRegistry()
+                    gemini_client.generate(PAYLOAD)
+                results[name] = {
+                    "mean_seconds": round((time.perf_counter() - start) / calls, 4),
+                    "upstream_requests": server.stats["requests"],
+                }
+            results["breakers"] = gemini_client.breakers.snapshot()
+        finally:
+            gemini_client.breakers = BreakerRegistry()
+            gemini_client.model_stats = ModelStats()
+    return results
+
+
+def _measure(run, items, workers):
+    """
+    Runs `run` over `items` with `workers` threads and summarises latencies,
+    throughput and how many results were errors.
+    """
+    latencies = []
+    errors = 0
+
+    def timed(item):
+        start = time.perf_counter()
+        result = run(item)
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for result in pool.map(timed, items):
+            texts = result if isinstance(result, tuple) else (result,)
+            errors += any(is_error(text) for text in texts)
+    elapsed = time.perf_counter() - start
+
+    return dict(_latency_summary(latencies),
+                mean=round(statistics.mean(latencies), 4),
+                throughput_per_second=round(len(items) / elapsed, 2),
+                calls=len(items),
+                errors=errors)
+
+
+def bench_pipeline(rounds=3, workers=4, latency=0.05, error_rate=0.0, response_words=600):
+    """
+    End-to-end run of analyze_image, generate_content and the two-step and
+    fused pipelines over the image corpus against the mock server. Reports
+    latency percentiles, throughput and the request bytes the server received.
+    The analysis cache and near-duplicate index are bypassed so every call
+    reaches the server.
+    """
+    corpus = make_corpus(long_edges=(640, 1280, 2048, 4032), formats=("JPEG", "PNG"))
+    images = [image_file.getvalue() for _, image_file in corpus] * rounds
+    description = "A mock description of a bright, colourful street scene at dusk."
+
+    stages = {
+        "analyze_image": (lambda data: vision.analyze_image(io.BytesIO(data)), images),
+        "generate_content": (language.generate_content, [description] * len(images)),
+        "pipeline_two_step": (lambda data: run_pipeline(io.BytesIO(data)), images),
+        "pipeline_fused": (lambda data: run_pipeline(io.BytesIO(data), fused=True), images),
+    }
+
+    results = {}
+    with MockGeminiServer(latency=latency, error_rate=error_rate, retry_after=0, seed=1,
+                          response_text=make_text(response_words)) as server:
+        gemini_client.API_BASE = server.base_url
+        cache._analysis_cache = cache.AnalysisCache(memory_entries=0)
+        image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+        try:
+            for name, (run, items) in stages.items():
+                server.reset_stats()
+                results[name] = _measure(run, items, workers)
+                results[name]["upstream_requests"] = server.stats["requests"]
+                results[name]["request_bytes"] = server.stats["bytes_received"]
+        finally:
+            cache._analysis_cache = None
+            image_index._image_index = None
+    return results
+
+
+def bench_metrics(iterations=200000):
+    """
+    Cost per span and counter call with metrics disabled, enabled, and
+    inside a per-request collector.
+    """
+    import metrics
+
+    def run():
+        start = time.perf_counter()
+        for _ in range(iterations):
+            with metrics.span("bench.stage"):
+                pass
+            metrics.incr("bench.counter")
+        return round((time.perf_counter() - start) / iterations * 1e9, 1)
+
+    enabled = metrics.ENABLED
+    results = {}
+    try:
+        metrics.ENABLED = False
+        results["disabled_ns_per_call"] = run()
+        with metrics.collect():
+            results["collecting_ns_per_call"] = run()
+        metrics.ENABLED = True
+        results["enabled_ns_per_call"] = run()
+    finally:
+        metrics.ENABLED = enabled
+    return results
+
+
+def bench_transport(sizes_mb=(1, 4, 16)):
+    """
+    Peak memory allocated while building and sending one request, beyond the
+    prepared image itself, for inline base64 versus the Files API upload.
+    """
+    import tracemalloc
+
+    results = {}
+    with MockGeminiServer() as server:
+        gemini_client.API_BASE = server.base_url
+        cache._upload_cache = cache.AnalysisCache()
+        try:
+            for size_mb in sizes_mb:
+                image_bytes = os.urandom(size_mb * 1024 * 1024)
+                row = {}
+                for transport in ("inline", "file"):
+                    cache._upload_cache.clear()
+                    tracemalloc.start()
+                    payload = gemini_client.build_payload(
+                        [{"text": "Describe"}, vision.image_part(image_bytes, "image/jpeg", transport)],
+                        vision.GENERATION_CONFIG
+                    )
+                    gemini_client.generate(payload)
+                    del payload
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    row[f"{transport}_peak_mb"] = round(peak / (1024 * 1024), 2)
+                results[f"{size_mb}mb"] = row
+        finally:
+            cache._upload_cache = None
+    return results
+
+
+def bench_sections(rounds=5, word_delay=0.01):
+    """
+    Structured packages: generating the whole package versus regenerating a
+    single section with the rest taken from cache. The mock server's response
+    time grows with the number of words it returns.
+    """
+    description = "A golden retriever catching a frisbee on a beach at sunset"
+    results = {}
+    with MockGeminiServer(word_delay=word_delay) as server:
+        gemini_client.API_BASE = server.base_url
+        cache._package_cache = cache.AnalysisCache()
+        try:
+            for name, sections in (("full", None), ("one_section", ["niche_hashtags"])):
+                server.reset_stats()
+                latencies = []
+                for _ in range(rounds):
+                    start = time.perf_counter()
+                    package = language.generate_package(description, sections)
+                    latencies.append(time.perf_counter() - start)
+                    assert not isinstance(package, str), package
+                config = language.structured_config(sections or list(content_package.SECTIONS))
+                results[name] = {
+                    "mean_seconds": round(statistics.mean(latencies), 4),
+                    "max_output_tokens": config["maxOutputTokens"],
+                    "upstream_requests": server.stats["requests"],
+                }
+        finally:
+            cache._package_cache = None
+    return results
+
+
+def bench_usage(calls=40, latency=0.02, output_words=400, max_output_tokens=256):
+    """
+    Token accounting and budgets: the cost of recording usage and planning a
+    call, then `calls` calls preferring gemini-2.5-pro with no budget and with
+    a daily budget that covers about half of them. The mock's answers are
+    longer than the output budget, so every call is counted as truncated.
+    """
+    payload = gemini_client.build_payload([{"text": "Write a caption for a beach at sunset"}],
+                                          {"maxOutputTokens": max_output_tokens})
+    models = ["gemini-2.5-pro", "gemini-2.0-flash"]
+    sample = usage.Usage("gemini-2.0-flash", prompt_tokens=100, output_tokens=200, total_tokens=300)
+    saved = usage._ledger, usage.DAILY_TOKEN_BUDGET
+    results = {}
+    try:
+        usage._ledger = usage.UsageLedger()
+        usage.DAILY_TOKEN_BUDGET = 10 ** 9
+        rounds = 1000
+        start = time.perf_counter()
+        for _ in range(rounds):
+            usage.plan(models, 1000)
+            usage.record(sample)
+        results["plan_and_record_ms"] = round((time.perf_counter() - start) / rounds * 1000, 4)
+
+        with MockGeminiServer(latency=latency, response_text=make_text(output_words)) as server:
+            gemini_client.API_BASE = server.base_url
+            per_call = None
+            for name, budget in (("unbudgeted", 0), ("daily_budget", None)):
+                usage._ledger = usage.UsageLedger()
+                # Half the calls' worth of tokens, measured from the unbudgeted run
+                usage.DAILY_TOKEN_BUDGET = budget if budget is not None else per_call * calls // 2
+                gemini_client.model_stats = ModelStats()
+                server.reset_stats()
+                refused = 0
+                for _ in range(calls):
+                    result = gemini_client.generate_result(payload, models=models, hedge=False)
+                    refused += usage.is_budget_error(result.text)
+                totals = usage.get_ledger().totals()
+                per_call = per_call or totals["total_tokens"] // max(1, totals["calls"])
+                results[name] = {
+                    "budget_tokens": usage.DAILY_TOKEN_BUDGET,
+                    "upstream_requests": server.stats["requests"],
+                    "refused": refused,
+                    "calls_by_model": {model_name: row["calls"]
+                                       for model_name, row in usage.get_ledger().breakdown("model").items()},
+                    "total_tokens": totals["total_tokens"],
+                    "truncated": totals["truncated"],
+                    "cost_usd": round(totals["cost"], 6),
+                }
+    finally:
+        usage._ledger, usage.DAILY_TOKEN_BUDGET = saved
+        gemini_client.model_stats = ModelStats()
+    return results
+
+
+HASHTAG_DESCRIPTIONS = [
+    "A golden retriever puppy running on a sandy beach at sunset, waves crashing behind it.",
+    "A cozy cafe table with a latte art cappuccino, an open book and a croissant by a rainy window.",
+    "A bride and groom laughing under a flower arch at their outdoor wedding ceremony.",
+    "Neon signs and light trails on a busy downtown street at night after the rain.",
+    "A hiker standing on a mountain summit above the clouds with an alpine lake below.",
+]
+
+
+def bench_hashtags(rounds=1000, latency=0.2, word_delay=0.004):
+    """
+    The local hashtag index: build, cold load and lookup time, then markdown
+    content generation with model-written against locally filled hashtags,
+    against a mock that fills the whole output budget at `word_delay`
+    seconds per token.
+    """
+    import hashtags
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "hashtags.idx")
+        rows = hashtags.read_source()
+        start = time.perf_counter()
+        hashtags.build_index(rows, path)
+        results["build_seconds"] = round(time.perf_counter() - start, 4)
+        results["index_bytes"] = os.path.getsize(path)
+        results["tags"] = len(rows)
+
+        start = time.perf_counter()
+        index = hashtags.HashtagIndex(path)
+        results["load_seconds"] = round(time.perf_counter() - start, 6)
+
+        start = time.perf_counter()
+        for round_number in range(rounds):
+            index.suggest(HASHTAG_DESCRIPTIONS[round_number % len(HASHTAG_DESCRIPTIONS)])
+        results["suggest_microseconds"] = round((time.perf_counter() - start) / rounds * 1e6, 1)
+        del index
+
+    with MockGeminiServer(latency=latency, word_delay=word_delay, response_text=make_text(3000)) as server:
+        gemini_client.API_BASE = server.base_url
+        for label, local in (("model_hashtags", False), ("local_hashtags", True)):
+            server.reset_stats()
+            start = time.perf_counter()
+            for description in HASHTAG_DESCRIPTIONS:
+                text = language.generate_content(description, local_hashtags=local)
+                assert not is_error(text), text
+            config = language.LOCAL_HASHTAGS_GENERATION_CONFIG if local else language.GENERATION_CONFIG
+            results[label] = {
+                "seconds_per_package": round((time.perf_counter() - start) / len(HASHTAG_DESCRIPTIONS), 4),
+                "prompt_chars": len(language.build_content_prompt(HASHTAG_DESCRIPTIONS[0], local)),
+                "max_output_tokens": config["maxOutputTokens"],
+            }
+    return results
+
+
+def _burst_shots(shots, seed=3):
+    """
+    Yields JPEG files of `shots` distinct scenes, each followed by a
+    re-compressed copy and a slight re-crop.
+    """
+    rng = random.Random(seed)
+    for _ in range(shots):
+        noise = Image.effect_noise((80, 60), rng.randint(30, 80)).convert("RGB")
+        scene = Image.merge("RGB", [noise.getchannel(0).rotate(rng.randint(0, 359))] * 3).resize((1600, 1200))
+        for variant, quality in ((scene, 92), (scene, 60), (scene.crop((16, 12, 1590, 1190)), 85)):
+            image_file = io.BytesIO()
+            variant.save(image_file, format="JPEG", quality=quality)
+            image_file.seek(0)
+            yield image_file
+
+
+def bench_similar(index_entries=200000, lookups=2000, shots=10, seed=5):
+    """
+    Near-duplicate index: lookup time with `index_entries` hashes stored, and
+    upstream requests for burst shots (original, re-compressed, re-cropped)
+    with the index off and on.
+    """
+    rng = random.Random(seed)
+    index = image_index.PerceptualIndex(threshold=image_index.SIMILARITY_THRESHOLD)
+    stored = [rng.getrandbits(64) for _ in range(index_entries)]
+    start = time.perf_counter()
+    for value in stored:
+        index.add(value, "description")
+    insert_seconds = time.perf_counter() - start
+
+    queries = [rng.choice(stored) ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for _ in range(lookups)]
+    start = time.perf_counter()
+    found = sum(index.find(query) is not None for query in queries)
+    results = {
+        "index_entries": index_entries,
+        "insert_us": round(insert_seconds / index_entries * 1e6, 1),
+        "lookup_us": round((time.perf_counter() - start) / lookups * 1e6, 1),
+        "lookup_recall": found / lookups,
+    }
+
+    images = [image_file.getvalue() for image_file in _burst_shots(shots)]
+    with MockGeminiServer() as server:
+        gemini_client.API_BASE = server.base_url
+        try:
+            for name, threshold in (("index_off", -1), ("index_on", image_index.SIMILARITY_THRESHOLD)):
+                cache._analysis_cache = cache.AnalysisCache()
+                image_index._image_index = image_index.PerceptualIndex(threshold=threshold)
+                server.reset_stats()
+                for data in images:
+                    vision.analyze_image(io.BytesIO(data))
+                results[name] = {"images": len(images), "upstream_requests": server.stats["requests"]}
+        finally:
+            cache._analysis_cache = None
+            image_index._image_index = None
+    return results
+
+
+def bench_coalesce(callers=32, latency=0.2):
+    """
+    A spike of identical requests arriving together: upstream requests and
+    latency when `callers` threads analyze the same image and generate from
+    the same description at once.
+    """
+    image_file = make_corpus(long_edges=(640,), formats=("JPEG",))[0][1]
+    data = image_file.getvalue()
+    description = "A mock description of a bright, colourful street scene at dusk."
+    stages = {
+        "analyze_image": lambda: vision.analyze_image(io.BytesIO(data)),
+        "generate_content": lambda: language.generate_content(description),
+    }
+
+    results = {}
+    with MockGeminiServer(latency=latency) as server:
+        gemini_client.API_BASE = server.base_url
+        try:
+            for name, run in stages.items():
+                cache._analysis_cache = cache.AnalysisCache()
+                image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+                server.reset_stats()
+                barrier = threading.Barrier(callers)
+
+                def call(_):
+                    barrier.wait()
+                    return run()
+
+                results[name] = _measure(call, range(callers), callers)
+                results[name]["upstream_requests"] = server.stats["requests"]
+        finally:
+            cache._analysis_cache = None
+            image_index._image_index = None
+    return results
+
+
+def bench_carousel(images=4, latency=0.2):
+    """
+    A carousel post of `images` photos: the two-step pipeline per image
+    (2N requests) versus one multimodal request for the whole set.
+    """
+    corpus = make_corpus(long_edges=(640, 1280, 2048, 4032), formats=("JPEG",))[:images]
+    files = [image_file.getvalue() for _, image_file in corpus]
+    runs = {
+        "per_image": lambda: [run_pipeline(io.BytesIO(data)) for data in files],
+        "carousel": lambda: analyze_and_generate_carousel([io.BytesIO(data) for data in files]),
+    }
+
+    results = {}
+    with MockGeminiServer(latency=latency) as server:
+        gemini_client.API_BASE = server.base_url
+        cache._analysis_cache = cache.AnalysisCache()
+        image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+        try:
+            for name, run in runs.items():
+                server.reset_stats()
+                start = time.perf_counter()
+                run()
+                results[name] = {
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "upstream_requests": server.stats["requests"],
+                    "request_bytes": server.stats["bytes_received"],
+                }
+        finally:
+            cache._analysis_cache = None
+            image_index._image_index = None
+    return results
+
+
+def bench_jobs(submissions=32, worker_counts=(1, 4, 8), latency=0.1):
+    """
+    Background job queue: time for `submissions` upload jobs, submitted at
+    once as many sessions would, to finish at each worker pool size.
+    """
+    data = make_corpus(long_edges=(640,), formats=("JPEG",))[0][1].getvalue()
+    results = {}
+    with MockGeminiServer(latency=latency) as server:
+        gemini_client.API_BASE = server.base_url
+        try:
+            for workers in worker_counts:
+                cache._analysis_cache = cache.AnalysisCache()
+                image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+                queue = jobs.JobQueue(workers=workers)
+                start = time.perf_counter()
+                # A trailing byte makes each upload distinct, so each job analyses its own image
+                job_ids = [queue.submit(pipeline.run_package_job, data + bytes([index])) for index in range(submissions)]
+                while any(queue.status(job_id)["status"] in (jobs.QUEUED, jobs.RUNNING) for job_id in job_ids):
+                    time.sleep(0.01)
+                elapsed = time.perf_counter() - start
+                failed = sum("error" in (queue.status(job_id)["result"] or {"error": True}) for job_id in job_ids)
+                results[f"workers_{workers}"] = {
+                    "seconds": round(elapsed, 3),
+                    "jobs_per_second": round(submissions / elapsed, 2),
+                    "failed": failed,
+                }
+        finally:
+            cache._analysis_cache = None
+            image_index._image_index = None
+    return results
+
+
+def bench_api(requests_total=64, clients=16, batch_size=16, latency=0.1, concurrency=8):
+    """
+    Load test of the HTTP API against the mock upstream: single-image
+    requests from `clients` concurrent clients, then one batch request.
+    """
+    import api_server
+
+    files = [image_file.getvalue() for _, image_file in make_corpus(long_edges=(640, 1280), formats=("JPEG",))]
+    results = {}
+    with MockGeminiServer(latency=latency) as server:
+        gemini_client.API_BASE = server.base_url
+        cache._analysis_cache = cache.AnalysisCache()
+        image_index._image_index = image_index.PerceptualIndex(threshold=-1)
+        base_url, stop = api_server.serve_in_background(concurrency=concurrency)
+        try:
+            with requests.Session() as session:
+                def post_one(index):
+                    # A trailing byte makes every upload distinct so none is answered from cache
+                    image = files[index % len(files)] + index.to_bytes(4, "big")
+                    response = session.post(f"{base_url}/v1/packages",
+                                            files={"image": (f"{index}.jpg", image, "image/jpeg")})
+                    return "" if response.ok else "Error"
+
+                server.reset_stats()
+                results["single"] = _measure(post_one, range(requests_total), clients)
+                results["single"]["upstream_requests"] = server.stats["requests"]
+
+                batch = [("image", (f"{index}.jpg", files[index % len(files)] + b"b" + index.to_bytes(4, "big"),
+                                    "image/jpeg")) for index in range(batch_size)]
+                start = time.perf_counter()
+                response = session.post(f"{base_url}/v1/packages/batch", files=batch)
+                results["batch"] = {
+                    "images": batch_size,
+                    "seconds": round(time.perf_counter() - start, 3),
+                    "errors": sum("error" in record for record in response.json()["results"]),
+                }
+        finally:
+            stop()
+            cache._analysis_cache = None
+            image_index._image_index = None
+    return results
+
+
+_IMPORT_PROBE = """
+import sys, time
+start = time.perf_counter()
+for name in sys.argv[1:]:
+    __import__(name)
+print(time.perf_counter() - start)
+"""
+
+_RENDER_PROBE = """
+import sys, time
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file(sys.argv[1], default_timeout=60)
+app.secrets["GOOGLE_API_KEY"] = "mock-key"
+start = time.perf_counter()
+app.run()
+assert not app.exception, app.exception
+print(time.perf_counter() - start)
+"""
+
+
+def _probe(script, *args):
+    result = subprocess.run([sys.executable, "-c", script, *args], capture_output=True, text=True,
+                            check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(runs=5):
+    """
+    Cold-start cost of the Streamlit app, each run in a fresh interpreter:
+    the imports app.py needs before its first render, everything it used to
+    import eagerly, and the time to render the first page.
+    """
+    app_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+    app_imports = [_probe(_IMPORT_PROBE, "streamlit") for _ in range(runs)]
+    eager_imports = [_probe(_IMPORT_PROBE, "streamlit", "PIL.Image", "requests", "dotenv", "pipeline")
+                     for _ in range(runs)]
+    renders = [_probe(_RENDER_PROBE, app_path) for _ in range(runs)]
+
+    results = {
+        "app_import_seconds": round(statistics.median(app_imports), 3),
+        "eager_import_seconds": round(statistics.median(eager_imports), 3),
+        "first_render_seconds": round(statistics.median(renders), 3),
+        "import_budget_seconds": STARTUP_IMPORT_BUDGET,
+        "render_budget_seconds": STARTUP_RENDER_BUDGET,
+    }
+    results["within_budget"] = (results["app_import_seconds"] <= STARTUP_IMPORT_BUDGET
+                                and results["first_render_seconds"] <= STARTUP_RENDER_BUDGET)
+    return results
+
+
+def bench_history(entries=5000, rounds=200):
+    """
+    The content-package history: adding entries, restoring an image's
+    package, the newest and the oldest page by keyset against the same page
+    by OFFSET, and full-text search, over `entries` packages on disk.
+    """
+    rng = random.Random(7)
+    words = " ".join(HASHTAG_DESCRIPTIONS).lower().replace(",", "").replace(".", "").split()
+    [(_, image_file)] = make_corpus(long_edges=(800,), formats=("JPEG",))
+    thumbnail = history.make_thumbnail(image_file.getvalue())
+
+    def timed(run, count=rounds):
+        start = time.perf_counter()
+        for _ in range(count):
+            run()
+        return round((time.perf_counter() - start) / count * 1000, 4)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "history.sqlite3")
+        store = history.HistoryStore(path, max_entries=entries)
+        packages = []
+        for index in range(entries):
+            package = content_package.ContentPackage(
+                *(" ".join(rng.choices(words, k=12)) for _ in range(4)),
+                *([f"#{word}" for word in rng.sample(words, 5)] for _ in range(3)),
+                "calm", "travellers", "evenings", ["post at sunset"],
+            )
+            packages.append((f"{index:064x}", " ".join(rng.choices(words, k=40)), package))
+
+        start = time.perf_counter()
+        for image_hash, description, package in packages:
+            store.add(image_hash, description, package.to_markdown(), package, thumbnail=thumbnail,
+                      timings={"step.analyze": 1.2, "step.generate": 3.4}, filename="photo.jpg")
+        add_ms = (time.perf_counter() - start) / entries * 1000
+
+        db = store._db
+        columns = ", ".join(history.COLUMNS)
+        results = {
+            "entries": entries,
+            "thumbnail_bytes": len(thumbnail),
+            "database_bytes": os.path.getsize(path),
+            "add_ms": round(add_ms, 4),
+            "restore_ms": timed(lambda: store.latest_for_image(packages[rng.randrange(entries)][0])),
+            "first_page_ms": timed(lambda: store.page()),
+            "last_page_keyset_ms": timed(lambda: store.page(before=history.PAGE_SIZE + 1)),
+            "last_page_offset_ms": timed(lambda: db.execute(
+                f"SELECT {columns} FROM entries ORDER BY id DESC LIMIT ? OFFSET ?",
+                (history.PAGE_SIZE, entries - history.PAGE_SIZE)
+            ).fetchall()),
+            "search_ms": timed(lambda: store.page("sunset beach")),
+            "search_matches": len(store.page("sunset beach", limit=entries)[0]),
+        }
+    return results
+
+
+SCENARIOS = {
+    "connections": bench_connections,
+    "preprocess": bench_preprocess,
+    "ingest": bench_ingest,
+    "features": bench_features,
+    "stream": bench_stream,
+    "hedge": bench_hedge,
+    "batch": bench_batch,
+    "retry": bench_retry,
+    "breaker": bench_breaker,
+    "pipeline": bench_pipeline,
+    "metrics": bench_metrics,
+    "transport": bench_transport,
+    "sections": bench_sections,
+    "hashtags": bench_hashtags,
+    "usage": bench_usage,
+    "history": bench_history,
+    "similar": bench_similar,
+    "coalesce": bench_coalesce,
+    "carousel": bench_carousel,
+    "jobs": bench_jobs,
+    "api": bench_api,
+    "startup": bench_startup,
+}
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB. Scenarios are run
+    in their own process (see run_isolated), so this is the scenario's peak.
+    """
+    import resource  # Unix only
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_isolated(name):
+    """
+    Runs one scenario in a fresh interpreter and returns its results with
+    its own peak RSS, which in a shared process would be the peak of the
+    heaviest scenario run before it.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output = os.path.join(temp_dir, f"{name}.json")
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), name, "--scenario-output", output],
+                                   stdout=subprocess.DEVNULL)
+        if completed.returncode != 0:
+            raise RuntimeError(f"Scenario {name} failed with exit code {completed.returncode}")
+        with open(output, encoding="utf-8") as results:
+            return json.load(results)
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, path=""):
+    """
+    Yields (path, baseline, current, ratio) for every numeric value in both reports.
+    """
+    for key, value in report.items():
+        if key not in baseline or key == "meta":
+            continue
+        old = baseline[key]
+        if isinstance(value, dict) and isinstance(old, dict):
+            yield from compare(value, old, f"{path}{key}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) \
+                and not isinstance(value, bool):
+            yield f"{path}{key}", old, value, (value / old if old else None)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks against a local mock Gemini server.")
+    parser.add_argument("scenarios", nargs="*", metavar="scenario",
+                        help=f"Scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("-o", "--output", help="Also write the JSON report to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Print changes against an earlier JSON report")
+    # Used by run_isolated: run the one scenario given in this process and write its results here
+    parser.add_argument("--scenario-output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    # Only the local mock server is called, so any key will do
+    for module in (gemini_client, vision, language):
+        module.API_KEY = module.API_KEY or "mock-key"
+
+    if args.scenario_output:
+        [name] = args.scenarios
+        results = SCENARIOS[name]()
+        results["peak_rss_mb"] = peak_rss_mb()
+        with open(args.scenario_output, "w", encoding="utf-8") as out:
+            json.dump(results, out)
+        sys.exit(0)
+
+    report = {"meta": {"commit": git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "python": platform.python_version()}}
+    for name in args.scenarios or SCENARIOS:
+        report[name] = run_isolated(name)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(report, out, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"\n📊 Compared with {baseline.get('meta', {}).get('commit') or args.compare}:")
+        for path, old, new, ratio in compare(report, baseline):
+            change = f"{(ratio - 1) * 100:+.1f}%" if ratio is not None else "n/a"
+            print(f"   {path}: {old} -> {new} ({change})")
+
+    over_budget = [name for name, results in report.items() if results.get("within_budget") is False]
+    if over_budget:
+        print(f"\n❌ Over budget: {', '.join(over_budget)}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Set GEMINI_CACHE_DIR to an empty string to keep the cache in memory only
+CACHE_DIR = os.getenv("GEMINI_CACHE_DIR", ".cache")
+MEMORY_ENTRIES = int(os.getenv("GEMINI_CACHE_MEMORY_ENTRIES", "256"))
+DISK_ENTRIES = int(os.getenv("GEMINI_CACHE_DISK_ENTRIES", "10000"))
+TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL", str(7 * 24 * 3600)))
+# Uploaded files expire after 48 hours; forget them a little earlier
+UPLOAD_TTL_SECONDS = 46 * 3600
+
+
+def content_hash(data):
+    """
+    Hex SHA-256 of raw bytes, used to recognise repeat images.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def make_key(image_bytes, prompt, config):
+    """
+    Builds a content-addressed cache key from the normalized image bytes,
+    the prompt and the generation config.
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(prompt.encode("utf-8"))
+    digest.update(json.dumps(config, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def upload_key(image_bytes, api_base, api_key):
+    """
+    Builds the key of an uploaded file from the image bytes and the API base
+    and key it was uploaded with, since files can't be used from another key.
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(f"{api_base}\n{api_key}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Two-tier cache: a bounded in-memory LRU in front of a SQLite table with
+    entry-count eviction. Entries in either tier expire after `ttl` seconds.
+    Values are strings.
+    """
+
+    def __init__(self, path=None, memory_entries=MEMORY_ENTRIES,
+                 disk_entries=DISK_ENTRIES, ttl=TTL_SECONDS):
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "sets": 0, "evictions": 0}
+
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+                " created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+            self._db.commit()
+
+    def get(self, key):
+        with self._lock:
+            now = time.time()
+            if key in self._memory:
+                value, created_at = self._memory[key]
+                if created_at > now - self.ttl:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM entries WHERE key = ? AND created_at > ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self._stats["disk_hits"] += 1
+                    return row[0]
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            now = time.time()
+            self._remember(key, value, now)
+            self._stats["sets"] += 1
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now)
+                )
+                self._evict_disk(now)
+                self._db.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+            stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+            stats["memory_size"] = len(self._memory)
+            if self._db is not None:
+                stats["disk_size"] = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.commit()
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = value, created_at
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        expired = self._db.execute("DELETE FROM entries WHERE created_at <= ?", (now - self.ttl,)).rowcount
+        overflow = self._db.execute(
+            "DELETE FROM entries WHERE key IN ("
+            " SELECT key FROM entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,)
+        ).rowcount
+        self._stats["evictions"] += expired + overflow
+
+
+_analysis_cache = None
+_caches_lock = threading.Lock()
+
+
+def get_analysis_cache():
+    """
+    Returns the process-wide cache for image analyses.
+    """
+    global _analysis_cache
+    if _analysis_cache is None:
+        with _caches_lock:
+            if _analysis_cache is None:
+                path = os.path.join(CACHE_DIR, "analyses.sqlite3") if CACHE_DIR else None
+                _analysis_cache = AnalysisCache(path=path)
+    return _analysis_cache
+
+
+_upload_cache = None
+
+
+def get_upload_cache():
+    """
+    Returns the process-wide map of image content hash to uploaded file URI.
+    """
+    global _upload_cache
+    if _upload_cache is None:
+        with _caches_lock:
+            if _upload_cache is None:
+                path = os.path.join(CACHE_DIR, "uploads.sqlite3") if CACHE_DIR else None
+                _upload_cache = AnalysisCache(path=path, ttl=UPLOAD_TTL_SECONDS)
+    return _upload_cache
+
+
+_package_cache = None
+
+
+def get_package_cache():
+    """
+    Returns the process-wide cache of structured content packages, keyed by
+    image description, used to keep sections that are not regenerated.
+    """
+    global _package_cache
+    if _package_cache is None:
+        with _caches_lock:
+            if _package_cache is None:
+                path = os.path.join(CACHE_DIR, "packages.sqlite3") if CACHE_DIR else None
+                _package_cache = AnalysisCache(path=path)
+    return _package_cache
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Consecutive soft failures (timeouts, 5xx) before a model's circuit opens
+FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURES", "3"))
+# Seconds an open circuit waits before letting a trial request through
+COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "300"))
+# Seconds a half-open circuit waits for its trial request to report back before admitting another
+TRIAL_TIMEOUT = float(os.getenv("GEMINI_BREAKER_TRIAL_TIMEOUT", "60"))
+
+
+class CircuitBreaker:
+    """
+    Availability state of one model. Soft failures open the circuit after
+    `failure_threshold` in a row; hard failures (model not found) open it
+    at once. After `cooldown` seconds a single trial request is let through
+    (half-open) and the others are turned away until its outcome closes or
+    re-opens the circuit, or `trial_timeout` passes without one.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, trial_timeout=TRIAL_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+        self.last_error = None
+
+    def allow(self, now):
+        if self.state == OPEN and now - self.opened_at >= self.cooldown:
+            self.state = HALF_OPEN
+        if self.state != HALF_OPEN:
+            return self.state == CLOSED
+        if self.trial_started is not None and now - self.trial_started < self.trial_timeout:
+            return False
+        self.trial_started = now
+        return True
+
+    def release(self):
+        """
+        Ends a trial request that said nothing about the model, so another can be let through.
+        """
+        self.trial_started = None
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_started = None
+        self.last_error = None
+
+    def record_failure(self, now, error, hard=False):
+        self.failures += 1
+        self.last_error = error
+        self.trial_started = None
+        if hard or self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = now
+
+
+class BreakerRegistry:
+    """
+    Thread-safe collection of per-model circuit breakers.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN, trial_timeout=TRIAL_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.trial_timeout = trial_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def _get(self, model_name):
+        breaker = self._breakers.get(model_name)
+        if breaker is None:
+            breaker = self._breakers[model_name] = CircuitBreaker(
+                self.failure_threshold, self.cooldown, self.trial_timeout
+            )
+        return breaker
+
+    def available(self, models):
+        """
+        Returns the models whose circuits let a request through, in order.
+        A half-open model is returned to one caller at a time.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return [model_name for model_name in models if self._get(model_name).allow(now)]
+
+    def release(self, model_name):
+        with self._lock:
+            breaker = self._breakers.get(model_name)
+            if breaker is not None:
+                breaker.release()
+
+    def record_success(self, model_name):
+        with self._lock:
+            self._get(model_name).record_success()
+
+    def record_failure(self, model_name, error, hard=False):
+        with self._lock:
+            self._get(model_name).record_failure(time.monotonic(), error, hard)
+
+    def snapshot(self):
+        """
+        Returns each model's state, failure count, last error and seconds until retry.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model_name: {
+                    "state": breaker.state,
+                    "failures": breaker.failures,
+                    "last_error": breaker.last_error,
+                    "retry_in": round(max(0.0, breaker.opened_at + breaker.cooldown - now), 1)
+                    if breaker.state == OPEN else 0.0,
+                }
+                for model_name, breaker in self._breakers.items()
+            }
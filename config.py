@@ -0,0 +1,7 @@
+import os
+from dotenv import load_dotenv
+
+# Read .env once per process; other modules import their settings from here
+load_dotenv()
+
+API_KEY = os.getenv("GOOGLE_API_KEY")
@@ -0,0 +1,39 @@
+import pytest
+
+import cache
+import gemini_client
+import image_index
+import language
+import usage
+import vision
+from circuit_breaker import BreakerRegistry
+from mock_server import MockGeminiServer
+from model_stats import ModelStats
+
+
+@pytest.fixture
+def mock_gemini(monkeypatch):
+    """
+    Returns a function that starts a MockGeminiServer with the given options
+    and points the clients at it. Every test gets a fake key, in-memory
+    caches, an empty usage ledger and fresh model statistics.
+    """
+    servers = []
+
+    def start(**options):
+        server = MockGeminiServer(**options).start()
+        servers.append(server)
+        monkeypatch.setattr(gemini_client, "API_BASE", server.base_url)
+        return server
+
+    for module in (gemini_client, vision, language):
+        monkeypatch.setattr(module, "API_KEY", "mock-key")
+    for name in ("_analysis_cache", "_upload_cache", "_package_cache"):
+        monkeypatch.setattr(cache, name, cache.AnalysisCache())
+    monkeypatch.setattr(usage, "_ledger", usage.UsageLedger())
+    monkeypatch.setattr(gemini_client, "model_stats", ModelStats())
+    monkeypatch.setattr(gemini_client, "breakers", BreakerRegistry())
+    monkeypatch.setattr(image_index, "_image_index", image_index.PerceptualIndex(threshold=-1))
+    yield start
+    for server in servers:
+        server.stop()
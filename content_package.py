@@ -0,0 +1,144 @@
+import json
+from dataclasses import asdict, dataclass, fields, replace
+
+# Sections of a structured content package and what the model is asked for in each
+SECTIONS = {
+    "witty_caption": "A clever, humorous caption that might include wordplay or a fun observation",
+    "inspirational_caption": "An uplifting, motivational caption that inspires the audience",
+    "professional_caption": "A polished caption suitable for business or professional contexts",
+    "casual_caption": "A friendly, relaxed caption like you're talking to a close friend",
+    "trending_hashtags": "5 popular, high-volume hashtags",
+    "niche_hashtags": "5 specific, relevant hashtags for targeted engagement",
+    "community_hashtags": "5 community or brand-specific hashtags",
+    "mood": "The emotional tone and atmosphere of the image",
+    "target_audience": "Who would most engage with this content",
+    "posting_times": "Optimal times to post this type of content",
+    "engagement_tips": "2-3 specific tips to increase engagement for this post",
+}
+# Sections returned as lists of strings; the rest are single strings
+LIST_SECTIONS = ("trending_hashtags", "niche_hashtags", "community_hashtags", "engagement_tips")
+HASHTAG_SECTIONS = ("trending_hashtags", "niche_hashtags", "community_hashtags")
+
+# Display labels, also used by the app's section picker
+LABELS = {
+    "witty_caption": "😄 Witty Caption",
+    "inspirational_caption": "✨ Inspirational Caption",
+    "professional_caption": "👔 Professional Caption",
+    "casual_caption": "😊 Casual Caption",
+    "trending_hashtags": "Trending Hashtags (High Reach)",
+    "niche_hashtags": "Niche Hashtags (Targeted Audience)",
+    "community_hashtags": "Branded/Community Hashtags",
+    "mood": "🎭 Mood Analysis",
+    "target_audience": "🎯 Target Audience",
+    "posting_times": "⏰ Best Posting Times",
+    "engagement_tips": "💡 Engagement Tips",
+}
+
+
+@dataclass
+class ContentPackage:
+    """
+    A content package with one field per section. Render it with to_markdown().
+    """
+    witty_caption: str
+    inspirational_caption: str
+    professional_caption: str
+    casual_caption: str
+    trending_hashtags: list
+    niche_hashtags: list
+    community_hashtags: list
+    mood: str
+    target_audience: str
+    posting_times: str
+    engagement_tips: list
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**parse_sections(data, [field.name for field in fields(cls)]))
+
+    def to_dict(self):
+        return asdict(self)
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    def with_sections(self, sections):
+        """
+        Returns a copy with the given {section: value} pairs replaced.
+        """
+        return replace(self, **sections)
+
+    def to_markdown(self):
+        """
+        Renders the package in the same layout as the free-form markdown mode.
+        """
+        def caption(name):
+            return f"### {LABELS[name]}\n{getattr(self, name)}"
+
+        def hashtags(name):
+            return f"### {LABELS[name]}\n{' '.join(getattr(self, name))}"
+
+        tips = "\n".join(f"- {tip}" for tip in self.engagement_tips)
+        return "\n\n".join([
+            "## 🎨 Caption Variations",
+            caption("witty_caption"),
+            caption("inspirational_caption"),
+            caption("professional_caption"),
+            caption("casual_caption"),
+            "## #️⃣ Hashtag Recommendations",
+            hashtags("trending_hashtags"),
+            hashtags("niche_hashtags"),
+            hashtags("community_hashtags"),
+            "## 📊 Content Insights",
+            caption("mood"),
+            caption("target_audience"),
+            caption("posting_times"),
+            f"### {LABELS['engagement_tips']}\n{tips}",
+        ])
+
+
+def response_schema(sections):
+    """
+    Returns the responseSchema for a JSON object holding the given sections.
+    """
+    return {
+        "type": "OBJECT",
+        "properties": {
+            name: {"type": "ARRAY", "items": {"type": "STRING"}} if name in LIST_SECTIONS else {"type": "STRING"}
+            for name in sections
+        },
+        "required": list(sections),
+        "propertyOrdering": list(sections),
+    }
+
+
+def _hashtag(tag):
+    tag = "".join(tag.split())
+    return tag if tag.startswith("#") else f"#{tag}"
+
+
+def parse_sections(data, sections):
+    """
+    Validates a decoded JSON object (or JSON text) and returns the requested
+    sections. Raises ValueError when one is missing or has the wrong type.
+    """
+    if isinstance(data, str):
+        data = json.loads(data)
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+
+    parsed = {}
+    for name in sections:
+        value = data.get(name)
+        if name in LIST_SECTIONS:
+            if not isinstance(value, list) or not value or not all(isinstance(item, str) for item in value):
+                raise ValueError(f"section {name!r} must be a non-empty list of strings")
+            value = [item.strip() for item in value if item.strip()]
+            if name in HASHTAG_SECTIONS:
+                value = [_hashtag(tag) for tag in value]
+        elif not isinstance(value, str) or not value.strip():
+            raise ValueError(f"section {name!r} must be a non-empty string")
+        else:
+            value = value.strip()
+        parsed[name] = value
+    return parsed
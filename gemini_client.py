@@ -0,0 +1,666 @@
+import json
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+import config
+import metrics
+import usage
+from circuit_breaker import BreakerRegistry
+from model_stats import ModelStats
+from rate_limiter import RateLimiter, estimate_tokens
+
+API_KEY = config.API_KEY
+
+# Point this at a local stand-in (see mock_server.py) for benchmarks
+API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+
+# Number of host pools to keep and connections kept alive per host
+POOL_CONNECTIONS = int(os.getenv("GEMINI_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.getenv("GEMINI_POOL_MAXSIZE", "16"))
+
+# Hedged mode: race the next model once the current one is slower than this percentile
+HEDGE = os.getenv("GEMINI_HEDGE", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("GEMINI_HEDGE_PERCENTILE", "0.9"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY", "8"))
+HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "0.5"))
+HEDGE_WORKERS = int(os.getenv("GEMINI_HEDGE_WORKERS", "16"))
+
+# 429/503 responses are retried with jittered exponential backoff within this many seconds
+RETRY_DEADLINE = float(os.getenv("GEMINI_RETRY_DEADLINE", "20"))
+RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "8"))
+RETRY_STATUSES = (429, 503)
+# Quota and permission errors concern the whole key, not the model that answered
+KEY_STATUSES = (403,) + RETRY_STATUSES
+
+# A request referencing uploaded files gets one of these once a file has
+# expired or if it was uploaded with another key
+FILE_ERROR_STATUSES = (400, 403, 404)
+FILE_ERROR = "Error: An uploaded image could not be used"
+# Last chunk of a stream that broke after yielding text
+STREAM_CUT_OFF = "Error: The response was cut off"
+
+# Rolling latency/error history that decides which model is tried first
+model_stats = ModelStats()
+
+# Shared request and token quota for every caller in this process
+rate_limiter = RateLimiter()
+
+# Per-model availability; models with an open circuit are skipped until their cool-down ends
+breakers = BreakerRegistry()
+# Probe every model in the background at app start to seed the breakers
+PROBE_ON_START = os.getenv("GEMINI_PROBE_ON_START", "0") == "1"
+
+_session = None
+_session_lock = threading.Lock()
+_warm_up_started = False
+_probe_started = False
+_hedge_pool = None
+
+
+def get_session():
+    """
+    Returns the process-wide requests session with keep-alive connection pooling.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=POOL_CONNECTIONS,
+                    pool_maxsize=POOL_MAXSIZE,
+                    pool_block=False
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                session.headers.update({"Content-Type": "application/json"})
+                _session = session
+    return _session
+
+
+def upload_file(file_obj, size, mime_type, display_name=None, timeout=60):
+    """
+    Uploads image bytes through the Files API resumable-upload protocol and
+    returns the file URI to reference in a request. `file_obj` is streamed
+    to the server in blocks, so no extra copies of the data are made.
+    Raises requests.exceptions.RequestException on failure.
+    """
+    session = get_session()
+    start = session.post(
+        f"{API_BASE}/upload/v1beta/files?key={API_KEY}",
+        json={"file": {"display_name": display_name or "image"}},
+        headers={
+            "X-Goog-Upload-Protocol": "resumable",
+            "X-Goog-Upload-Command": "start",
+            "X-Goog-Upload-Header-Content-Length": str(size),
+            "X-Goog-Upload-Header-Content-Type": mime_type,
+        },
+        timeout=timeout
+    )
+    start.raise_for_status()
+    upload_url = start.headers.get("X-Goog-Upload-URL")
+    if not upload_url:
+        raise requests.exceptions.RequestException("Upload session was not created")
+
+    with metrics.span("api.upload"):
+        finish = session.post(
+            upload_url,
+            data=file_obj,
+            headers={
+                "Content-Type": mime_type,
+                "Content-Length": str(size),
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize",
+            },
+            timeout=timeout
+        )
+    finish.raise_for_status()
+    uploaded = finish.json()["file"]
+
+    # Images are normally usable at once; wait briefly if still processing
+    for _ in range(10):
+        if uploaded.get("state", "ACTIVE") != "PROCESSING":
+            break
+        time.sleep(0.5)
+        status = session.get(f"{API_BASE}/v1beta/{uploaded['name']}?key={API_KEY}", timeout=timeout)
+        status.raise_for_status()
+        uploaded = status.json()
+    if uploaded.get("state", "ACTIVE") != "ACTIVE":
+        raise requests.exceptions.RequestException(f"Uploaded file is {uploaded.get('state')}")
+
+    metrics.incr("api.uploads")
+    return uploaded["uri"]
+
+
+def model_url(model_name, method="generateContent"):
+    """
+    Builds the endpoint URL for a model method.
+    """
+    return f"{API_BASE}/v1beta/models/{model_name}:{method}?key={API_KEY}"
+
+
+def post(url, **kwargs):
+    """
+    Sends a POST request through the shared pooled session.
+    """
+    return get_session().post(url, **kwargs)
+
+
+def warm_up(connections=1, background=True):
+    """
+    Opens connections to the API host ahead of the first real request so the
+    TCP and TLS handshakes are already paid for. Only runs once per process.
+    """
+    global _warm_up_started
+    with _session_lock:
+        if _warm_up_started:
+            return
+        _warm_up_started = True
+
+    def _open_connection():
+        try:
+            # Any response keeps the connection in the pool; the status is irrelevant
+            get_session().head(API_BASE, timeout=5)
+        except requests.exceptions.RequestException:
+            pass
+
+    threads = [threading.Thread(target=_open_connection, daemon=True)
+               for _ in range(max(1, min(connections, POOL_MAXSIZE)))]
+    for thread in threads:
+        thread.start()
+    if not background:
+        for thread in threads:
+            thread.join()
+
+
+# Updated list to match the WORKING models from your test
+MODELS = [
+    "gemini-2.0-flash",
+    "gemini-2.5-flash",
+    "gemini-2.5-pro"
+]
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE"
+    }
+]
+
+
+def build_payload(parts, generation_config):
+    """
+    Builds a generateContent request body from content parts.
+    """
+    return {
+        "contents": [
+            {
+                "parts": parts
+            }
+        ],
+        "generationConfig": generation_config,
+        "safetySettings": SAFETY_SETTINGS
+    }
+
+
+def _error_for_status(status_code):
+    """
+    Returns the user-facing error for statuses that should stop the fallback,
+    or None if the next model should be tried.
+    """
+    if status_code == 403:
+        return f"Error: Access forbidden. Your API key may not have permission to use Generative Language API. Please check that your API key from Google AI Studio has proper permissions."
+    elif status_code == 503:
+        return f"Error: Google's Gemini API service is temporarily unavailable (503). This is usually temporary - please try again in a few minutes. The servers may be overloaded or under maintenance."
+    elif status_code == 429:
+        return f"Error: Rate limit exceeded. Please wait a moment before trying again."
+    return None
+
+
+def file_uris(payload):
+    """
+    Returns the URIs of the uploaded files a request body references.
+    """
+    return [
+        part["file_data"]["file_uri"]
+        for content in payload.get("contents", [])
+        for part in content.get("parts", [])
+        if "file_data" in part
+    ]
+
+
+def is_file_error(text):
+    return text.startswith(FILE_ERROR)
+
+
+def _all_models_failed(models):
+    return f"Error: All available Gemini models failed to respond. Please verify your API key is from Google AI Studio (ai.google.dev) and try again later. Models tried: {', '.join(models)}"
+
+
+def _candidate_text(result):
+    """
+    Returns the text of the first candidate in a response body, or None.
+    """
+    if 'candidates' in result and result['candidates']:
+        if 'content' in result['candidates'][0]:
+            parts = result['candidates'][0]['content'].get('parts', [])
+            return "".join(part.get('text', '') for part in parts)
+    return None
+
+
+@dataclass
+class GenerationResult:
+    """
+    The outcome of a generate call: the response text (or an error string),
+    the model that produced it and that call's token usage.
+    """
+    text: str
+    model: str = None
+    usage: "usage.Usage" = None
+
+    @property
+    def is_error(self):
+        return self.model is None
+
+
+def _max_output_tokens(payload):
+    return payload.get("generationConfig", {}).get("maxOutputTokens", 0)
+
+
+def _plan(models, payload):
+    """
+    Applies the token budgets to a call, counting its full output budget so
+    a call that could go over is refused before it is sent.
+    """
+    return usage.plan(models, estimate_tokens(payload) + _max_output_tokens(payload))
+
+
+def _retry_after(response):
+    """
+    Returns the delay requested by a Retry-After header in seconds, or None.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _send(url, payload, timeout, stream=False):
+    """
+    Posts a request through the rate limiter. 429 and 503 responses are retried
+    with jittered exponential backoff (or the server's Retry-After) until
+    RETRY_DEADLINE; the last response is returned if the deadline would be passed.
+    Returns None if the rate limiter cannot admit the request before the deadline.
+    """
+    deadline = time.monotonic() + RETRY_DEADLINE
+    tokens = estimate_tokens(payload)
+    # Serialize once, even if the request is retried
+    with metrics.span("api.serialize"):
+        body = json.dumps(payload)
+    attempt = 0
+
+    while True:
+        if not rate_limiter.acquire(tokens, deadline):
+            metrics.incr("api.rate_limited")
+            return None
+
+        with metrics.span("api.request"):
+            response = post(url, data=body, timeout=timeout, stream=stream)
+        if response.status_code not in RETRY_STATUSES:
+            return response
+
+        delay = _retry_after(response)
+        if delay is None:
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+        if time.monotonic() + delay > deadline:
+            return response
+
+        response.close()
+        metrics.incr("api.retries")
+        time.sleep(delay)
+        attempt += 1
+
+
+def _record_outcome(model_name, start, ok, status_code=None, error=None, neutral=False):
+    """
+    Feeds one call's outcome into the latency stats and the circuit breakers.
+    A 404 opens the model's circuit at once; timeouts, network errors and
+    server errors count towards opening it. Quota errors (429/503), 403 and
+    `neutral` outcomes (like refused files) say nothing about the model, so
+    they are left out of both; only a half-open circuit's trial is released.
+    """
+    if not ok and (neutral or status_code in KEY_STATUSES):
+        breakers.release(model_name)
+        return
+    model_stats.record(model_name, time.monotonic() - start, ok)
+    if ok:
+        breakers.record_success(model_name)
+    elif status_code == 404:
+        breakers.record_failure(model_name, "404 model not found", hard=True)
+    elif error is not None or (status_code and status_code >= 500):
+        breakers.record_failure(model_name, error or f"HTTP {status_code}")
+    else:
+        breakers.release(model_name)
+
+
+def _attempt(model_name, payload, timeout, session=None, calls=None):
+    """
+    Makes one generateContent call and records its latency, outcome and the
+    tokens it used against `session` and in `calls` (see usage.collect_calls). Returns ("ok", GenerationResult),
+    ("error", message) for errors that should stop the fallback, or
+    ("next", None) if another model should be tried. A request referencing
+    uploaded files that is refused with a FILE_ERROR_STATUSES status stops
+    with FILE_ERROR, since every model would refuse the same files.
+    """
+    start = time.monotonic()
+    outcome = ("next", None)
+    status_code = network_error = None
+    neutral = False
+    try:
+        response = _send(model_url(model_name), payload, timeout)
+
+        if response is None:
+            # Refused by the local rate limiter before reaching the model
+            outcome = ("error", _error_for_status(429))
+            neutral = True
+        else:
+            status_code = response.status_code
+            if status_code == 200:
+                with metrics.span("api.parse"):
+                    body = response.json()
+                    text = _candidate_text(body)
+                # Tokens are billed even when the response has no usable text
+                call_usage = usage.Usage.from_response(model_name, body, _max_output_tokens(payload))
+                usage.record(call_usage, session, calls)
+                if text is not None:
+                    outcome = ("ok", GenerationResult(text, model_name, call_usage))
+            elif status_code in FILE_ERROR_STATUSES and file_uris(payload):
+                outcome = ("error", f"{FILE_ERROR} (HTTP {status_code}).")
+                # The files are at fault, not the model
+                neutral = True
+            else:
+                error = _error_for_status(status_code)
+                if error:
+                    outcome = ("error", error)
+
+    except requests.exceptions.RequestException as e:
+        network_error = type(e).__name__  # Try next model
+    except ValueError:
+        pass  # Unparseable response; try next model
+
+    _record_outcome(model_name, start, outcome[0] == "ok", status_code, network_error, neutral)
+    return outcome
+
+
+def _candidate_models(models):
+    """
+    Orders models by recent performance and drops those with an open circuit.
+    If every circuit is open the full list is tried rather than failing outright.
+    """
+    models = model_stats.ordered(models or MODELS)
+    return breakers.available(models) or models
+
+
+def generate_result(payload, models=None, timeout=30, hedge=None):
+    """
+    Sends a generateContent request, falling back through `models` ordered by
+    their recent latency and error rate and limited by the token budgets (see
+    usage.plan). With `hedge` (default: GEMINI_HEDGE) the next model is tried
+    in parallel once the current one is slower than usual. Returns a
+    GenerationResult whose text starts with "Error" on failure.
+    """
+    if not API_KEY:
+        return GenerationResult("Error: GOOGLE_API_KEY is not set.")
+
+    models, error = _plan(_candidate_models(models), payload)
+    if error:
+        return GenerationResult(error)
+    if HEDGE if hedge is None else hedge:
+        return _generate_hedged(payload, models, timeout)
+
+    # Try each model until one works
+    for index, model_name in enumerate(models):
+        if index:
+            metrics.incr("api.fallbacks")
+        status, value = _attempt(model_name, payload, timeout)
+        if status == "ok":
+            return value
+        if status == "error":
+            return GenerationResult(value)
+
+    # If all models failed
+    return GenerationResult(_all_models_failed(models))
+
+
+def generate(payload, models=None, timeout=30, hedge=None):
+    """
+    Like generate_result, returning only the response text, or a string
+    starting with "Error" on failure.
+    """
+    return generate_result(payload, models, timeout, hedge).text
+
+
+def hedge_delay(model_name, timeout):
+    """
+    Seconds to wait on a model before hedging: its HEDGE_PERCENTILE latency,
+    or HEDGE_DEFAULT_DELAY until enough history exists.
+    """
+    delay = model_stats.latency_percentile(model_name, HEDGE_PERCENTILE)
+    if delay is None:
+        delay = HEDGE_DEFAULT_DELAY
+    return min(max(delay, HEDGE_MIN_DELAY), timeout)
+
+
+def _get_hedge_pool():
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _session_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="gemini-hedge")
+    return _hedge_pool
+
+
+def _generate_hedged(payload, models, timeout):
+    """
+    Races models: the next one is launched when the newest in-flight request
+    outlives its hedge delay or a request fails. The first valid response wins.
+    Losers that have not started are cancelled; in-flight ones are abandoned
+    and their results discarded, though their tokens are still recorded.
+    Returns a GenerationResult.
+    """
+    pool = _get_hedge_pool()
+    pending = {}
+    remaining = list(models)
+    stop_error = None
+    # Pool threads record usage and metrics for the caller's session and request
+    session = usage.current_session()
+    calls = usage.current_calls()
+    collector = metrics.current_collector()
+
+    def attempt(model_name):
+        with metrics.collector_scope(collector):
+            return _attempt(model_name, payload, timeout, session, calls)
+
+    def launch():
+        model_name = remaining.pop(0)
+        pending[pool.submit(attempt, model_name)] = model_name
+        # Deadline after which the next model is hedged in
+        return time.monotonic() + hedge_delay(model_name, timeout)
+
+    hedge_at = launch()
+    try:
+        while pending:
+            wait_for = max(0.0, hedge_at - time.monotonic()) if remaining and stop_error is None else None
+            done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                pending.pop(future)
+                status, value = future.result()
+                if status == "ok":
+                    return value
+                if status == "error" and stop_error is None:
+                    stop_error = value
+
+            # Either the newest request is slow (hedge) or one failed (move on)
+            if remaining and stop_error is None:
+                metrics.incr("api.hedges" if not done else "api.fallbacks")
+                hedge_at = launch()
+    finally:
+        for future in pending:
+            future.cancel()
+
+    return GenerationResult(stop_error or _all_models_failed(models))
+
+
+def _iter_sse_data(response):
+    """
+    Yields the decoded JSON of each server-sent event in a streaming response.
+    """
+    data_lines = []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            if line.startswith("data:"):
+                data_lines.append(line[5:].strip())
+            continue
+        if data_lines:
+            yield json.loads("\n".join(data_lines))
+            data_lines = []
+    if data_lines:
+        yield json.loads("\n".join(data_lines))
+
+
+def is_cut_off(text):
+    return text.startswith(STREAM_CUT_OFF)
+
+
+def stream_generate(payload, models=None, timeout=30):
+    """
+    Streams a response from the streamGenerateContent endpoint, yielding text chunks.
+
+    Models are tried in order until one starts producing text; once a chunk has
+    been yielded there is no further fallback, and a broken stream ends with a
+    chunk starting with STREAM_CUT_OFF (see is_cut_off). On failure a single
+    chunk starting with "Error" is yielded. The usage in the stream's last
+    event is recorded once it ends.
+    """
+    if not API_KEY:
+        yield "Error: GOOGLE_API_KEY is not set."
+        return
+
+    models, error = _plan(_candidate_models(models), payload)
+    if error:
+        yield error
+        return
+
+    for model_name in models:
+        url = model_url(model_name, "streamGenerateContent") + "&alt=sse"
+        start = time.monotonic()
+        started = False
+        last_usage = None
+
+        try:
+            response = _send(url, payload, timeout, stream=True)
+            if response is None:
+                _record_outcome(model_name, start, False, neutral=True)
+                yield _error_for_status(429)
+                return
+
+            with response:
+                if response.status_code != 200:
+                    _record_outcome(model_name, start, False, response.status_code)
+                    error = _error_for_status(response.status_code)
+                    if error:
+                        yield error
+                        return
+                    continue  # Try next model
+
+                for event in _iter_sse_data(response):
+                    if "usageMetadata" in event:
+                        last_usage = event
+                    text = _candidate_text(event)
+                    if text:
+                        if not started:
+                            # Time to first token is the latency that matters when streaming
+                            _record_outcome(model_name, start, True)
+                            started = True
+                        yield text
+
+        except (requests.exceptions.RequestException, ValueError) as e:
+            if not started:
+                _record_outcome(model_name, start, False, error=type(e).__name__)
+                continue  # Try next model
+            metrics.incr("api.stream_cut_off")
+            yield f"{STREAM_CUT_OFF} ({type(e).__name__}), so the text above is incomplete. Please try again."
+        finally:
+            # Each event carries the running totals, so the last one covers the whole stream
+            if last_usage is not None:
+                usage.record(usage.Usage.from_response(model_name, last_usage, _max_output_tokens(payload)))
+
+        if started:
+            return
+
+    yield _all_models_failed(models)
+
+
+def probe_models(models=None, timeout=10):
+    """
+    Sends a tiny prompt to every model in parallel, like test_api.py does by
+    hand, and seeds the circuit breakers with the results. Returns a dict of
+    model name to HTTP status code (None for network errors).
+    """
+    models = models or MODELS
+    payload = build_payload(
+        [{"text": "Hello, can you respond with just 'API is working'?"}],
+        {"maxOutputTokens": 8}
+    )
+
+    def probe(model_name):
+        start = time.monotonic()
+        try:
+            response = post(model_url(model_name), json=payload, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            _record_outcome(model_name, start, False, error=type(e).__name__)
+            return None
+        _record_outcome(model_name, start, response.status_code == 200, response.status_code)
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=len(models)) as pool:
+        return dict(zip(models, pool.map(probe, models)))
+
+
+def start_probe():
+    """
+    Runs probe_models once per process in a background thread.
+    """
+    global _probe_started
+    with _session_lock:
+        if _probe_started:
+            return
+        _probe_started = True
+    threading.Thread(target=probe_models, daemon=True).start()
@@ -0,0 +1,299 @@
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import Counter
+from itertools import chain
+
+import numpy as np
+
+import cache
+import content_package
+
+# Tag list the index is built from: tier, tag, popularity (0-100) and comma-separated
+# keywords per line. Keyword "*" marks general tags used to fill a tier with few matches.
+SOURCE_PATH = os.getenv("GEMINI_HASHTAG_SOURCE",
+                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "hashtags.tsv"))
+# Compiled index; rebuilt whenever the source is newer
+INDEX_PATH = os.getenv("GEMINI_HASHTAG_INDEX", "")
+TAGS_PER_TIER = 5
+
+TIERS = ("trending", "niche", "community")
+# Content package section filled by each tier
+TIER_SECTIONS = dict(zip(TIERS, content_package.HASHTAG_SECTIONS))
+GENERAL_KEYWORD = "*"
+
+MAGIC = b"HTAGIDX1"
+HEADER = struct.Struct("<8s4I")
+
+# Words too common in image descriptions to say anything about the tags
+STOPWORDS = frozenset("""
+a about above across after against all along also an and any are around as at away back be been before behind
+being below beneath between both but by can could each every feel feeling feels for from front has have her here
+his image images in into is it its itself like look looking looks made making many may more most near of off on
+one onto or other our out over overall perhaps photo picture piece possibly scene seems set shot shows some such
+than that the their them there these they this those through to together too toward under up upon very was
+we were what where which while who whose with within without would you your
+""".split())
+
+_WORD = re.compile(r"[a-z][a-z']+")
+
+
+def _stem(word):
+    word = word.replace("'", "")
+    return word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+
+
+def normalize_keyword(keyword):
+    """
+    Lower-cased, singular form of a one or two word keyword.
+    """
+    return " ".join(_stem(word) for word in _WORD.findall(keyword.lower()))
+
+
+def keywords(text):
+    """
+    Counts of the words and two-word phrases in `text` that can match index
+    keywords, stop words left out.
+    """
+    words = [_stem(word) for word in _WORD.findall(text.lower())]
+    counts = Counter(word for word in words if word not in STOPWORDS)
+    counts.update(f"{first} {second}" for first, second in zip(words, words[1:])
+                  if first not in STOPWORDS and second not in STOPWORDS)
+    return counts
+
+
+def _keyword_hash(keyword):
+    return int.from_bytes(hashlib.blake2b(keyword.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def read_source(path=SOURCE_PATH):
+    """
+    Reads the tag list, returning (tier, tag, popularity, keywords) tuples.
+    """
+    rows = []
+    with open(path, encoding="utf-8") as source:
+        for number, line in enumerate(source, 1):
+            fields = line.rstrip("\n").split("\t")
+            if number == 1 or not line.strip() or line.startswith("#"):
+                continue
+            if len(fields) != 4 or fields[0] not in TIERS:
+                raise ValueError(f"{path}:{number}: expected tier, tag, popularity and keywords")
+            tier, tag, popularity, words = fields
+            tag = "#" + tag.lstrip("#").lower()
+            keyword_set = {GENERAL_KEYWORD if word.strip() == GENERAL_KEYWORD else normalize_keyword(word)
+                           for word in words.split(",")}
+            keyword_set.add(normalize_keyword(tag.lstrip("#")))
+            rows.append((tier, tag, float(popularity), sorted(keyword for keyword in keyword_set if keyword)))
+    return rows
+
+
+def _aligned(data):
+    return data + b"\0" * (-len(data) % 8)
+
+
+def build_index(rows, path):
+    """
+    Writes the binary index for (tier, tag, popularity, keywords) rows to
+    `path`. Tags are stored by tier and then by popularity, so each tier's
+    most popular tags come first; every keyword has a posting list of
+    (tag, weight) pairs, heaviest first.
+    """
+    rows = sorted(rows, key=lambda row: (TIERS.index(row[0]), -row[2], row[1]))
+    postings = {}
+    for tag_id, (_, _, popularity, words) in enumerate(rows):
+        # Matching more keywords beats popularity, which only breaks close calls
+        weight = 0.5 + popularity / 100
+        for keyword in words:
+            postings.setdefault(_keyword_hash(keyword), []).append((tag_id, weight))
+
+    key_hashes = np.array(sorted(postings), dtype=np.uint64)
+    key_starts, post_tags, post_weights = [0], [], []
+    for key_hash in key_hashes.tolist():
+        for tag_id, weight in sorted(postings[key_hash], key=lambda posting: -posting[1]):
+            post_tags.append(tag_id)
+            post_weights.append(weight)
+        key_starts.append(len(post_tags))
+
+    encoded = [tag.encode("utf-8") for _, tag, _, _ in rows]
+    tag_offsets = np.cumsum([0] + [len(tag) for tag in encoded], dtype=np.uint32)
+    tiers = np.array([TIERS.index(tier) for tier, _, _, _ in rows], dtype=np.uint8)
+    tier_starts = np.searchsorted(tiers, np.arange(len(TIERS) + 1)).astype(np.uint32)
+
+    blocks = [
+        key_hashes.tobytes(),
+        np.array(key_starts, dtype=np.uint32).tobytes(),
+        np.array(post_tags, dtype=np.uint32).tobytes(),
+        np.array(post_weights, dtype=np.float32).tobytes(),
+        np.array([row[2] for row in rows], dtype=np.float32).tobytes(),
+        tag_offsets.tobytes(),
+        tiers.tobytes(),
+        tier_starts.tobytes(),
+        b"".join(encoded),
+    ]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    partial = f"{path}.{os.getpid()}.tmp"
+    with open(partial, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(key_hashes), len(post_tags), len(rows), len(blocks[-1])))
+        for block in blocks:
+            index_file.write(_aligned(block))
+    os.replace(partial, path)
+
+
+class HashtagIndex:
+    """
+    Read-only view of a built index. The file is memory-mapped, so opening
+    it reads nothing up front and lookups only touch the pages they need.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as index_file:
+            self._buffer = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, keyword_count, posting_count, tag_count, blob_bytes = HEADER.unpack_from(self._buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a hashtag index")
+
+        offset = HEADER.size
+
+        def array(dtype, count):
+            nonlocal offset
+            values = np.frombuffer(self._buffer, dtype=dtype, count=count, offset=offset)
+            offset += -(-values.nbytes // 8) * 8
+            return values
+
+        self._key_hashes = array(np.uint64, keyword_count)
+        self._key_starts = array(np.uint32, keyword_count + 1)
+        self._post_tags = array(np.uint32, posting_count)
+        self._post_weights = array(np.float32, posting_count)
+        self._popularity = array(np.float32, tag_count)
+        self._tag_offsets = array(np.uint32, tag_count + 1)
+        self._tiers = array(np.uint8, tag_count)
+        self._tier_starts = array(np.uint32, len(TIERS) + 1)
+        self._blob_offset = offset
+        self._general = self._postings(GENERAL_KEYWORD)[0]
+
+    def __len__(self):
+        return len(self._tiers)
+
+    def tag(self, tag_id):
+        start, end = self._tag_offsets[tag_id:tag_id + 2].tolist()
+        return self._buffer[self._blob_offset + start:self._blob_offset + end].decode("utf-8")
+
+    def _postings(self, keyword):
+        key_hash = _keyword_hash(keyword)
+        position = int(np.searchsorted(self._key_hashes, np.uint64(key_hash)))
+        if position == len(self._key_hashes) or int(self._key_hashes[position]) != key_hash:
+            return [], []
+        start, end = self._key_starts[position:position + 2].tolist()
+        return self._post_tags[start:end].tolist(), self._post_weights[start:end].tolist()
+
+    def suggest(self, text, count=TAGS_PER_TIER, exclude=()):
+        """
+        Ranked hashtags for a piece of text, as {section: [tags]} with
+        `count` tags for each of content_package.HASHTAG_SECTIONS. Tiers
+        with too few matching tags are filled with general tags, then the
+        tier's most popular ones. Tags in `exclude` are skipped.
+        """
+        scores = Counter()
+        counts = keywords(text)
+        if counts and len(self._key_hashes):
+            # Look every keyword up in one vectorised binary search
+            hashes = np.fromiter((_keyword_hash(keyword) for keyword in counts), dtype=np.uint64, count=len(counts))
+            positions = np.minimum(np.searchsorted(self._key_hashes, hashes), len(self._key_hashes) - 1)
+            found = self._key_hashes[positions] == hashes
+            occurrences = np.fromiter(counts.values(), dtype=np.int64, count=len(counts))
+            starts, ends = self._key_starts[positions[found]].tolist(), self._key_starts[positions[found] + 1].tolist()
+            for start, end, times in zip(starts, ends, occurrences[found].tolist()):
+                for tag_id, weight in zip(self._post_tags[start:end].tolist(), self._post_weights[start:end].tolist()):
+                    scores[tag_id] += weight * times
+
+        ranked = {tier: [] for tier in range(len(TIERS))}
+        for tag_id, _ in sorted(scores.items(), key=lambda item: (-item[1], item[0])):
+            ranked[int(self._tiers[tag_id])].append(tag_id)
+
+        excluded = {tag.lower() for tag in exclude}
+        suggestions = {}
+        for tier, section in enumerate(TIER_SECTIONS.values()):
+            start, end = self._tier_starts[tier:tier + 2].tolist()
+            general = [tag_id for tag_id in self._general if start <= tag_id < end]
+            tags = []
+            for tag_id in chain(ranked[tier], general, range(start, end)):
+                tag = self.tag(tag_id)
+                if tag not in tags and tag not in excluded:
+                    tags.append(tag)
+                    if len(tags) == count:
+                        break
+            suggestions[section] = tags
+        return suggestions
+
+
+def to_markdown(suggestions):
+    """
+    The hashtag section of a markdown content package, in the layout of
+    ContentPackage.to_markdown.
+    """
+    parts = ["## #️⃣ Hashtag Recommendations"]
+    for section, tags in suggestions.items():
+        parts.append(f"### {content_package.LABELS[section]}\n{' '.join(tags)}")
+    return "\n\n".join(parts)
+
+
+def _index_path():
+    if INDEX_PATH:
+        return INDEX_PATH
+    directory = cache.CACHE_DIR or os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+    return os.path.join(directory, "hashtags.idx")
+
+
+_hashtag_index = None
+_hashtag_index_lock = threading.Lock()
+
+
+def get_hashtag_index():
+    """
+    Returns the process-wide hashtag index, building it from SOURCE_PATH on
+    first use if the compiled file is missing or older than the source.
+    """
+    global _hashtag_index
+    if _hashtag_index is None:
+        with _hashtag_index_lock:
+            if _hashtag_index is None:
+                path = _index_path()
+                if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(SOURCE_PATH):
+                    build_index(read_source(), path)
+                _hashtag_index = HashtagIndex(path)
+    return _hashtag_index
+
+
+def suggest(text, count=TAGS_PER_TIER, exclude=()):
+    """
+    Ranked hashtags for `text` from the process-wide index (see HashtagIndex.suggest).
+    """
+    return get_hashtag_index().suggest(text, count, exclude)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the local hashtag index.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="Compile a tag list into a binary index")
+    build.add_argument("--source", default=SOURCE_PATH)
+    build.add_argument("--output", default=None, help="Index file (defaults to GEMINI_HASHTAG_INDEX or the cache)")
+    query = commands.add_parser("suggest", help="Print hashtags for a description")
+    query.add_argument("text")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        output = args.output or _index_path()
+        rows = read_source(args.source)
+        build_index(rows, output)
+        print(f"✅ Indexed {len(rows)} hashtags into {output} ({os.path.getsize(output)} bytes)")
+    else:
+        start = time.perf_counter()
+        result = suggest(args.text)
+        elapsed = time.perf_counter() - start
+        print(to_markdown(result))
+        print(f"\n({elapsed * 1000:.2f} ms including index load)")
@@ -0,0 +1,218 @@
+import io
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import cache
+from content_package import HASHTAG_SECTIONS, ContentPackage
+
+# Keep a history of generated packages so they can be found and reused later
+ENABLED = os.getenv("GEMINI_HISTORY", "1") == "1"
+MAX_ENTRIES = int(os.getenv("GEMINI_HISTORY_MAX_ENTRIES", "5000"))
+PAGE_SIZE = 10
+# Thumbnails are small JPEGs stored in the row, a few KB each
+THUMBNAIL_EDGE = 160
+THUMBNAIL_QUALITY = 70
+
+CAPTION_SECTIONS = ("witty_caption", "inspirational_caption", "professional_caption", "casual_caption")
+COLUMNS = ("id", "created_at", "session", "filename", "image_hash", "thumbnail", "description",
+           "content_package", "package", "timings", "captions", "hashtags")
+
+_HASHTAG = re.compile(r"#\w+")
+_CAPTIONS = re.compile(r"^## 🎨[^\n]*\n(.*?)(?=^## |\Z)", re.MULTILINE | re.DOTALL)
+_TERM = re.compile(r"\w+")
+
+
+def make_thumbnail(image_bytes):
+    """
+    JPEG bytes of a THUMBNAIL_EDGE thumbnail of an encoded image, such as
+    an upload's preview.
+    """
+    from PIL import Image
+
+    thumbnail = Image.open(io.BytesIO(image_bytes))
+    thumbnail.draft("RGB", (THUMBNAIL_EDGE, THUMBNAIL_EDGE))
+    thumbnail = thumbnail.convert("RGB")
+    thumbnail.thumbnail((THUMBNAIL_EDGE, THUMBNAIL_EDGE))
+    buffer = io.BytesIO()
+    thumbnail.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def searchable_text(content_package, package=None):
+    """
+    Returns (captions, hashtags): the text the search index covers, from a
+    ContentPackage when there is one, otherwise from the package markdown.
+    """
+    if package is not None:
+        captions = "\n".join(getattr(package, name) for name in CAPTION_SECTIONS)
+        hashtags = " ".join(tag for name in HASHTAG_SECTIONS for tag in getattr(package, name))
+        return captions, hashtags
+    match = _CAPTIONS.search(content_package)
+    lines = match.group(1).splitlines() if match else []
+    captions = "\n".join(line.strip() for line in lines if line.strip() and not line.startswith("#"))
+    return captions, " ".join(_HASHTAG.findall(content_package))
+
+
+def match_query(text):
+    """
+    An FTS5 query matching entries that contain every word of `text` as a
+    word prefix, or None if it has no words. Words are quoted, so the user's
+    text is never parsed as query syntax.
+    """
+    terms = _TERM.findall(text.lower())
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+
+class HistoryStore:
+    """
+    Generated content packages in SQLite, newest first, with an FTS5 index
+    over their captions, hashtags and descriptions. Pages are fetched by
+    keyset (entries older than a given id), so every page costs the same
+    however far back it is.
+    """
+
+    def __init__(self, path=None, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY, created_at REAL NOT NULL, session TEXT NOT NULL,
+                filename TEXT NOT NULL, image_hash TEXT NOT NULL, thumbnail BLOB,
+                description TEXT NOT NULL, content_package TEXT NOT NULL, package TEXT,
+                timings TEXT NOT NULL, captions TEXT NOT NULL, hashtags TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_image_hash ON entries (image_hash, id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+                captions, hashtags, description, content='entries', content_rowid='id'
+            );
+            CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+                INSERT INTO entries_fts (rowid, captions, hashtags, description)
+                VALUES (new.id, new.captions, new.hashtags, new.description);
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, captions, hashtags, description)
+                VALUES ('delete', old.id, old.captions, old.hashtags, old.description);
+            END;
+            CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE ON entries BEGIN
+                INSERT INTO entries_fts (entries_fts, rowid, captions, hashtags, description)
+                VALUES ('delete', old.id, old.captions, old.hashtags, old.description);
+                INSERT INTO entries_fts (rowid, captions, hashtags, description)
+                VALUES (new.id, new.captions, new.hashtags, new.description);
+            END;
+        """)
+        self._db.commit()
+
+    def add(self, image_hash, description, content_package, package=None, thumbnail=None,
+            timings=None, filename="", session=""):
+        """
+        Stores a generated package and returns its entry id.
+        """
+        captions, hashtags = searchable_text(content_package, package)
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO entries (created_at, session, filename, image_hash, thumbnail, description,"
+                " content_package, package, timings, captions, hashtags)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), session or "", filename or "", image_hash, thumbnail, description, content_package,
+                 package.to_json() if package is not None else None, json.dumps(timings or {}), captions, hashtags)
+            )
+            # Oldest entries go first once the history is full
+            self._db.execute("DELETE FROM entries WHERE id <= ?", (cursor.lastrowid - self.max_entries,))
+            self._db.commit()
+        return cursor.lastrowid
+
+    def update(self, entry_id, content_package, package=None):
+        """
+        Replaces an entry's package, e.g. after some sections were regenerated.
+        """
+        captions, hashtags = searchable_text(content_package, package)
+        with self._lock:
+            self._db.execute(
+                "UPDATE entries SET content_package = ?, package = ?, captions = ?, hashtags = ? WHERE id = ?",
+                (content_package, package.to_json() if package is not None else None, captions, hashtags, entry_id)
+            )
+            self._db.commit()
+
+    def _entry(self, row):
+        entry = {name: row[name] for name in COLUMNS}
+        entry["timings"] = json.loads(entry["timings"])
+        entry["package"] = ContentPackage.from_dict(json.loads(entry["package"])) if entry["package"] else None
+        return entry
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self._db.execute(f"SELECT {', '.join(COLUMNS)} FROM entries WHERE id = ?", (entry_id,)).fetchone()
+        return self._entry(row) if row is not None else None
+
+    def latest_for_image(self, image_hash):
+        """
+        The newest entry generated for an image with this content hash, or None.
+        """
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM entries WHERE image_hash = ? ORDER BY id DESC LIMIT 1",
+                (image_hash,)
+            ).fetchone()
+        return self._entry(row) if row is not None else None
+
+    def page(self, query="", before=None, limit=PAGE_SIZE):
+        """
+        Up to `limit` entries, newest first, older than entry id `before` and,
+        with a `query`, matching every one of its words. Returns
+        (entries, cursor): pass `cursor` as `before` for the next page; it is
+        None on the last page.
+        """
+        conditions, params = [], []
+        match = match_query(query)
+        if match:
+            conditions.append("id IN (SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?)")
+            params.append(match)
+        if before is not None:
+            conditions.append("id < ?")
+            params.append(before)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {', '.join(COLUMNS)} FROM entries{where} ORDER BY id DESC LIMIT ?", (*params, limit + 1)
+            ).fetchall()
+        entries = [self._entry(row) for row in rows[:limit]]
+        return entries, (entries[-1]["id"] if len(rows) > limit else None)
+
+    def delete(self, entry_id):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM entries")
+            self._db.commit()
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """
+    Returns the process-wide history store.
+    """
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                path = os.path.join(cache.CACHE_DIR, "history.sqlite3") if cache.CACHE_DIR else None
+                _history = HistoryStore(path=path)
+    return _history
@@ -0,0 +1,241 @@
+from dataclasses import asdict, dataclass
+
+import numpy as np
+from PIL import ExifTags, Image
+
+# Colours in the dominant palette, and the size of the sample k-means runs on
+PALETTE_COLORS = 5
+SAMPLE_EDGE = 64
+# Tone statistics are measured on a sample this size; they barely move with resolution
+TONE_SAMPLE_EDGE = 256
+KMEANS_ITERATIONS = 16
+# Palette colours covering less of the image than this are left out
+MIN_COLOR_SHARE = 0.04
+
+# Rough names for palette colours, so the facts read naturally in a prompt
+COLOR_NAMES = {
+    "black": (20, 20, 20),
+    "charcoal": (60, 60, 60),
+    "grey": (128, 128, 128),
+    "silver": (192, 192, 192),
+    "white": (245, 245, 245),
+    "red": (200, 30, 30),
+    "maroon": (120, 20, 30),
+    "orange": (240, 140, 20),
+    "brown": (130, 80, 40),
+    "tan": (200, 160, 110),
+    "beige": (230, 215, 180),
+    "yellow": (240, 220, 40),
+    "olive": (120, 120, 30),
+    "green": (40, 160, 60),
+    "dark green": (20, 80, 40),
+    "teal": (0, 128, 128),
+    "turquoise": (60, 200, 200),
+    "sky blue": (120, 180, 235),
+    "blue": (30, 80, 200),
+    "navy": (20, 30, 90),
+    "purple": (120, 50, 160),
+    "lavender": (190, 160, 220),
+    "pink": (240, 150, 180),
+    "magenta": (200, 40, 160),
+}
+_NAME_RGB = np.array(list(COLOR_NAMES.values()), dtype=np.float32)
+_NAMES = list(COLOR_NAMES)
+
+# EXIF capture details reported, with their labels
+CAPTURE_TAGS = {
+    ExifTags.Base.Make: "camera make",
+    ExifTags.Base.Model: "camera model",
+    ExifTags.Base.LensModel: "lens",
+    ExifTags.Base.DateTimeOriginal: "taken",
+    ExifTags.Base.ExposureTime: "exposure",
+    ExifTags.Base.FNumber: "aperture",
+    ExifTags.Base.ISOSpeedRatings: "ISO",
+    ExifTags.Base.FocalLength: "focal length",
+    ExifTags.Base.Flash: "flash",
+}
+# EXIF orientations that turn the stored image on its side
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+@dataclass
+class ImageFeatures:
+    """
+    Facts measured from an image: its dominant colours as
+    (hex, name, share) tuples, tone statistics between 0 and 1, its framing
+    and any EXIF capture details.
+    """
+    palette: list
+    brightness: float
+    contrast: float
+    saturation: float
+    warmth: float
+    orientation: str
+    aspect_ratio: str
+    capture: dict
+
+    def to_dict(self):
+        return asdict(self)
+
+    def describe_tone(self):
+        brightness = "bright" if self.brightness > 0.62 else "dark" if self.brightness < 0.35 else "balanced"
+        contrast = "high" if self.contrast > 0.28 else "low" if self.contrast < 0.14 else "moderate"
+        saturation = "vivid" if self.saturation > 0.5 else "muted" if self.saturation < 0.2 else "natural"
+        warmth = "warm" if self.warmth > 0.06 else "cool" if self.warmth < -0.06 else "neutral"
+        return f"{brightness} exposure, {contrast} contrast, {saturation} {warmth} colours"
+
+    def to_facts(self):
+        """
+        The features as prompt lines.
+        """
+        colours = ", ".join(f"{name} {hex_code} ({share:.0%})" for hex_code, name, share in self.palette)
+        lines = [
+            f"- Dominant colours: {colours}",
+            f"- Tone: {self.describe_tone()} (brightness {self.brightness:.2f}, contrast {self.contrast:.2f},"
+            f" saturation {self.saturation:.2f})",
+            f"- Framing: {self.orientation}, {self.aspect_ratio}",
+        ]
+        if self.capture:
+            lines.append("- Capture: " + ", ".join(f"{label} {value}" for label, value in self.capture.items()))
+        return "\n".join(lines)
+
+    def to_markdown(self):
+        """
+        The colours and visual style section added to a description. Capture
+        details such as the camera and when the photo was taken are only
+        prompt context (see to_facts), since descriptions are shown, stored
+        and searchable.
+        """
+        colours = ", ".join(f"{name} ({share:.0%})" for _, name, share in self.palette)
+        return (f"**Colours and visual style:** {colours}; {self.describe_tone()}."
+                f" {self.orientation.capitalize()} framing ({self.aspect_ratio}).")
+
+
+def _color_name(rgb):
+    return _NAMES[int(np.argmin(((_NAME_RGB - rgb) ** 2).sum(axis=1)))]
+
+
+def palette(image, colors=PALETTE_COLORS, iterations=KMEANS_ITERATIONS):
+    """
+    Dominant colours by k-means over a small sample of the image's pixels,
+    largest first, as (hex, name, share) tuples. The clusters start from
+    brightness quantiles, so the result is deterministic.
+    """
+    sample = image.convert("RGB")
+    sample.thumbnail((SAMPLE_EDGE, SAMPLE_EDGE), Image.BILINEAR)
+    pixels = np.asarray(sample, dtype=np.float32).reshape(-1, 3)
+    colors = min(colors, len(pixels))
+
+    order = np.argsort(pixels @ np.array([0.299, 0.587, 0.114], dtype=np.float32))
+    centroids = np.stack([pixels[chunk].mean(axis=0) for chunk in np.array_split(order, colors)])
+    for _ in range(iterations):
+        labels = ((pixels[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        counts = np.bincount(labels, minlength=colors)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, pixels)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centroids)
+        if np.allclose(updated, centroids, atol=0.5):
+            break
+        centroids = updated
+
+    # Clusters with the same name are reported once, under the largest one's colour
+    shares = counts / len(pixels)
+    merged = {}
+    for index in np.argsort(-shares):
+        name = _color_name(centroids[index])
+        if name in merged:
+            merged[name][1] += float(shares[index])
+        else:
+            r, g, b = (int(round(value)) for value in centroids[index])
+            merged[name] = [f"#{r:02x}{g:02x}{b:02x}", float(shares[index])]
+    result = [(hex_code, name, round(share, 3)) for name, (hex_code, share) in merged.items() if share >= MIN_COLOR_SHARE]
+    return sorted(result, key=lambda color: -color[2])
+
+
+def tone(image):
+    """
+    Returns (brightness, contrast, saturation, warmth): mean and standard
+    deviation of luminance, mean HSV saturation, and how much red outweighs
+    blue, each scaled to 0-1 (warmth to -1..1).
+    """
+    sample = image.convert("RGB")
+    sample.thumbnail((TONE_SAMPLE_EDGE, TONE_SAMPLE_EDGE), Image.BILINEAR)
+    rgb = np.asarray(sample, dtype=np.float32) / 255
+    luminance = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    high, low = rgb.max(axis=2), rgb.min(axis=2)
+    saturation = np.where(high > 0, (high - low) / np.maximum(high, 1e-6), 0)
+    warmth = rgb[..., 0].mean() - rgb[..., 2].mean()
+    return (round(float(luminance.mean()), 3), round(float(luminance.std()), 3),
+            round(float(saturation.mean()), 3), round(float(warmth), 3))
+
+
+def _format_capture(tag, value):
+    if tag == ExifTags.Base.ExposureTime:
+        value = float(value)
+        return f"1/{round(1 / value)} s" if 0 < value < 1 else f"{value:g} s"
+    if tag == ExifTags.Base.FNumber:
+        return f"f/{float(value):g}"
+    if tag == ExifTags.Base.FocalLength:
+        return f"{float(value):g} mm"
+    if tag == ExifTags.Base.Flash:
+        return "fired" if int(value) & 1 else "off"
+    if isinstance(value, bytes):
+        value = value.decode("ascii", "ignore")
+    return str(value).strip("\x00 ")
+
+
+def capture_info(exif):
+    """
+    Human-readable capture details from an Image.Exif, keyed by label.
+    """
+    if not exif:
+        return {}
+    tags = dict(exif)
+    try:
+        tags.update(exif.get_ifd(ExifTags.IFD.Exif))
+    except (KeyError, ValueError):
+        pass
+
+    capture = {}
+    for tag, label in CAPTURE_TAGS.items():
+        if tag not in tags:
+            continue
+        try:
+            value = _format_capture(tag, tags[tag])
+        except (TypeError, ValueError, ZeroDivisionError):
+            continue
+        if value:
+            capture[label] = value
+    return capture
+
+
+def framing(width, height):
+    """
+    Returns (orientation, aspect ratio) for the displayed size of an image.
+    """
+    ratio = width / height
+    orientation = "square" if abs(ratio - 1) < 0.05 else "landscape" if ratio > 1 else "portrait"
+    common = {"1:1": 1, "4:5": 0.8, "3:4": 0.75, "2:3": 2 / 3, "9:16": 0.5625,
+              "5:4": 1.25, "4:3": 4 / 3, "3:2": 1.5, "16:9": 16 / 9}
+    name, value = min(common.items(), key=lambda item: abs(item[1] - ratio))
+    return orientation, name if abs(value - ratio) < 0.03 else f"{ratio:.2f}:1"
+
+
+def extract_features(image, exif=None, size=None):
+    """
+    Measures an upright, decoded image. `exif` is the original file's
+    Image.Exif and `size` its displayed dimensions, when the image passed in
+    has been downscaled.
+    """
+    brightness, contrast, saturation, warmth = tone(image)
+    orientation, aspect_ratio = framing(*(size or image.size))
+    return ImageFeatures(
+        palette=palette(image),
+        brightness=brightness,
+        contrast=contrast,
+        saturation=saturation,
+        warmth=warmth,
+        orientation=orientation,
+        aspect_ratio=aspect_ratio,
+        capture=capture_info(exif),
+    )
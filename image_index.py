@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+import time
+from itertools import combinations
+
+import numpy as np
+from PIL import Image
+
+import cache
+
+# Reuse the analysis of a near-identical image (off by default: similar but
+# different images, like a product shot in another colour, could match)
+SIMILAR_REUSE = os.getenv("GEMINI_SIMILAR_REUSE", "0") == "1"
+# Largest Hamming distance (out of 64 bits) at which two images count as the same shot;
+# a negative value turns near-duplicate reuse off
+SIMILARITY_THRESHOLD = int(os.getenv("GEMINI_SIMILARITY_THRESHOLD", "2"))
+MAX_ENTRIES = int(os.getenv("GEMINI_SIMILARITY_MAX_ENTRIES", "500000"))
+
+HASH_SIZE = 8
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+# Hashes of flat or plain gradient images carry too little detail to match on
+MIN_DETAIL_BITS = 8
+
+
+def dhash(image, hash_size=HASH_SIZE):
+    """
+    64-bit difference hash: the image is shrunk to (hash_size + 1) x hash_size
+    greyscale and each bit records whether a pixel is brighter than its left
+    neighbour. Robust to re-compression, resizing and small crops.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def has_detail(image_hash):
+    return MIN_DETAIL_BITS <= image_hash.bit_count() <= 64 - MIN_DETAIL_BITS
+
+
+def _chunks(image_hash):
+    mask = (1 << CHUNK_BITS) - 1
+    return [(image_hash >> (CHUNK_BITS * index)) & mask for index in range(CHUNKS)]
+
+
+def _neighbours(chunk, radius):
+    """
+    All chunk values within `radius` bit flips of `chunk`.
+    """
+    values = [chunk]
+    for distance in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), distance):
+            flipped = chunk
+            for bit in bits:
+                flipped ^= 1 << bit
+            values.append(flipped)
+    return values
+
+
+def _signed(image_hash):
+    # SQLite integers are signed 64-bit
+    return image_hash - (1 << 64) if image_hash >= 1 << 63 else image_hash
+
+
+class PerceptualIndex:
+    """
+    Persistent Hamming-distance index of image hashes using multi-index
+    hashing: each 64-bit hash is split into CHUNKS indexed 16-bit columns.
+    Two hashes within distance r must agree to within r // CHUNKS bits on at
+    least one chunk, so a lookup only probes a few index entries per chunk
+    and checks the full distance on the candidates it finds. Entries are
+    only matched within the `scope` they were added with.
+    """
+
+    def __init__(self, path=None, threshold=SIMILARITY_THRESHOLD, max_entries=MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        columns = ", ".join(f"c{index} INTEGER NOT NULL" for index in range(CHUNKS))
+        existing = [row[1] for row in self._db.execute("PRAGMA table_info(hashes)")]
+        if existing and "scope" not in existing:
+            # Entries from before scopes can't be told apart, so they are dropped
+            self._db.execute("DROP TABLE hashes")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            " id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, scope TEXT NOT NULL, value TEXT NOT NULL,"
+            f" created_at REAL NOT NULL, {columns})"
+        )
+        for index in range(CHUNKS):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS hashes_c{index} ON hashes (c{index})")
+        self._db.commit()
+
+    def add(self, image_hash, value, scope=""):
+        chunks = _chunks(image_hash)
+        with self._lock:
+            cursor = self._db.execute(
+                f"INSERT INTO hashes (hash, scope, value, created_at, {', '.join(f'c{i}' for i in range(CHUNKS))})"
+                f" VALUES (?, ?, ?, ?, {', '.join('?' * CHUNKS)})",
+                (_signed(image_hash), scope, value, time.time(), *chunks)
+            )
+            # Oldest entries go first once the index is full
+            self._db.execute("DELETE FROM hashes WHERE id <= ?", (cursor.lastrowid - self.max_entries,))
+            self._db.commit()
+
+    def find(self, image_hash, threshold=None, scope=""):
+        """
+        Returns (value, distance) of the closest entry in `scope` within
+        `threshold` bits, or None.
+        """
+        threshold = self.threshold if threshold is None else threshold
+        if threshold < 0:
+            return None
+
+        radius = threshold // CHUNKS
+        queries, params = [], []
+        for index, chunk in enumerate(_chunks(image_hash)):
+            values = _neighbours(chunk, radius)
+            queries.append(f"SELECT hash, value FROM hashes"
+                           f" WHERE c{index} IN ({', '.join('?' * len(values))}) AND scope = ?")
+            params.extend(values)
+            params.append(scope)
+
+        with self._lock:
+            rows = self._db.execute(" UNION ".join(queries), params).fetchall()
+
+        best = None
+        for stored, value in rows:
+            distance = ((stored & ((1 << 64) - 1)) ^ image_hash).bit_count()
+            if distance <= threshold and (best is None or distance < best[1]):
+                best = (value, distance)
+        return best
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM hashes")
+            self._db.commit()
+
+
+_image_index = None
+_index_lock = threading.Lock()
+
+
+def get_image_index():
+    """
+    Returns the process-wide index of analysed images' perceptual hashes.
+    """
+    global _image_index
+    if _image_index is None:
+        with _index_lock:
+            if _image_index is None:
+                path = os.path.join(cache.CACHE_DIR, "image_index.sqlite3") if cache.CACHE_DIR else None
+                _image_index = PerceptualIndex(path=path, threshold=SIMILARITY_THRESHOLD if SIMILAR_REUSE else -1)
+    return _image_index
@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# Jobs run at once per process, however many sessions submit them
+JOB_WORKERS = int(os.getenv("GEMINI_JOB_WORKERS", "4"))
+# Finished jobs are forgotten after this many seconds
+JOB_TTL = float(os.getenv("GEMINI_JOB_TTL", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Job:
+    """
+    A unit of background work. The job function receives its Job and may
+    report progress (0-100), a status message and partial output with update().
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.progress = 0
+        self.message = ""
+        self.partial = ""
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, progress=None, message=None, partial=None):
+        with self._lock:
+            if progress is not None:
+                self.progress = progress
+            if message is not None:
+                self.message = message
+            if partial is not None:
+                self.partial = partial
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "status": self.status,
+                "progress": self.progress,
+                "message": self.message,
+                "partial": self.partial,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class JobQueue:
+    """
+    In-process job queue: jobs are run by a fixed pool of worker threads and
+    looked up by ID, so their results outlive the script run that submitted them.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, ttl=JOB_TTL):
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues `function(job, *args, **kwargs)` and returns the job ID.
+        """
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._expire(time.time())
+            self._jobs[job.id] = job
+        metrics.incr("jobs.submitted")
+        # The worker adds to the submitter's metrics breakdown, if it collects one
+        self._pool.submit(self._run, job, function, args, kwargs, metrics.current_collector())
+        return job.id
+
+    def _run(self, job, function, args, kwargs, collector=None):
+        with metrics.collector_scope(collector):
+            self._run_job(job, function, args, kwargs)
+
+    def _run_job(self, job, function, args, kwargs):
+        with job._lock:
+            job.status = RUNNING
+            job.started_at = time.time()
+        try:
+            result = function(job, *args, **kwargs)
+        except Exception as e:
+            metrics.incr("jobs.failed")
+            with job._lock:
+                job.status, job.error = FAILED, str(e)
+        else:
+            with job._lock:
+                job.status, job.result, job.progress = DONE, result, 100
+        finally:
+            with job._lock:
+                job.finished_at = time.time()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id):
+        """
+        Returns a snapshot of the job (see Job.snapshot), or None if it is
+        unknown or has expired.
+        """
+        job = self.get(job_id)
+        return job.snapshot() if job is not None else None
+
+    def queue_depth(self):
+        """
+        Number of jobs waiting for a worker.
+        """
+        with self._lock:
+            return sum(job.status == QUEUED for job in self._jobs.values())
+
+    def _expire(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at is not None and now - job.finished_at > self.ttl]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    Returns the process-wide job queue.
+    """
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -1,28 +1,17 @@
+import json
 import os
-import requests
-from dotenv import load_dotenv
+import cache
+import config
+import content_package
+import gemini_client
+import hashtags
+from content_package import ContentPackage
+from single_flight import SingleFlight
 
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
+API_KEY = config.API_KEY
 
 
-def generate_content(description):
-    """
-    Generates content using the Google AI Gemini API endpoint.
-    """
-    if not API_KEY:
-        return "Error: GOOGLE_API_KEY is not set."
-
-    # Updated list to match the WORKING models from your test
-    models_to_try = [
-        "gemini-2.0-flash",
-        "gemini-2.5-flash",
-        "gemini-2.5-pro"
-    ]
-
-    prompt = f"""Based on this image description: "{description}"
-
-Create a comprehensive social media content package with the following sections:
+CONTENT_PACKAGE_INSTRUCTIONS = """Create a comprehensive social media content package with the following sections:
 
 ## 🎨 Caption Variations
 
@@ -65,76 +54,224 @@ Create a comprehensive social media content package with the following sections:
 
 Format everything clearly with emojis and proper markdown formatting. Make it engaging and actionable!"""
 
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {"text": prompt}
-                ]
-            }
-        ],
-        "generationConfig": {
-            "temperature": 0.8,
-            "topK": 40,
-            "topP": 0.95,
-            "maxOutputTokens": 2048,
-        },
-        "safetySettings": [
-            {
-                "category": "HARM_CATEGORY_HARASSMENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_HATE_SPEECH",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            },
-            {
-                "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-            }
-        ]
-    }
+GENERATION_CONFIG = {
+    "temperature": 0.8,
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 2048,
+}
+
+# Leave hashtags out of the prompt and fill them from the local index (see hashtags.py)
+LOCAL_HASHTAGS = os.getenv("GEMINI_LOCAL_HASHTAGS", "0") == "1"
+# The model's output budget without the hashtag sections
+LOCAL_HASHTAGS_GENERATION_CONFIG = dict(GENERATION_CONFIG, maxOutputTokens=1536)
+
+HASHTAG_HEADING = "## #️⃣ Hashtag Recommendations"
+INSIGHTS_HEADING = "## 📊 Content Insights"
+INSTRUCTIONS_WITHOUT_HASHTAGS = (
+    CONTENT_PACKAGE_INSTRUCTIONS[:CONTENT_PACKAGE_INSTRUCTIONS.index(HASHTAG_HEADING)]
+    + CONTENT_PACKAGE_INSTRUCTIONS[CONTENT_PACKAGE_INSTRUCTIONS.index(INSIGHTS_HEADING):]
+)
+
+# Output budget per section in structured mode, so regenerating one section asks for far fewer tokens
+STRUCTURED_TOKENS_PER_SECTION = 192
+
+
+# Concurrent requests for the same description share one upstream request
+packages_in_flight = SingleFlight()
+
+
+def build_content_prompt(description, local_hashtags=False):
+    """
+    Builds the content package prompt for an image description, without
+    the hashtag sections when they are filled locally.
+    """
+    instructions = INSTRUCTIONS_WITHOUT_HASHTAGS if local_hashtags else CONTENT_PACKAGE_INSTRUCTIONS
+    return f"""Based on this image description: "{description}"
+
+{instructions}"""
+
+
+def insert_hashtags(content_package_text, hashtag_section):
+    """
+    Puts the hashtag section where the model would have written it: before
+    the content insights, or at the end if that heading is missing.
+    """
+    position = content_package_text.find(INSIGHTS_HEADING)
+    if position == -1:
+        return f"{content_package_text.rstrip()}\n\n{hashtag_section}"
+    return f"{content_package_text[:position]}{hashtag_section}\n\n{content_package_text[position:]}"
+
+
+def generate_content(description, local_hashtags=None):
+    """
+    Generates content using the Google AI Gemini API endpoint. With
+    `local_hashtags` (default LOCAL_HASHTAGS) the model writes everything
+    but the hashtags, which come from the local index.
+    """
+    if not API_KEY:
+        return "Error: GOOGLE_API_KEY is not set."
+
+    local_hashtags = LOCAL_HASHTAGS if local_hashtags is None else local_hashtags
+    prompt = build_content_prompt(description, local_hashtags)
+    generation_config = LOCAL_HASHTAGS_GENERATION_CONFIG if local_hashtags else GENERATION_CONFIG
+    payload = gemini_client.build_payload([{"text": prompt}], generation_config)
 
     try:
-        # Try each model until one works
-        for model_name in models_to_try:
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
+        key = cache.make_key(prompt.encode("utf-8"), "", generation_config)
+        text = packages_in_flight.do(key, lambda: gemini_client.generate(payload))
+        if local_hashtags and not text.startswith("Error"):
+            text = insert_hashtags(text, hashtags.to_markdown(hashtags.suggest(description)))
+        return text
+
+    except Exception as e:
+        return f"An unexpected error occurred: {str(e)}"
+
+
+def generate_content_stream(description, local_hashtags=None):
+    """
+    Streams the content package as it is generated, yielding markdown chunks.
+    A single chunk starting with "Error" is yielded on failure, and a stream
+    that breaks part way ends with a gemini_client.STREAM_CUT_OFF chunk.
+    Locally filled hashtags are yielded as soon as the model reaches the
+    insights.
+    """
+    if not API_KEY:
+        yield "Error: GOOGLE_API_KEY is not set."
+        return
+
+    local_hashtags = LOCAL_HASHTAGS if local_hashtags is None else local_hashtags
+    payload = gemini_client.build_payload(
+        [{"text": build_content_prompt(description, local_hashtags)}],
+        LOCAL_HASHTAGS_GENERATION_CONFIG if local_hashtags else GENERATION_CONFIG
+    )
+
+    try:
+        chunks = gemini_client.stream_generate(payload)
+        if not local_hashtags:
+            yield from chunks
+            return
+
+        # Hold back just enough text to spot the insights heading across chunk boundaries
+        hashtag_section = hashtags.to_markdown(hashtags.suggest(description))
+        pending = ""
+        for chunk in chunks:
+            if hashtag_section is None:
+                yield chunk
+                continue
+            if (not pending and chunk.startswith("Error")) or gemini_client.is_cut_off(chunk):
+                if pending:
+                    yield pending
+                yield chunk
+                return
+            pending += chunk
+            position = pending.find(INSIGHTS_HEADING)
+            if position != -1:
+                yield insert_hashtags(pending, hashtag_section)
+                hashtag_section, pending = None, ""
+            elif len(pending) > len(INSIGHTS_HEADING):
+                yield pending[:-len(INSIGHTS_HEADING)]
+                pending = pending[-len(INSIGHTS_HEADING):]
+        if hashtag_section is not None:
+            yield insert_hashtags(pending, hashtag_section)
+
+    except Exception as e:
+        yield f"An unexpected error occurred: {str(e)}"
+
+
+def build_sections_prompt(description, sections, previous=None):
+    """
+    Builds the structured-mode prompt asking for the given sections as JSON.
+    Values from `previous` for those sections are shown so new ones differ.
+    """
+    wanted = "\n".join(f'- "{name}": {content_package.SECTIONS[name]}' for name in sections)
+    prompt = f"""Based on this image description: "{description}"
+
+Write the following sections of a social media content package. Make them engaging and actionable, use emojis where they fit and write hashtags with a leading #.
+
+{wanted}"""
+    if previous is not None:
+        replaced = json.dumps({name: getattr(previous, name) for name in sections}, ensure_ascii=False)
+        prompt += f"""
+
+These sections are being regenerated. Write fresh alternatives that differ from the current ones:
+{replaced}"""
+    return prompt
+
+
+def structured_config(sections):
+    """
+    Generation config requesting a JSON object with the given sections.
+    """
+    return dict(
+        GENERATION_CONFIG,
+        maxOutputTokens=min(GENERATION_CONFIG["maxOutputTokens"], STRUCTURED_TOKENS_PER_SECTION * len(sections)),
+        responseMimeType="application/json",
+        responseSchema=content_package.response_schema(sections),
+    )
+
+
+def package_key(description):
+    """
+    Cache key of the structured package generated for a description.
+    """
+    return cache.make_key(description.encode("utf-8"), json.dumps(content_package.SECTIONS), GENERATION_CONFIG)
+
+
+def generate_package(description, sections=None, local_hashtags=None):
+    """
+    Generates a structured ContentPackage using JSON output. With `sections`,
+    only those are regenerated and the others are kept from the package last
+    generated for this description; without a cached package the whole
+    package is generated. With `local_hashtags` (default LOCAL_HASHTAGS) the
+    hashtag sections come from the local index, and regenerating only those
+    makes no request. Returns the package, or an error string.
+    """
+    if not API_KEY:
+        return "Error: GOOGLE_API_KEY is not set."
+
+    unknown = [name for name in sections or () if name not in content_package.SECTIONS]
+    if unknown:
+        return f"Error: Unknown content package section(s): {', '.join(unknown)}"
+
+    package_cache = cache.get_package_cache()
+    key = package_key(description)
+    previous = None
+    if sections:
+        cached = package_cache.get(key)
+        if cached is not None:
+            previous = ContentPackage.from_dict(cached)
+    # Keep the schema's property order stable whatever order the caller used
+    sections = [name for name in content_package.SECTIONS if previous is None or name in sections]
+
+    local_hashtags = LOCAL_HASHTAGS if local_hashtags is None else local_hashtags
+    values = {}
+    if local_hashtags:
+        local_sections = [name for name in sections if name in content_package.HASHTAG_SECTIONS]
+        # Regenerated hashtags move on to the next-ranked tags
+        replaced = [tag for name in local_sections for tag in getattr(previous, name)] if previous else ()
+        suggestions = hashtags.suggest(description, exclude=replaced)
+        values = {name: suggestions[name] for name in local_sections}
+        sections = [name for name in sections if name not in local_sections]
+
+    try:
+        if sections:
+            payload = gemini_client.build_payload(
+                [{"text": build_sections_prompt(description, sections, previous)}],
+                structured_config(sections)
+            )
+            text = gemini_client.generate(payload)
+            if text.startswith("Error"):
+                return text
 
             try:
-                response = requests.post(
-                    url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=30
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'candidates' in result and result['candidates']:
-                        if 'content' in result['candidates'][0]:
-                            return result['candidates'][0]['content']['parts'][0]['text']
-                    continue  # Try next model if this one doesn't return content
-
-                elif response.status_code == 404:
-                    continue  # Try next model
-                elif response.status_code == 403:
-                    return f"Error: Access forbidden. Your API key may not have permission to use Generative Language API. Please check that your API key from Google AI Studio has proper permissions."
-                elif response.status_code == 503:
-                    return f"Error: Google's Gemini API service is temporarily unavailable (503). This is usually temporary - please try again in a few minutes. The servers may be overloaded or under maintenance."
-                elif response.status_code == 429:
-                    return f"Error: Rate limit exceeded. Please wait a moment before trying again."
-                else:
-                    continue  # Try next model
-
-            except requests.exceptions.RequestException:
-                continue  # Try next model
-
-        # If all models failed
-        return f"Error: All available Gemini models failed to respond. Please verify your API key is from Google AI Studio (ai.google.dev) and try again later. Models tried: {', '.join(models_to_try)}"
+                values.update(content_package.parse_sections(text, sections))
+            except ValueError as e:
+                return f"Error: The model returned an invalid content package: {str(e)}"
+
+        package = previous.with_sections(values) if previous is not None else ContentPackage(**values)
+        package_cache.set(key, package.to_json())
+        return package
 
     except Exception as e:
         return f"An unexpected error occurred: {str(e)}"
@@ -0,0 +1,233 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Collect process-wide metrics; per-request breakdowns via collect() work either way
+ENABLED = os.getenv("GEMINI_METRICS", "0") == "1"
+# Serve Prometheus text on this port when set (see start_server)
+PORT = int(os.getenv("GEMINI_METRICS_PORT", "0"))
+# Interface the metrics server listens on; set 0.0.0.0 to expose it beyond this host
+HOST = os.getenv("GEMINI_METRICS_HOST", "127.0.0.1")
+
+PREFIX = "social_spark_"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class _Local(threading.local):
+    # Class default avoids a costly AttributeError on threads without a collector
+    collector = None
+
+
+_lock = threading.Lock()
+_local = _Local()
+_counters = {}
+_timings = {}
+_hooks = []
+_server = None
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _Span:
+    def __init__(self, name, collector):
+        self.name = name
+        self.collector = collector
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        _observe(self.name, time.perf_counter() - self.start, self.collector)
+        return False
+
+
+def add_hook(hook):
+    """
+    Registers `hook(kind, name, value)`, called for every span ("timing",
+    seconds) and counter ("counter", amount) while metrics are enabled.
+    """
+    _hooks.append(hook)
+
+
+def span(name):
+    """
+    Context manager that times a stage. Returns a shared no-op object when
+    metrics are disabled and no per-request collector is active.
+    """
+    collector = _local.collector
+    if not ENABLED and collector is None:
+        return _NOOP_SPAN
+    return _Span(name, collector)
+
+
+def incr(name, amount=1):
+    """
+    Increments a counter such as retries, fallbacks or cache hits.
+    """
+    collector = _local.collector
+    if not ENABLED and collector is None:
+        return
+    if collector is not None:
+        # Pool threads carrying the same collector (see collector_scope) add to it concurrently
+        with _lock:
+            counters = collector.setdefault("counters", {})
+            counters[name] = counters.get(name, 0) + amount
+    if ENABLED:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + amount
+        for hook in _hooks:
+            hook("counter", name, amount)
+
+
+def _observe(name, seconds, collector):
+    if collector is not None:
+        with _lock:
+            timings = collector.setdefault("timings", {})
+            timings[name] = timings.get(name, 0.0) + seconds
+    if ENABLED:
+        with _lock:
+            timing = _timings.get(name)
+            if timing is None:
+                timing = _timings[name] = {"count": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+            timing["count"] += 1
+            timing["sum"] += seconds
+            for index, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    timing["buckets"][index] += 1
+        for hook in _hooks:
+            hook("timing", name, seconds)
+
+
+@contextmanager
+def collect(collector=None):
+    """
+    Collects the spans and counters recorded on this thread into a dict with
+    "timings" (seconds per stage) and "counters", for a per-request breakdown.
+    Pass the same dict again to keep adding to an earlier breakdown.
+    """
+    previous = _local.collector
+    if collector is None:
+        collector = {}
+    collector.setdefault("timings", {})
+    collector.setdefault("counters", {})
+    _local.collector = collector
+    try:
+        yield collector
+    finally:
+        _local.collector = previous
+
+
+def current_collector():
+    return _local.collector
+
+
+@contextmanager
+def collector_scope(collector):
+    """
+    Records this thread's spans and counters into `collector`, the dict of a
+    collect() block on another thread (see current_collector), so work handed
+    to an executor still shows up in the request's breakdown. None records
+    into no breakdown.
+    """
+    previous = _local.collector
+    _local.collector = collector
+    try:
+        yield
+    finally:
+        _local.collector = previous
+
+
+def snapshot():
+    """
+    Returns all counters and timing summaries as a JSON-serialisable dict.
+    """
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {
+                name: {"count": timing["count"], "sum": round(timing["sum"], 6),
+                       "mean": round(timing["sum"] / timing["count"], 6) if timing["count"] else 0.0}
+                for name, timing in _timings.items()
+            },
+        }
+
+
+def _metric_name(name):
+    return PREFIX + name.replace(".", "_").replace("-", "_")
+
+
+def render_prometheus():
+    """
+    Renders the metrics in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        for name, value in sorted(_counters.items()):
+            metric = _metric_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, timing in sorted(_timings.items()):
+            metric = _metric_name(name) + "_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in zip(BUCKETS, timing["buckets"]):
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines.append(f'{metric}_bucket{{le="+Inf"}} {timing["count"]}')
+            lines.append(f"{metric}_sum {timing['sum']:.6f}")
+            lines.append(f"{metric}_count {timing['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def write_file(path):
+    """
+    Writes the metrics to `path`: JSON for *.json, Prometheus text otherwise.
+    """
+    content = json.dumps(snapshot(), indent=2) if path.endswith(".json") else render_prometheus()
+    with open(path, "w", encoding="utf-8") as out:
+        out.write(content)
+
+
+def start_server(port=None, host=None):
+    """
+    Serves /metrics (Prometheus text) and /metrics.json on a background thread,
+    on HOST (loopback by default) unless `host` is given. Only the first call
+    starts a server; returns its port.
+    """
+    # Imported here so processes that never serve metrics don't pay for http.server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.startswith("/metrics.json"):
+                body, content_type = json.dumps(snapshot()).encode("utf-8"), "application/json"
+            elif self.path.startswith("/metrics"):
+                body, content_type = render_prometheus().encode("utf-8"), "text/plain; version=0.0.4"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    global _server
+    with _lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host or HOST, port or PORT), MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server.server_address[1]
@@ -0,0 +1,341 @@
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TEXT = "This is a mock response from the local Gemini stand-in."
+# The end of each request body is kept to find the generationConfig, which follows the contents
+BODY_TAIL_BYTES = 128 * 1024
+FILE_URI_PATTERN = re.compile(rb'"file_uri": "[^"]*/files/([^"]+)"')
+
+
+def make_text(words):
+    """
+    Returns filler text of roughly `words` words, shaped like a content package.
+    """
+    lines = []
+    for index in range(0, words, 12):
+        if index % 120 == 0:
+            lines.append(f"\n### Section {index // 120 + 1}")
+        lines.append(" ".join(f"word{n}" for n in range(index, min(index + 12, words))))
+    return "\n".join(lines)
+
+
+def make_json(schema, words=6):
+    """
+    Returns a value shaped like a responseSchema, filled with filler text.
+    """
+    kind = schema.get("type", "STRING").upper()
+    if kind == "OBJECT":
+        return {name: make_json(prop, words) for name, prop in schema.get("properties", {}).items()}
+    if kind == "ARRAY":
+        count = max(5, schema.get("minItems", 0))
+        count = min(count, schema.get("maxItems", count))
+        return [make_json(schema.get("items", {}), 1) for _ in range(count)]
+    return " ".join(f"word{n}" for n in range(words))
+
+
+def _candidate_body(text, prompt_tokens=None, finish_reason="STOP", output_tokens=None):
+    """
+    A response body for `text`. With `prompt_tokens`, it ends the response:
+    the finish reason and usageMetadata are added, counting a word of
+    `text` (or `output_tokens`, for a whole stream) as a token.
+    """
+    body = {
+        "candidates": [
+            {"content": {"parts": [{"text": text}], "role": "model"}}
+        ]
+    }
+    if prompt_tokens is not None:
+        output_tokens = len(text.split()) if output_tokens is None else output_tokens
+        body["candidates"][0]["finishReason"] = finish_reason
+        body["usageMetadata"] = {
+            "promptTokenCount": prompt_tokens,
+            "candidatesTokenCount": output_tokens,
+            "totalTokenCount": prompt_tokens + output_tokens,
+        }
+    return body
+
+
+def _prompt_tokens(length):
+    # Four bytes of request body to a token, like rate_limiter.estimate_tokens
+    return max(1, length // 4)
+
+
+def _generation_config(tail):
+    """
+    Returns the generationConfig near the end of a request body, or {}.
+    """
+    start = tail.rfind(b'"generationConfig"')
+    if start == -1:
+        return {}
+    text = tail[start:].decode("utf-8", "replace")
+    value = text[text.index(":") + 1:].lstrip()
+    try:
+        generation_config, _ = json.JSONDecoder().raw_decode(value)
+    except ValueError:
+        return {}
+    return generation_config if isinstance(generation_config, dict) else {}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so clients can keep connections alive between requests
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.stats_increment("connections")
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, retry_after=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        # Read in blocks, as a real server would, keeping only the tail of the body
+        tail = b""
+        remaining = length
+        while remaining > 0:
+            block = self.rfile.read(min(remaining, 64 * 1024))
+            remaining -= len(block)
+            tail = (tail + block)[-BODY_TAIL_BYTES:]
+        self.server.stats_increment("requests")
+        self.server.stats_increment("bytes_received", length)
+
+        if self.path.startswith("/upload/"):
+            self._handle_upload(length)
+            return
+
+        latency = self.server.latency_for(self.path)
+        if latency:
+            time.sleep(latency)
+
+        if self.server.error_rate and self.server.random.random() < self.server.error_rate:
+            self.server.stats_increment("errors")
+            self._send_json(self.server.error_status, {
+                "error": {"code": self.server.error_status, "message": "Injected error"}
+            }, retry_after=self.server.retry_after)
+            return
+
+        if ":streamGenerateContent" in self.path and not self.server.is_unavailable(self.path):
+            self._send_stream(length)
+            return
+
+        if ":generateContent" not in self.path or self.server.is_unavailable(self.path):
+            self._send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            return
+
+        if not self.server.has_files(FILE_URI_PATTERN.findall(tail)):
+            self._send_json(403, {"error": {"code": 403, "message": "You do not have permission to access the File"}})
+            return
+
+        text = self.server.response_text
+        generation_config = _generation_config(tail)
+        schema = generation_config.get("responseSchema")
+        finish_reason = "STOP"
+        if schema is not None:
+            text = json.dumps(make_json(schema))
+        elif len(text.split()) > generation_config.get("maxOutputTokens", float("inf")):
+            # Counting a word as a token, stop where the model would hit its output limit
+            text = " ".join(text.split()[:generation_config["maxOutputTokens"]])
+            finish_reason = "MAX_TOKENS"
+
+        # A blocking response only arrives once the whole text has been "generated"
+        if self.server.chunk_delay:
+            time.sleep(self.server.chunk_delay * (self.server.stream_chunks - 1))
+        if self.server.word_delay:
+            time.sleep(self.server.word_delay * len(text.split()))
+        self._send_json(200, _candidate_body(text, _prompt_tokens(length), finish_reason))
+
+    def _handle_upload(self, length):
+        """Files API resumable upload: a start request, then one upload-and-finalize."""
+        command = self.headers.get("X-Goog-Upload-Command", "")
+        if self.server.fail_uploads:
+            self.server.stats_increment("errors")
+            self._send_json(500, {"error": {"code": 500, "message": "Injected upload error"}})
+        elif command == "start":
+            file_id = self.server.new_file_id()
+            self.send_response(200)
+            self.send_header("X-Goog-Upload-URL", f"{self.server.base_url}/upload/session/{file_id}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif "finalize" in command:
+            self.server.stats_increment("uploads")
+            file_id = self.path.rsplit("/", 1)[-1]
+            self._send_json(200, {"file": {
+                "name": f"files/{file_id}",
+                "uri": f"{self.server.base_url}/v1beta/files/{file_id}",
+                "mimeType": self.headers.get("Content-Type"),
+                "sizeBytes": str(length),
+                "state": "ACTIVE",
+            }})
+        else:
+            self._send_json(400, {"error": {"code": 400, "message": "Unsupported upload command"}})
+
+    def _send_stream(self, length):
+        """Sends the response text as server-sent events, one chunk per event, usage in the last."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        text = self.server.response_text
+        size = max(1, -(-len(text) // self.server.stream_chunks))
+        for index, start in enumerate(range(0, len(text), size)):
+            if index == self.server.cut_streams_after:
+                self.close_connection = True
+                return
+            if start and self.server.chunk_delay:
+                time.sleep(self.server.chunk_delay)
+            if start + size < len(text):
+                body = _candidate_body(text[start:start + size])
+            else:
+                body = _candidate_body(text[start:], _prompt_tokens(length), output_tokens=len(text.split()))
+            event = f"data: {json.dumps(body)}\r\n\r\n".encode("utf-8")
+            self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class MockGeminiServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Gemini generateContent and streamGenerateContent
+    endpoints and the Files API resumable upload. Streamed responses are
+    split into `stream_chunks` events sent `chunk_delay` seconds apart.
+    Use as a context manager; `base_url` can be assigned to
+    gemini_client.API_BASE.
+
+    `latency` and the values of `model_latency` (keyed by model name) may be
+    seconds or a zero-argument callable returning seconds. A fraction
+    `error_rate` of requests fail with `error_status`, optionally sending a
+    Retry-After header. Models in `unavailable_models` answer 404.
+
+    Requests with a responseSchema get filler JSON of that shape; other
+    blocking responses are cut to maxOutputTokens words. Responses report
+    usageMetadata, counting a word of output as a token. Blocking responses
+    take another `word_delay` seconds per word of output.
+
+    Requests referencing a file that was not uploaded here, or has been
+    dropped with expire_files, answer 403. With `fail_uploads` every upload
+    fails with a 500. With `cut_streams_after` streams drop the connection
+    after that many events.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port=0, latency=0.0, response_text=DEFAULT_TEXT,
+                 stream_chunks=8, chunk_delay=0.0, model_latency=None,
+                 error_rate=0.0, error_status=429, retry_after=None, seed=None,
+                 unavailable_models=(), word_delay=0.0, fail_uploads=False, cut_streams_after=None):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.model_latency = model_latency or {}
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.unavailable_models = set(unavailable_models)
+        self.response_text = response_text
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.word_delay = word_delay
+        self.fail_uploads = fail_uploads
+        self.cut_streams_after = cut_streams_after
+        self.stats = {"connections": 0, "requests": 0, "errors": 0, "bytes_received": 0, "uploads": 0}
+        self._stats_lock = threading.Lock()
+        self._file_count = 0
+        self._files = set()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def latency_for(self, path):
+        latency = self.latency
+        for model_name, model_latency in self.model_latency.items():
+            if f"/models/{model_name}:" in path:
+                latency = model_latency
+                break
+        return latency() if callable(latency) else latency
+
+    def new_file_id(self):
+        with self._stats_lock:
+            self._file_count += 1
+            file_id = f"mock-{self._file_count}"
+            self._files.add(file_id)
+            return file_id
+
+    def has_files(self, file_ids):
+        with self._stats_lock:
+            return all(file_id.decode("utf-8") in self._files for file_id in file_ids)
+
+    def expire_files(self):
+        """Forgets every uploaded file, as the Files API does after 48 hours."""
+        with self._stats_lock:
+            self._files.clear()
+
+    def is_unavailable(self, path):
+        return any(f"/models/{model_name}:" in path for model_name in self.unavailable_models)
+
+    def stats_increment(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + amount
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for name in self.stats:
+                self.stats[name] = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local Gemini API stand-in.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before responding")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=429, help="Status code of failed requests")
+    parser.add_argument("--response-words", type=int, default=0, help="Size of generated responses in words")
+    args = parser.parse_args()
+
+    server = MockGeminiServer(port=args.port, latency=args.latency, chunk_delay=args.chunk_delay,
+                              error_rate=args.error_rate, error_status=args.error_status,
+                              response_text=make_text(args.response_words) if args.response_words else DEFAULT_TEXT)
+    print(f"🧪 Mock Gemini API listening on {server.base_url}")
+    print(f"   Set GEMINI_API_BASE={server.base_url} to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,90 @@
+import math
+import os
+import threading
+import time
+from collections import deque
+
+# Number of recent calls kept per model
+WINDOW = int(os.getenv("GEMINI_STATS_WINDOW", "100"))
+# Below this many successful samples a model's latency is treated as unknown
+MIN_SAMPLES = int(os.getenv("GEMINI_STATS_MIN_SAMPLES", "5"))
+# Assumed latency (seconds) of a model with no history
+UNKNOWN_LATENCY = float(os.getenv("GEMINI_STATS_UNKNOWN_LATENCY", "10"))
+# Seconds added to a model's score per unit of error rate
+ERROR_PENALTY = float(os.getenv("GEMINI_STATS_ERROR_PENALTY", "30"))
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at `fraction` (0-1) of the sorted values, nearest-rank.
+    """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+class ModelStats:
+    """
+    Rolling per-model record of call latencies and outcomes, used to order
+    models by expected latency and to pick hedging delays.
+    """
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model_name, latency, ok):
+        with self._lock:
+            samples = self._samples.setdefault(model_name, deque(maxlen=self.window))
+            samples.append((time.time(), latency, ok))
+
+    def latencies(self, model_name):
+        with self._lock:
+            return [latency for _, latency, ok in self._samples.get(model_name, ()) if ok]
+
+    def error_rate(self, model_name):
+        with self._lock:
+            samples = self._samples.get(model_name, ())
+            if not samples:
+                return 0.0
+            return sum(1 for _, _, ok in samples if not ok) / len(samples)
+
+    def latency_percentile(self, model_name, fraction):
+        """
+        Returns the latency percentile of successful calls, or None without enough samples.
+        """
+        latencies = self.latencies(model_name)
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return percentile(latencies, fraction)
+
+    def score(self, model_name):
+        """
+        Expected cost of trying a model first: median latency plus an error penalty.
+        """
+        median = self.latency_percentile(model_name, 0.5)
+        if median is None:
+            median = UNKNOWN_LATENCY
+        return median + self.error_rate(model_name) * ERROR_PENALTY
+
+    def ordered(self, models):
+        """
+        Returns `models` sorted by score, keeping the given order for ties.
+        """
+        return sorted(models, key=lambda name: (self.score(name), models.index(name)))
+
+    def snapshot(self):
+        """
+        Returns a summary of every tracked model for display or export.
+        """
+        summary = {}
+        for model_name in list(self._samples):
+            latencies = self.latencies(model_name)
+            summary[model_name] = {
+                "calls": len(self._samples[model_name]),
+                "error_rate": round(self.error_rate(model_name), 3),
+                "p50": round(percentile(latencies, 0.5), 3) if latencies else None,
+                "p90": round(percentile(latencies, 0.9), 3) if latencies else None,
+                "p99": round(percentile(latencies, 0.99), 3) if latencies else None,
+            }
+        return summary
@@ -0,0 +1,250 @@
+import io
+import sqlite3
+import requests
+import cache
+import gemini_client
+import history
+import language
+import metrics
+import usage
+import vision
+from single_flight import SingleFlight
+
+# Separates the description from the content package in a fused response
+PACKAGE_MARKER = "===CONTENT PACKAGE==="
+
+FUSED_PROMPT = f"""{vision.ANALYSIS_PROMPT}
+
+Write this analysis first, under the heading "## Image Description".
+Then write a line containing only {PACKAGE_MARKER} and, based on your analysis:
+
+{language.CONTENT_PACKAGE_INSTRUCTIONS}"""
+
+FUSED_GENERATION_CONFIG = dict(
+    language.GENERATION_CONFIG,
+    maxOutputTokens=vision.GENERATION_CONFIG["maxOutputTokens"] + language.GENERATION_CONFIG["maxOutputTokens"]
+)
+
+CAROUSEL_PACKAGE_PROMPT = """{analysis}
+
+Finally, in "content_package", write one content package for the whole carousel, based on your analysis of the set, in markdown:
+
+{instructions}"""
+
+# Concurrent fused requests for the same image share one upstream request
+fused_in_flight = SingleFlight()
+
+
+def is_error(text):
+    """
+    True for the error strings returned by the pipeline functions.
+    """
+    return text.startswith(("Error", "An unexpected error occurred"))
+
+
+def split_fused_response(text):
+    """
+    Splits a fused response into (description, content_package).
+    """
+    if PACKAGE_MARKER in text:
+        description, content_package = text.split(PACKAGE_MARKER, 1)
+    else:
+        # The model dropped the marker; fall back to the first package heading
+        heading = text.find("## 🎨")
+        if heading == -1:
+            return text.strip(), text.strip()
+        description, content_package = text[:heading], text[heading:]
+
+    description = description.strip()
+    if description.startswith("## Image Description"):
+        description = description[len("## Image Description"):].strip()
+    return description, content_package.strip()
+
+
+def analyze_and_generate(image_file):
+    """
+    Analyzes an image and generates its content package in one multimodal request.
+    Returns (description, content_package); on failure both are the error string.
+    """
+    if not gemini_client.API_KEY:
+        error = "Error: GOOGLE_API_KEY is not set."
+        return error, error
+
+    try:
+        ingested = vision.ingest_image(vision.read_image_file(image_file))
+        def build_payload(transport):
+            return gemini_client.build_payload(
+                [{"text": FUSED_PROMPT}, vision.image_part(ingested.image_bytes, ingested.mime_type, transport)],
+                FUSED_GENERATION_CONFIG
+            )
+
+        key = cache.make_key(ingested.image_bytes, FUSED_PROMPT, FUSED_GENERATION_CONFIG)
+        text = fused_in_flight.do(
+            key, lambda: vision.generate_with_images(build_payload, [ingested.image_bytes]).text
+        )
+        if is_error(text):
+            return text, text
+        return split_fused_response(text)
+
+    except requests.exceptions.RequestException as e:
+        error = f"Error making API request: {str(e)}"
+    except Exception as e:
+        error = f"An unexpected error occurred: {str(e)}"
+    return error, error
+
+
+def run_pipeline(image_file, fused=False):
+    """
+    Runs the full image-to-content pipeline and returns (description, content_package).
+    The two-step path analyzes the image first and then generates from the description;
+    the fused path does both in a single request.
+    """
+    if fused:
+        return analyze_and_generate(image_file)
+
+    description = vision.analyze_image(image_file)
+    if is_error(description):
+        return description, description
+    return description, language.generate_content(description)
+
+
+def analyze_and_generate_carousel(image_files):
+    """
+    Analyzes the images of a carousel post and writes one content package
+    for the set, all in a single multimodal request. Returns (descriptions,
+    summary, content_package) with one description per image; on failure the
+    descriptions are empty and the summary and package are the error string.
+    """
+    error = vision.check_carousel(image_files)
+    if error:
+        return [], error, error
+
+    try:
+        prepared = vision.prepare_images(image_files)
+        if prepared is None:
+            error = f"Error: The images don't fit in {vision.CAROUSEL_MAX_BYTES // (1024 * 1024)} MB even when downscaled."
+            return [], error, error
+
+        prompt = CAROUSEL_PACKAGE_PROMPT.format(
+            analysis=vision.CAROUSEL_PROMPT.format(count=len(image_files)),
+            instructions=language.CONTENT_PACKAGE_INSTRUCTIONS
+        )
+        generation_config = vision.carousel_config(
+            len(image_files),
+            extra_properties={"content_package": {"type": "STRING"}},
+            extra_tokens=language.GENERATION_CONFIG["maxOutputTokens"]
+        )
+        text = vision.generate_with_images(
+            lambda transport: gemini_client.build_payload(vision.carousel_parts(prompt, prepared, transport),
+                                                          generation_config),
+            [image_bytes for image_bytes, _ in prepared]
+        ).text
+        if is_error(text):
+            return [], text, text
+
+        data = vision.parse_carousel(text, len(image_files))
+        if not isinstance(data.get("content_package"), str):
+            raise ValueError("missing content package")
+        return data["descriptions"], data["summary"], data["content_package"]
+
+    except requests.exceptions.RequestException as e:
+        error = f"Error making API request: {str(e)}"
+    except ValueError as e:
+        error = f"Error parsing API response: {str(e)}"
+    except Exception as e:
+        error = f"An unexpected error occurred: {str(e)}"
+    return [], error, error
+
+
+def save_to_history(image_bytes, result, filename="", session=""):
+    """
+    Stores a finished package in the history with a thumbnail of the image
+    and returns its entry id, or None if the history could not be written.
+    """
+    try:
+        with metrics.span("history.save"):
+            return history.get_history().add(
+                cache.content_hash(image_bytes), result["description"], result["content_package"], result["package"],
+                thumbnail=history.make_thumbnail(vision.ingest_image(image_bytes).preview),
+                timings=result["breakdown"].get("timings"), filename=filename, session=session
+            )
+    except (sqlite3.Error, OSError):
+        # Losing a history entry must not lose the package itself
+        metrics.incr("history.errors")
+        return None
+
+
+def run_package_job(job, image_bytes, fused=False, structured=False, session="", filename=""):
+    """
+    Background job (see jobs.py) for one upload: analyzes the image and writes
+    its content package, reporting progress and the package as it streams in.
+    Token usage is attributed to `session`. Returns a dict with
+    "description", "content_package", "package" (the ContentPackage in
+    structured mode), the per-stage "breakdown", "history_id" (its history
+    entry, if saved), the "model" that wrote the package and the "usage" of
+    its calls (see usage.summarize); on failure "error" holds the error
+    string and "stage" where it happened.
+    """
+    breakdown = {}
+    with metrics.collect(breakdown), usage.session_scope(session), usage.collect_calls() as calls:
+        result = _package_steps(job, image_bytes, fused, structured)
+    result["breakdown"] = breakdown
+    result["model"], result["usage"] = usage.summarize(calls)
+
+    if "error" not in result and history.ENABLED:
+        result["history_id"] = save_to_history(image_bytes, result, filename, session)
+    return result
+
+
+def _package_steps(job, image_bytes, fused, structured):
+    """
+    The model work of run_package_job, returning its result without the
+    breakdown and usage.
+    """
+    result = {"package": None}
+    job.update(progress=10, message="🔍 Analyzing your image...")
+    with metrics.span("step.analyze"):
+        if fused:
+            description, content_package = analyze_and_generate(io.BytesIO(image_bytes))
+        else:
+            description = vision.analyze_image(io.BytesIO(image_bytes))
+    if is_error(description):
+        return dict(result, error=description, stage="analysis")
+
+    job.update(progress=50, message="🎨 Generating creative content...")
+    if structured and not fused:
+        with metrics.span("step.generate"):
+            package = language.generate_package(description)
+        if isinstance(package, str):
+            return dict(result, error=package, stage="generation")
+        content_package = package.to_markdown()
+        result["package"] = package
+    elif not fused:
+        with metrics.span("step.generate"):
+            content_package = ""
+            for chunk in language.generate_content_stream(description):
+                if gemini_client.is_cut_off(chunk):
+                    return dict(result, error=chunk, stage="generation")
+                content_package += chunk
+                job.update(partial=content_package)
+    if is_error(content_package):
+        return dict(result, error=content_package, stage="generation")
+
+    return dict(result, description=description, content_package=content_package, history_id=None)
+
+
+def run_carousel_job(job, images, session=""):
+    """
+    Background job for a carousel: analyze_and_generate_carousel over the
+    image bytes in `images`, with token usage attributed to `session`.
+    Returns a dict with "descriptions", "summary" and "content_package", or
+    "error".
+    """
+    job.update(progress=10, message="🔍 Analyzing your carousel and writing its content package...")
+    with usage.session_scope(session):
+        descriptions, summary, content_package = analyze_and_generate_carousel(
+            [io.BytesIO(image_bytes) for image_bytes in images]
+        )
+    if is_error(summary):
+        return {"error": summary}
+    return {"descriptions": descriptions, "summary": summary, "content_package": content_package}
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+# Quota to stay under; 0 disables that bucket
+REQUESTS_PER_MINUTE = float(os.getenv("GEMINI_RPM", "0"))
+TOKENS_PER_MINUTE = float(os.getenv("GEMINI_TPM", "0"))
+
+# Rough token cost of an inline image, used when estimating request size
+IMAGE_TOKENS = 258
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `per_minute` / 60 per second,
+    holding at most one minute's worth. A rate of 0 means unlimited.
+    """
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.rate:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """
+        Seconds until `amount` is available (0 if it is available now).
+        """
+        if not self.rate:
+            return 0.0
+        # Requests larger than the bucket only need it to be full
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+
+class RateLimiter:
+    """
+    Process-wide limiter combining a requests-per-minute and a tokens-per-minute
+    bucket. Callers block in `acquire` until both have capacity.
+    """
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._condition = threading.Condition()
+        self._waiting = 0
+
+    def acquire(self, tokens=0, deadline=None):
+        """
+        Waits for one request slot and `tokens` tokens. Returns False without
+        taking anything if they would not be available before `deadline`
+        (a time.monotonic() value).
+        """
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait <= 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        return True
+                    if deadline is not None and now + wait > deadline:
+                        return False
+                    self._condition.wait(wait)
+            finally:
+                self._waiting -= 1
+
+    def queue_depth(self):
+        """
+        Number of callers currently waiting for capacity.
+        """
+        return self._waiting
+
+
+def estimate_tokens(payload):
+    """
+    Estimates the input tokens of a generateContent payload: about four
+    characters per token of text plus a fixed cost per image.
+    """
+    tokens = 0
+    for content in payload.get("contents", []):
+        for part in content.get("parts", []):
+            if "text" in part:
+                tokens += len(part["text"]) // 4 + 1
+            else:
+                tokens += IMAGE_TOKENS
+    return tokens
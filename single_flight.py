@@ -0,0 +1,119 @@
+import copy
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+
+import cache
+import metrics
+
+# Also coalesce across processes sharing CACHE_DIR (Unix only): the first process
+# to take a key's lock file makes the call and the others find its result in the cache
+CROSS_PROCESS = os.getenv("GEMINI_SINGLE_FLIGHT_PROCESSES", "0") == "1"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function and everyone who arrives while it is in flight waits for it and
+    gets the same result, or the same exception.
+    """
+
+    def __init__(self, cross_process=CROSS_PROCESS, lock_dir=None):
+        self.cross_process = cross_process
+        self.lock_dir = lock_dir
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function, recheck=None):
+        """
+        Returns function() for `key`, sharing one call among concurrent
+        callers. With cross-process coalescing on, `recheck()` is called once
+        the process lock is held and a result other than None is returned
+        instead of calling `function`.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            metrics.incr("single_flight.shared")
+            call.done.wait()
+            if call.error is not None:
+                # Each waiter raises its own exception, so none of them rewrites the leader's traceback
+                raise _fresh(call.error) from call.error
+            return call.result
+
+        try:
+            with self._process_lock(key, enabled=recheck is not None):
+                result = recheck() if recheck is not None and self.cross_process else None
+                call.result = function() if result is None else result
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """
+        Number of keys with a call in progress.
+        """
+        with self._lock:
+            return len(self._calls)
+
+    @contextmanager
+    def _process_lock(self, key, enabled=True):
+        """
+        Holds a lock file of this key's own, so only calls for the same key
+        wait for each other. The holder removes the file when done; a
+        process that locked a file which was removed meanwhile tries again.
+        """
+        lock_dir = self.lock_dir or (os.path.join(cache.CACHE_DIR, "locks") if cache.CACHE_DIR else None)
+        if not (enabled and self.cross_process and lock_dir):
+            yield
+            return
+        try:
+            import fcntl
+        except ImportError:  # Not available on Windows; coalesce within this process only
+            yield
+            return
+
+        os.makedirs(lock_dir, exist_ok=True)
+        path = os.path.join(lock_dir, f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.lock")
+        while True:
+            lock_file = open(path, "a+")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+        try:
+            yield
+        finally:
+            os.unlink(path)
+            lock_file.close()
+
+
+def _fresh(error):
+    """
+    A copy of `error` without its traceback, or a RuntimeError if it can't be copied.
+    """
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError(f"Shared call failed: {error!r}")
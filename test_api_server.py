@@ -0,0 +1,75 @@
+import io
+
+import pytest
+import requests
+from aiohttp import web
+from PIL import Image
+
+import api_server
+
+
+def _jpeg():
+    image_file = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").save(image_file, format="JPEG")
+    return image_file.getvalue()
+
+
+@pytest.fixture
+def api(mock_gemini):
+    mock_gemini()
+    base_url, stop = api_server.serve_in_background(max_pending=2)
+    yield base_url
+    stop()
+
+
+@pytest.mark.parametrize("body", [{"description": 5}, {"description": ""}, {"description": "  "},
+                                  {"text": "A beach"}, ["A beach"]])
+def test_generate_rejects_invalid_descriptions(api, body):
+    response = requests.post(f"{api}/v1/generate", json=body)
+
+    assert response.status_code == 400
+    assert "description" in response.json()["error"]
+
+
+def test_batch_larger_than_the_pending_limit_is_turned_away(api):
+    def batch(count):
+        files = [("image", (f"{index}.jpg", _jpeg(), "image/jpeg")) for index in range(count)]
+        return requests.post(f"{api}/v1/packages/batch", files=files)
+
+    response = batch(3)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    assert batch(2).status_code == 200
+
+
+def test_reservations_are_checked_and_taken_together():
+    limiter = api_server.Limiter(concurrency=1, max_pending=3)
+
+    with limiter.reserve(2) as first:
+        assert limiter.pending == 2
+        with pytest.raises(web.HTTPServiceUnavailable):
+            with limiter.reserve(2):
+                pass
+        assert limiter.pending == 2
+        first.extend(1)
+        first.use()
+        assert limiter.pending == 2
+    assert limiter.pending == 0
+    limiter.close()
+
+
+def test_uploads_that_are_not_images_are_rejected(api):
+    response = requests.post(f"{api}/v1/packages", files={"image": ("notes.jpg", b"plain text" * 1000, "image/jpeg")})
+
+    assert response.status_code == 400
+    assert "not a supported image" in response.json()["error"]
+
+
+def test_batch_bytes_are_capped(api, monkeypatch):
+    monkeypatch.setattr(api_server, "BATCH_MAX_BYTES", len(_jpeg()) + 1)
+    files = [("image", (f"{index}.jpg", _jpeg(), "image/jpeg")) for index in range(2)]
+
+    response = requests.post(f"{api}/v1/packages/batch", files=files)
+
+    assert response.status_code == 413
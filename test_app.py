@@ -0,0 +1,56 @@
+import ast
+import os
+
+import pytest
+
+import history
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """
+    The Streamlit app under AppTest, with a fake key and an in-memory history.
+    """
+    testing = pytest.importorskip("streamlit.testing.v1")
+    monkeypatch.setattr(history, "ENABLED", True)
+    monkeypatch.setattr(history, "_history", history.HistoryStore())
+    app = testing.AppTest.from_file(APP_PATH, default_timeout=60)
+    app.secrets["GOOGLE_API_KEY"] = "mock-key"
+    return app
+
+
+def test_opened_results_survive_reruns(app):
+    entry_id = history.get_history().add("hash", "A lighthouse at dusk", "## 🎨 Captions\nGuiding light.",
+                                         filename="lighthouse.jpg")
+    app.run()
+    app.button(key=f"history_open_{entry_id}").click().run()
+    assert app.session_state["history_entry"] == entry_id
+
+    # Any widget interaction reruns the whole script
+    app.text_input(key="history_query").input("nothing matches this").run()
+
+    assert not app.exception
+    assert app.session_state["history_entry"] == entry_id
+    assert any("lighthouse.jpg" in markdown.value for markdown in app.markdown)
+
+
+def test_app_imports_only_streamlit_before_first_render():
+    with open(APP_PATH, encoding="utf-8") as app_file:
+        tree = ast.parse(app_file.read())
+    imported = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            imported.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            imported.add(node.module.split(".")[0])
+
+    assert not imported & {"PIL", "numpy", "requests", "gemini_client", "vision", "language", "pipeline"}
+
+
+def test_first_render_starts_without_errors(app):
+    app.run()
+
+    assert not app.exception
+    assert app.get("file_uploader")
@@ -0,0 +1,38 @@
+import json
+
+from PIL import Image
+
+import batch
+
+
+def _images(directory, count):
+    paths = []
+    for index in range(count):
+        path = directory / f"image{index}.jpg"
+        Image.new("RGB", (64, 64), (index * 40, 80, 120)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_checkpoint_records_successes_and_retries_failures(mock_gemini, tmp_path):
+    mock_gemini()
+    paths = _images(tmp_path, 3) + [str(tmp_path / "missing.jpg")]
+    output, checkpoint = str(tmp_path / "out.jsonl"), str(tmp_path / "out.done")
+
+    assert batch.run_batch(paths, output, checkpoint, workers=2) == (3, 1)
+    assert batch.load_checkpoint(checkpoint) == set(paths[:3])
+
+    # Only the failed image is tried again
+    assert batch.run_batch(paths, output, checkpoint, workers=2) == (0, 1)
+    with open(output, encoding="utf-8") as records:
+        assert [json.loads(line)["image"] for line in records][-1] == paths[-1]
+
+
+def test_skip_errors_checkpoints_failures(mock_gemini, tmp_path):
+    mock_gemini()
+    paths = _images(tmp_path, 1) + [str(tmp_path / "missing.jpg")]
+    output, checkpoint = str(tmp_path / "out.jsonl"), str(tmp_path / "out.done")
+
+    assert batch.run_batch(paths, output, checkpoint, skip_errors=True) == (1, 1)
+    assert batch.load_checkpoint(checkpoint) == set(paths)
+    assert batch.run_batch(paths, output, checkpoint, skip_errors=True) == (0, 0)
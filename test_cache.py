@@ -0,0 +1,50 @@
+import io
+
+from PIL import Image
+
+import cache
+import vision
+
+
+def test_memory_tier_drops_least_recently_used():
+    analysis_cache = cache.AnalysisCache(memory_entries=2)
+    analysis_cache.set("a", "1")
+    analysis_cache.set("b", "2")
+    assert analysis_cache.get("a") == "1"
+    analysis_cache.set("c", "3")
+
+    assert analysis_cache.get("b") is None
+    assert analysis_cache.get("a") == "1" and analysis_cache.get("c") == "3"
+
+
+def test_disk_tier_outlives_the_process_and_is_bounded(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    analysis_cache = cache.AnalysisCache(path, disk_entries=2)
+    for key in "abc":
+        analysis_cache.set(key, key.upper())
+    assert analysis_cache.stats()["disk_size"] == 2
+
+    reopened = cache.AnalysisCache(path, disk_entries=2)
+    assert reopened.get("c") == "C"
+    assert reopened.stats()["disk_hits"] == 1
+
+
+def test_keys_depend_on_image_prompt_and_config():
+    key = cache.make_key(b"image", "Describe it", {"temperature": 0.3})
+
+    assert key == cache.make_key(b"image", "Describe it", {"temperature": 0.3})
+    assert key != cache.make_key(b"other", "Describe it", {"temperature": 0.3})
+    assert key != cache.make_key(b"image", "Describe it briefly", {"temperature": 0.3})
+    assert key != cache.make_key(b"image", "Describe it", {"temperature": 0.7})
+
+
+def test_repeat_image_is_answered_from_the_cache(mock_gemini):
+    server = mock_gemini()
+    image_file = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").save(image_file, format="JPEG")
+
+    first = vision.analyze_image(io.BytesIO(image_file.getvalue()))
+    second = vision.analyze_image(io.BytesIO(image_file.getvalue()))
+
+    assert first == second and not first.startswith("Error")
+    assert server.stats["requests"] == 1
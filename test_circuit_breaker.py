@@ -0,0 +1,63 @@
+import gemini_client
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitBreaker
+
+
+def test_soft_failures_open_the_circuit_after_the_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=10)
+    for now in range(2):
+        breaker.record_failure(now, "Timeout")
+    assert breaker.state == CLOSED and breaker.allow(2)
+
+    breaker.record_failure(2, "Timeout")
+    assert breaker.state == OPEN
+    assert not breaker.allow(5)
+
+
+def test_half_open_admits_a_single_trial():
+    breaker = CircuitBreaker(cooldown=10, trial_timeout=30)
+    breaker.record_failure(0, "404 model not found", hard=True)
+
+    assert breaker.allow(10)
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow(11)
+    assert not breaker.allow(12)
+
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow(13) and breaker.allow(13)
+
+
+def test_failed_trial_reopens_and_silent_trial_expires():
+    breaker = CircuitBreaker(cooldown=10, trial_timeout=30)
+    breaker.record_failure(0, "404 model not found", hard=True)
+    assert breaker.allow(10)
+    breaker.record_failure(11, "Timeout")
+    assert breaker.state == OPEN and not breaker.allow(15)
+
+    assert breaker.allow(21)
+    assert not breaker.allow(50)
+    assert breaker.allow(51)  # The trial never reported back
+
+    breaker.release()
+    assert breaker.allow(52)
+
+
+def test_registry_lets_one_caller_probe_a_recovering_model():
+    registry = BreakerRegistry(cooldown=0)
+    registry.record_failure("gemini-2.5-pro", "404 model not found", hard=True)
+
+    assert registry.available(["gemini-2.0-flash", "gemini-2.5-pro"]) == ["gemini-2.0-flash", "gemini-2.5-pro"]
+    assert registry.available(["gemini-2.0-flash", "gemini-2.5-pro"]) == ["gemini-2.0-flash"]
+
+
+def test_quota_errors_leave_breakers_and_stats_alone(mock_gemini):
+    mock_gemini(error_rate=1.0, error_status=429)
+    gemini_client.RETRY_DEADLINE, deadline = 0.0, gemini_client.RETRY_DEADLINE
+    try:
+        payload = gemini_client.build_payload([{"text": "Hello"}], {"maxOutputTokens": 8})
+        for _ in range(5):
+            assert gemini_client.generate(payload).startswith("Error: Rate limit")
+    finally:
+        gemini_client.RETRY_DEADLINE = deadline
+
+    assert gemini_client.breakers.available(gemini_client.MODELS) == gemini_client.MODELS
+    assert all(gemini_client.model_stats.error_rate(model_name) == 0.0 for model_name in gemini_client.MODELS)
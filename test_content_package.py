@@ -0,0 +1,43 @@
+import pytest
+
+import content_package
+import language
+from content_package import ContentPackage
+
+
+def test_generated_package_has_every_section(mock_gemini):
+    server = mock_gemini()
+
+    package = language.generate_package("A lighthouse at dusk", local_hashtags=False)
+
+    assert isinstance(package, ContentPackage)
+    assert all(tag.startswith("#") for tag in package.trending_hashtags)
+    assert "## 🎨" in package.to_markdown()
+    assert server.stats["requests"] == 1
+
+
+def test_regenerating_a_section_keeps_the_others(mock_gemini):
+    mock_gemini()
+    first = language.generate_package("A lighthouse at dusk", local_hashtags=False)
+
+    second = language.generate_package("A lighthouse at dusk", sections=["witty_caption"], local_hashtags=False)
+
+    assert second.with_sections({"witty_caption": first.witty_caption}) == first
+
+
+def test_unknown_sections_are_rejected(mock_gemini):
+    mock_gemini()
+
+    assert language.generate_package("A lighthouse", sections=["limerick"]).startswith("Error")
+
+
+def test_sections_are_validated_and_hashtags_normalised():
+    parsed = content_package.parse_sections(
+        {"mood": " Calm ", "niche_hashtags": ["sea views", "#coast"]}, ["mood", "niche_hashtags"]
+    )
+    assert parsed["niche_hashtags"] == ["#seaviews", "#coast"]
+
+    with pytest.raises(ValueError):
+        content_package.parse_sections({"mood": ""}, ["mood"])
+    with pytest.raises(ValueError):
+        content_package.parse_sections('{"engagement_tips": "not a list"}', ["engagement_tips"])
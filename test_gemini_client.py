@@ -0,0 +1,67 @@
+import io
+import time
+
+from PIL import Image
+
+import gemini_client
+import language
+import vision
+from model_stats import ModelStats
+
+
+def _jpeg():
+    image_file = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").save(image_file, format="JPEG")
+    return image_file.getvalue()
+
+
+def test_vision_and_language_share_pooled_connections(mock_gemini):
+    server = mock_gemini()
+
+    description = vision.analyze_image(io.BytesIO(_jpeg()))
+    content = language.generate_content(description, local_hashtags=False)
+
+    assert not description.startswith("Error") and not content.startswith("Error")
+    assert server.stats["requests"] == 2
+    assert server.stats["connections"] == 1
+
+
+def _payload():
+    return gemini_client.build_payload([{"text": "Hello"}], {"maxOutputTokens": 8})
+
+
+def test_slow_model_is_hedged_with_the_next_one(mock_gemini, monkeypatch):
+    slow, fast = gemini_client.MODELS[:2]
+    server = mock_gemini(model_latency={slow: 3.0})
+    monkeypatch.setattr(gemini_client, "HEDGE_DEFAULT_DELAY", 0.1)
+    monkeypatch.setattr(gemini_client, "HEDGE_MIN_DELAY", 0.05)
+
+    start = time.monotonic()
+    result = gemini_client.generate_result(_payload(), models=[slow, fast], hedge=True)
+
+    assert result.model == fast and not result.is_error
+    assert time.monotonic() - start < 2.0
+    assert server.stats["requests"] == 2
+
+
+def test_hedge_delay_follows_recent_latency(monkeypatch):
+    stats = ModelStats()
+    monkeypatch.setattr(gemini_client, "model_stats", stats)
+    model_name = gemini_client.MODELS[0]
+    assert gemini_client.hedge_delay(model_name, 30) == gemini_client.HEDGE_DEFAULT_DELAY
+
+    for latency in (1.0, 1.0, 1.0, 1.0, 2.0):
+        stats.record(model_name, latency, True)
+    assert 1.0 <= gemini_client.hedge_delay(model_name, 30) <= 2.0
+    assert gemini_client.hedge_delay(model_name, 0.5) == 0.5
+
+
+def test_models_are_ordered_by_latency_and_errors():
+    stats = ModelStats()
+    first, second, third = gemini_client.MODELS[:3]
+    for _ in range(5):
+        stats.record(first, 3.0, True)
+        stats.record(second, 1.0, True)
+        stats.record(third, 0.5, False)
+
+    assert stats.ordered([first, second, third]) == [second, first, third]
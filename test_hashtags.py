@@ -0,0 +1,57 @@
+import pytest
+
+import hashtags
+
+ROWS = [
+    ("trending", "#love", 100.0, ["*", "love"]),
+    ("trending", "#sunset", 60.0, ["sunset", "sky"]),
+    ("trending", "#beach", 80.0, ["beach", "sea"]),
+    ("niche", "#goldenhour", 40.0, ["sunset", "golden", "light"]),
+    ("niche", "#coastalliving", 30.0, ["beach", "coast"]),
+    ("community", "#travelgram", 50.0, ["*", "travel"]),
+]
+
+
+@pytest.fixture
+def index(tmp_path):
+    path = str(tmp_path / "hashtags.idx")
+    hashtags.build_index(ROWS, path)
+    return hashtags.HashtagIndex(path)
+
+
+def test_tags_matching_more_keywords_rank_first(index):
+    suggestions = index.suggest("A sunset over the sky at the beach", count=2)
+
+    assert suggestions["trending_hashtags"] == ["#sunset", "#beach"]
+    assert suggestions["niche_hashtags"] == ["#goldenhour", "#coastalliving"]
+
+
+def test_tiers_are_filled_with_general_then_popular_tags(index):
+    suggestions = index.suggest("A quiet library", count=2)
+
+    assert suggestions["trending_hashtags"] == ["#love", "#beach"]
+    assert suggestions["community_hashtags"] == ["#travelgram"]
+
+
+def test_excluded_tags_are_skipped(index):
+    suggestions = index.suggest("sunset sky", count=1, exclude=["#Sunset"])
+
+    assert suggestions["trending_hashtags"] == ["#love"]
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / "not-an-index"
+    path.write_bytes(b"\0" * hashtags.HEADER.size)
+
+    with pytest.raises(ValueError):
+        hashtags.HashtagIndex(str(path))
+
+
+def test_bundled_source_builds(tmp_path):
+    path = str(tmp_path / "hashtags.idx")
+    hashtags.build_index(hashtags.read_source(), path)
+
+    suggestions = hashtags.HashtagIndex(path).suggest("A romantic couple at the beach")
+
+    assert all(len(tags) == hashtags.TAGS_PER_TIER for tags in suggestions.values())
+    assert "#love" in suggestions["trending_hashtags"]
@@ -0,0 +1,46 @@
+import history
+
+
+def _package(caption, *tags):
+    return f"## 🎨 Captions\n{caption}\n\n## #️⃣ Hashtag Recommendations\n{' '.join(tags)}"
+
+
+def test_pages_walk_back_by_keyset():
+    store = history.HistoryStore()
+    ids = [store.add(f"hash{number}", f"Photo {number}", _package(f"Caption {number}")) for number in range(25)]
+
+    seen, cursor = [], None
+    while True:
+        entries, cursor = store.page(before=cursor, limit=10)
+        seen.append([entry["id"] for entry in entries])
+        if cursor is None:
+            break
+
+    assert [len(page) for page in seen] == [10, 10, 5]
+    assert sum(seen, []) == ids[::-1]
+
+
+def test_search_matches_every_word_as_a_prefix():
+    store = history.HistoryStore()
+    beach = store.add("a", "A beach", _package("Salty air and golden light", "#beachlife", "#sunset"))
+    store.add("b", "A city", _package("Neon nights downtown", "#citylights"))
+    store.add("c", "A forest", _package("Golden leaves underfoot", "#autumn"))
+
+    assert [entry["id"] for entry in store.page("golden beachl")[0]] == [beach]
+    assert len(store.page("golden")[0]) == 2
+    # Quotes and operators are words to match, not query syntax
+    assert store.page('neon" OR "golden')[0] == []
+
+
+def test_updates_are_searchable_and_old_entries_dropped():
+    store = history.HistoryStore(max_entries=2)
+    first = store.add("a", "A beach", _package("Waves"))
+    store.update(first, _package("Tides rolling in"))
+    assert store.page("tides")[0][0]["id"] == first
+    assert not store.page("waves")[0]
+
+    store.add("b", "A city", _package("Lights"))
+    latest = store.add("a", "A beach again", _package("Sand"))
+
+    assert len(store) == 2 and store.get(first) is None
+    assert store.latest_for_image("a")["id"] == latest
@@ -0,0 +1,53 @@
+import random
+
+import image_index
+
+
+def test_find_returns_closest_entry_within_threshold():
+    index = image_index.PerceptualIndex(threshold=2)
+    rng = random.Random(3)
+    stored = [rng.getrandbits(64) for _ in range(1000)]
+    for number, image_hash in enumerate(stored):
+        index.add(image_hash, f"description {number}")
+
+    assert index.find(stored[42]) == ("description 42", 0)
+    assert index.find(stored[42] ^ 0b101) == ("description 42", 2)
+    assert index.find(stored[42] ^ 0b10101) is None
+
+
+def test_entries_only_match_within_their_scope():
+    index = image_index.PerceptualIndex(threshold=2)
+    index.add(0x0123456789ABCDEF, "described with prompt A", scope="a")
+
+    assert index.find(0x0123456789ABCDEF, scope="a") == ("described with prompt A", 0)
+    assert index.find(0x0123456789ABCDEF, scope="b") is None
+
+
+def test_negative_threshold_turns_lookups_off():
+    index = image_index.PerceptualIndex(threshold=-1)
+    index.add(0x0123456789ABCDEF, "description")
+
+    assert index.find(0x0123456789ABCDEF) is None
+
+
+def test_reuse_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(image_index, "_image_index", None)
+    monkeypatch.setattr(image_index.cache, "CACHE_DIR", "")
+
+    assert not image_index.SIMILAR_REUSE
+    assert image_index.get_image_index().threshold < 0
+
+
+def test_unscoped_index_is_dropped(tmp_path):
+    path = str(tmp_path / "index.sqlite3")
+    index = image_index.PerceptualIndex(path=path)
+    index._db.execute("DROP TABLE hashes")
+    index._db.execute("CREATE TABLE hashes (id INTEGER PRIMARY KEY, hash INTEGER NOT NULL, value TEXT NOT NULL,"
+                      " created_at REAL NOT NULL, c0 INTEGER, c1 INTEGER, c2 INTEGER, c3 INTEGER)")
+    index._db.execute("INSERT INTO hashes VALUES (1, 5, 'old', 0, 5, 0, 0, 0)")
+    index._db.commit()
+
+    reopened = image_index.PerceptualIndex(path=path)
+    assert len(reopened) == 0
+    reopened.add(5, "new")
+    assert len(reopened) == 1
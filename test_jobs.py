@@ -0,0 +1,60 @@
+import threading
+import time
+
+from jobs import DONE, FAILED, QUEUED, JobQueue
+
+
+def _finished(queue, job_id):
+    while True:
+        job = queue.status(job_id)
+        if job["finished_at"] is not None:
+            return job
+        time.sleep(0.01)
+
+
+def test_job_reports_progress_and_result():
+    queue = JobQueue(workers=1)
+
+    def work(job, value, scale=1):
+        job.update(progress=50, message="Halfway", partial="partial text")
+        return value * scale
+
+    job = _finished(queue, queue.submit(work, 21, scale=2))
+
+    assert job["status"] == DONE and job["result"] == 42
+    assert job["progress"] == 100 and job["partial"] == "partial text"
+
+
+def test_failed_job_keeps_its_error():
+    queue = JobQueue(workers=1)
+
+    def work(job):
+        raise RuntimeError("boom")
+
+    job = _finished(queue, queue.submit(work))
+
+    assert job["status"] == FAILED and job["error"] == "boom"
+
+
+def test_jobs_wait_for_a_free_worker():
+    queue = JobQueue(workers=1)
+    release = threading.Event()
+    first = queue.submit(lambda job: release.wait(5))
+    second = queue.submit(lambda job: "done")
+
+    assert queue.status(second)["status"] == QUEUED
+    assert queue.queue_depth() >= 1
+    release.set()
+    assert _finished(queue, second)["result"] == "done"
+    assert _finished(queue, first)["status"] == DONE
+
+
+def test_finished_jobs_expire():
+    queue = JobQueue(workers=1, ttl=0.05)
+    job_id = queue.submit(lambda job: None)
+    _finished(queue, job_id)
+    time.sleep(0.1)
+
+    queue.submit(lambda job: None)  # Expired jobs are dropped when the next one arrives
+
+    assert queue.status(job_id) is None
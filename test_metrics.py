@@ -0,0 +1,47 @@
+import time
+
+import requests
+
+import gemini_client
+import metrics
+from jobs import DONE, JobQueue
+
+
+def test_hedged_calls_add_to_the_callers_breakdown(mock_gemini):
+    mock_gemini()
+    payload = gemini_client.build_payload([{"text": "Hello"}], {"maxOutputTokens": 8})
+
+    with metrics.collect() as breakdown:
+        assert not gemini_client.generate(payload, hedge=True).startswith("Error")
+
+    assert breakdown["timings"]["api.request"] > 0
+    assert breakdown["timings"]["api.parse"] > 0
+
+
+def test_job_workers_add_to_the_submitters_breakdown():
+    queue = JobQueue(workers=1)
+
+    def work(job):
+        with metrics.span("work"):
+            metrics.incr("work.items", 3)
+
+    with metrics.collect() as breakdown:
+        job_id = queue.submit(work)
+    while queue.status(job_id)["status"] != DONE:
+        time.sleep(0.01)
+
+    assert breakdown["counters"]["work.items"] == 3
+    assert "work" in breakdown["timings"]
+    assert metrics.current_collector() is None
+
+
+def test_server_listens_on_loopback_by_default(monkeypatch):
+    monkeypatch.setattr(metrics, "_server", None)
+    port = metrics.start_server(port=0)
+    server = metrics._server
+    try:
+        assert server.server_address[0] == "127.0.0.1"
+        assert requests.get(f"http://127.0.0.1:{port}/metrics.json").json().keys() == {"counters", "timings"}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,45 @@
+import io
+
+from PIL import Image
+
+import pipeline
+
+FUSED_TEXT = f"""## Image Description
+A lighthouse on a cliff at dusk.
+{pipeline.PACKAGE_MARKER}
+## 🎨 Captions
+Guiding light."""
+
+
+def _jpeg():
+    image_file = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").save(image_file, format="JPEG")
+    return image_file.getvalue()
+
+
+def test_fused_pipeline_makes_one_request(mock_gemini):
+    server = mock_gemini(response_text=FUSED_TEXT)
+
+    description, content_package = pipeline.run_pipeline(io.BytesIO(_jpeg()), fused=True)
+
+    assert description == "A lighthouse on a cliff at dusk."
+    assert content_package == "## 🎨 Captions\nGuiding light."
+    assert server.stats["requests"] == 1
+
+
+def test_fused_response_without_marker_splits_at_first_heading():
+    description, content_package = pipeline.split_fused_response(
+        FUSED_TEXT.replace(pipeline.PACKAGE_MARKER + "\n", "")
+    )
+
+    assert description == "A lighthouse on a cliff at dusk."
+    assert content_package.startswith("## 🎨 Captions")
+
+
+def test_fused_errors_are_returned_for_both_parts(mock_gemini):
+    mock_gemini(error_rate=1.0, error_status=400)
+
+    description, content_package = pipeline.analyze_and_generate(io.BytesIO(_jpeg()))
+
+    assert description == content_package
+    assert description.startswith("Error")
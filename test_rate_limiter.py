@@ -0,0 +1,59 @@
+import time
+
+import gemini_client
+from rate_limiter import IMAGE_TOKENS, RateLimiter, TokenBucket, estimate_tokens
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    assert bucket.wait_time(1) == 1.0
+
+    bucket.refill(bucket.updated + 30)
+    assert bucket.level == 30 and bucket.wait_time(30) == 0.0
+    bucket.refill(bucket.updated + 600)
+    assert bucket.level == 60  # Never more than a minute's worth
+    assert bucket.wait_time(1000) == 0.0  # Oversized requests only need a full bucket
+
+
+def test_unlimited_bucket_never_waits():
+    bucket = TokenBucket(per_minute=0)
+    bucket.take(10 ** 6)
+    assert bucket.wait_time(10 ** 6) == 0.0
+
+
+def test_acquire_refuses_what_the_deadline_cannot_cover():
+    limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=600)
+    assert limiter.acquire(tokens=600)
+
+    assert not limiter.acquire(tokens=10, deadline=time.monotonic() + 0.1)
+    assert limiter.acquire(deadline=time.monotonic() + 2.0)  # One request slot refills in a second
+
+
+def test_estimate_counts_text_and_images():
+    payload = gemini_client.build_payload(
+        [{"text": "x" * 400}, {"inline_data": {"mime_type": "image/jpeg", "data": ""}}], {}
+    )
+    assert estimate_tokens(payload) == 101 + IMAGE_TOKENS
+
+
+def test_quota_errors_are_retried_after_the_servers_delay(mock_gemini):
+    server = mock_gemini(error_rate=0.5, error_status=429, retry_after=0, seed=3)
+    payload = gemini_client.build_payload([{"text": "Hello"}], {"maxOutputTokens": 8})
+
+    results = [gemini_client.generate(payload, models=gemini_client.MODELS[:1]) for _ in range(6)]
+
+    assert not any(text.startswith("Error") for text in results)
+    assert server.stats["errors"] > 0
+    assert server.stats["requests"] == 6 + server.stats["errors"]
+
+
+def test_requests_over_the_local_limit_are_refused(mock_gemini, monkeypatch):
+    server = mock_gemini()
+    monkeypatch.setattr(gemini_client, "rate_limiter", RateLimiter(requests_per_minute=1))
+    monkeypatch.setattr(gemini_client, "RETRY_DEADLINE", 0.1)
+    payload = gemini_client.build_payload([{"text": "Hello"}], {"maxOutputTokens": 8})
+
+    assert not gemini_client.generate(payload).startswith("Error")
+    assert gemini_client.generate(payload).startswith("Error: Rate limit")
+    assert server.stats["requests"] == 1
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight(cross_process=False)
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        leader = pool.submit(flight.do, "key", slow)
+        started.wait()
+        followers = [pool.submit(flight.do, "key", slow) for _ in range(7)]
+        results = [leader.result()] + [future.result() for future in followers]
+
+    assert results == ["result"] * 8
+    assert len(calls) == 1
+    assert flight.in_flight() == 0
+
+
+def test_waiters_get_their_own_exception():
+    flight = SingleFlight(cross_process=False)
+    started = threading.Event()
+    original = TimeoutError("upstream timed out")
+
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        raise original
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, "key", failing)
+        started.wait()
+        follower = pool.submit(flight.do, "key", failing)
+        with pytest.raises(TimeoutError) as leader_error:
+            leader.result()
+        with pytest.raises(TimeoutError) as follower_error:
+            follower.result()
+
+    assert leader_error.value is original
+    assert follower_error.value is not original
+    assert follower_error.value.__cause__ is original
+    assert follower_error.value.args == original.args
+
+
+def test_processes_only_wait_for_the_same_key(tmp_path):
+    # Separate instances stand in for processes: each opens its own lock files
+    flights = [SingleFlight(cross_process=True, lock_dir=str(tmp_path)) for _ in range(2)]
+    both_running = threading.Barrier(2, timeout=2)
+
+    def call(flight, key):
+        return flight.do(key, lambda: both_running.wait() is not None, recheck=lambda: None)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = list(pool.map(call, flights, ["key-a", "key-b"]))
+
+    assert results == [True, True]
+    assert os.listdir(tmp_path) == []
+
+
+def test_processes_find_the_result_of_the_same_key(tmp_path):
+    flights = [SingleFlight(cross_process=True, lock_dir=str(tmp_path)) for _ in range(2)]
+    stored = {}
+    calls = []
+    started = threading.Event()
+
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        stored["key"] = "result"
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first = pool.submit(flights[0].do, "key", slow, recheck=lambda: stored.get("key"))
+        started.wait()
+        second = pool.submit(flights[1].do, "key", slow, recheck=lambda: stored.get("key"))
+        assert first.result() == second.result() == "result"
+
+    assert len(calls) == 1
@@ -0,0 +1,70 @@
+import io
+
+from PIL import Image
+
+import gemini_client
+import history
+import language
+import pipeline
+from jobs import Job
+
+TEXT = " ".join(f"word{i}" for i in range(120))
+
+
+def _jpeg():
+    image_file = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").save(image_file, format="JPEG")
+    return image_file.getvalue()
+
+
+def test_stream_matches_blocking_text(mock_gemini):
+    mock_gemini(response_text=TEXT, stream_chunks=16)
+
+    blocking = language.generate_content("A mock image", local_hashtags=False)
+    chunks = list(language.generate_content_stream("A mock image", local_hashtags=False))
+
+    assert len(chunks) > 1
+    assert "".join(chunks) == blocking == TEXT
+
+
+def test_stream_falls_back_before_first_chunk(mock_gemini):
+    primary = gemini_client.MODELS[0]
+    server = mock_gemini(response_text=TEXT, unavailable_models=[primary])
+
+    chunks = list(language.generate_content_stream("A mock image", local_hashtags=False))
+
+    assert "".join(chunks) == TEXT
+    assert server.stats["requests"] == 2
+    assert primary not in gemini_client.breakers.available([primary])
+
+
+def test_stream_yields_single_error_when_every_model_fails(mock_gemini):
+    mock_gemini(response_text=TEXT, unavailable_models=gemini_client.MODELS)
+
+    chunks = list(language.generate_content_stream("A mock image", local_hashtags=False))
+
+    assert len(chunks) == 1
+    assert chunks[0].startswith("Error")
+
+
+def test_stream_broken_after_first_chunk_ends_with_cut_off_marker(mock_gemini):
+    server = mock_gemini(response_text=TEXT, stream_chunks=8, cut_streams_after=3)
+
+    chunks = list(language.generate_content_stream("A mock image", local_hashtags=False))
+
+    assert TEXT.startswith("".join(chunks[:-1]))
+    assert len(chunks) == 4
+    assert gemini_client.is_cut_off(chunks[-1])
+    assert server.stats["requests"] == 1  # No fallback once text was shown
+
+
+def test_cut_off_stream_fails_the_package_job(mock_gemini, monkeypatch):
+    mock_gemini(response_text=TEXT, cut_streams_after=2)
+    monkeypatch.setattr(history, "ENABLED", False)
+    job = Job("job")
+
+    result = pipeline.run_package_job(job, _jpeg())
+
+    assert gemini_client.is_cut_off(result["error"])
+    assert result["stage"] == "generation"
+    assert job.partial and TEXT.startswith(job.partial)
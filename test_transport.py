@@ -0,0 +1,83 @@
+import os
+import time
+
+import cache
+import gemini_client
+import vision
+
+
+def _generate(image_bytes):
+    return vision.generate_with_images(
+        lambda transport: gemini_client.build_payload(
+            [{"text": "Describe"}, vision.image_part(image_bytes, "image/jpeg", transport)],
+            vision.GENERATION_CONFIG
+        ),
+        [image_bytes]
+    )
+
+
+def test_upload_is_reused_by_content_hash(mock_gemini, monkeypatch):
+    server = mock_gemini()
+    monkeypatch.setattr(vision, "TRANSPORT", "file")
+    image_bytes = os.urandom(64 * 1024)
+
+    for _ in range(2):
+        part = vision.image_part(image_bytes, "image/jpeg")
+        assert "file_data" in part and "inline_data" not in part
+        result = gemini_client.generate_result(
+            gemini_client.build_payload([{"text": "Describe"}, part], vision.GENERATION_CONFIG)
+        )
+        assert not result.is_error, result.text
+
+    assert server.stats["uploads"] == 1
+
+
+def test_upload_is_not_reused_with_another_key(mock_gemini, monkeypatch):
+    server = mock_gemini()
+    image_bytes = os.urandom(1024)
+
+    first = vision.image_part(image_bytes, "image/jpeg", "file")
+    monkeypatch.setattr(gemini_client, "API_KEY", "other-key")
+    second = vision.image_part(image_bytes, "image/jpeg", "file")
+
+    assert first["file_data"]["file_uri"] != second["file_data"]["file_uri"]
+    assert server.stats["uploads"] == 2
+
+
+def test_failed_upload_falls_back_to_inline(mock_gemini, monkeypatch):
+    server = mock_gemini(fail_uploads=True)
+    monkeypatch.setattr(vision, "TRANSPORT", "file")
+    image_bytes = os.urandom(1024)
+
+    part = vision.image_part(image_bytes, "image/jpeg")
+    assert "inline_data" in part and "file_data" not in part
+    result = _generate(image_bytes)
+    assert not result.is_error, result.text
+    assert server.stats["uploads"] == 0
+
+
+def test_expired_upload_is_dropped_and_retried_inline(mock_gemini, monkeypatch):
+    server = mock_gemini()
+    monkeypatch.setattr(vision, "TRANSPORT", "file")
+    image_bytes = os.urandom(1024)
+    assert not _generate(image_bytes).is_error
+
+    server.expire_files()
+    result = _generate(image_bytes)
+
+    assert not result.is_error, result.text
+    assert cache.get_upload_cache().get(vision._upload_key(image_bytes)) is None
+    # The refused file says nothing about the model
+    assert gemini_client.breakers.available([result.model]) == [result.model]
+
+    assert not _generate(image_bytes).is_error
+    assert server.stats["uploads"] == 2
+
+
+def test_memory_tier_expires_entries():
+    upload_cache = cache.AnalysisCache(ttl=0.2)
+    upload_cache.set("key", "files/mock-1")
+    assert upload_cache.get("key") == "files/mock-1"
+
+    time.sleep(0.3)
+    assert upload_cache.get("key") is None
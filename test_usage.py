@@ -0,0 +1,46 @@
+import io
+
+import requests
+from PIL import Image
+
+import api_server
+import gemini_client
+import history
+import pipeline
+from jobs import Job
+
+
+def _jpeg():
+    image_file = io.BytesIO()
+    Image.linear_gradient("L").convert("RGB").save(image_file, format="JPEG")
+    return image_file.getvalue()
+
+
+def test_package_job_reports_model_and_usage(mock_gemini, monkeypatch):
+    mock_gemini()
+    monkeypatch.setattr(history, "ENABLED", False)
+
+    result = pipeline.run_package_job(Job("job"), _jpeg(), structured=True)
+
+    assert "error" not in result, result.get("error")
+    assert result["model"] in gemini_client.MODELS
+    calls = result["usage"]["calls"]
+    assert len(calls) == 2  # The analysis and the package
+    assert result["usage"]["total_tokens"] == sum(call["total_tokens"] for call in calls) > 0
+    assert calls[-1]["model"] == result["model"]
+
+
+def test_api_responses_report_model_and_usage(mock_gemini):
+    mock_gemini()
+    base_url, stop = api_server.serve_in_background()
+    try:
+        generated = requests.post(f"{base_url}/v1/generate", json={"description": "A beach at sunset"}).json()
+        packaged = requests.post(f"{base_url}/v1/packages", files={"image": ("beach.jpg", _jpeg(), "image/jpeg")},
+                                 data={"fused": "1"}).json()
+    finally:
+        stop()
+
+    for body, calls in ((generated, 1), (packaged, 1)):
+        assert body["model"] in gemini_client.MODELS
+        assert len(body["usage"]["calls"]) == calls
+        assert body["usage"]["total_tokens"] > 0
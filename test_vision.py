@@ -0,0 +1,125 @@
+import io
+
+from PIL import ExifTags, Image
+
+import image_index
+import metrics
+import vision
+
+
+def _sideways_jpeg(size):
+    image = Image.new("RGB", size, "red")
+    exif = image.getexif()
+    exif[ExifTags.Base.Orientation] = 6  # Stored on its side; display rotated 90 degrees
+    image_file = io.BytesIO()
+    image.save(image_file, format="JPEG", exif=exif)
+    return image_file.getvalue()
+
+
+def test_carousel_images_are_turned_upright():
+    large, small = _sideways_jpeg((4000, 3000)), _sideways_jpeg((400, 300))
+
+    prepared = vision.prepare_images([io.BytesIO(large), io.BytesIO(small)])
+
+    ingested = Image.open(io.BytesIO(vision.ingest_image(large).image_bytes))
+    # The small one is within budget but can't be passed through on its side
+    for (image_bytes, _), expected_size in zip(prepared, [ingested.size, (300, 400)]):
+        image = Image.open(io.BytesIO(image_bytes))
+        assert image.size == expected_size
+        assert image.getexif().get(ExifTags.Base.Orientation, 1) == 1
+
+
+def _photo(image, quality):
+    image_file = io.BytesIO()
+    image.save(image_file, format="JPEG", quality=quality)
+    return image_file.getvalue()
+
+
+def test_near_duplicates_reuse_analyses_made_with_the_same_prompt(mock_gemini, monkeypatch):
+    server = mock_gemini()
+    monkeypatch.setattr(image_index, "_image_index", image_index.PerceptualIndex(threshold=2))
+    image = Image.effect_noise((64, 48), 80).resize((640, 480), Image.BILINEAR).convert("RGB")
+    original, recompressed, again = _photo(image, 95), _photo(image, 60), _photo(image, 40)
+
+    vision.analyze_image(io.BytesIO(original))
+    vision.analyze_image(io.BytesIO(recompressed))
+    assert server.stats["requests"] == 1
+
+    # Analyses made with another prompt are not shared
+    monkeypatch.setattr(vision, "IMAGE_FEATURES", not vision.IMAGE_FEATURES)
+    vision.analyze_image(io.BytesIO(again))
+    assert server.stats["requests"] == 2
+
+
+def test_carousel_reuses_ingested_images():
+    images = [_sideways_jpeg((4000, 3000)), _sideways_jpeg((400, 300))]
+    ingested = [vision.ingest_image(data) for data in images]
+
+    with metrics.collect() as breakdown:
+        prepared = vision.prepare_images([io.BytesIO(data) for data in images])
+
+    assert prepared == [(image.image_bytes, image.mime_type) for image in ingested]
+    assert breakdown["counters"]["image.ingest_reuses"] == 2
+    assert "image.decode" not in breakdown["timings"]
+
+
+def test_ingest_and_prepare_image_agree():
+    for data in (_sideways_jpeg((4000, 3000)), _sideways_jpeg((400, 300)), _photo(Image.new("RGB", (300, 200)), 90)):
+        ingested = vision.ingest_image(data)
+        assert vision.prepare_image(io.BytesIO(data)) == (ingested.image_bytes, ingested.mime_type)
+
+
+def _encoded(image, image_format):
+    image_file = io.BytesIO()
+    image.save(image_file, format=image_format)
+    return image_file.getvalue()
+
+
+def test_small_upright_images_are_passed_through():
+    original = _encoded(Image.linear_gradient("L").convert("RGB"), "JPEG")
+
+    assert vision.prepare_image(io.BytesIO(original)) == (original, "image/jpeg")
+
+
+def test_large_images_are_downscaled_and_re_encoded():
+    original = _encoded(Image.linear_gradient("L").convert("RGB").resize((3000, 2000)), "PNG")
+
+    image_bytes, mime_type = vision.prepare_image(io.BytesIO(original), max_long_edge=1000, max_pixels=10 ** 6)
+
+    assert mime_type in ("image/jpeg", "image/webp")
+    assert 900 < max(Image.open(io.BytesIO(image_bytes)).size) <= 1000
+    assert len(image_bytes) < len(original)
+
+
+def test_transparent_images_are_not_made_jpeg():
+    original = _encoded(Image.new("RGBA", (2000, 2000), (255, 0, 0, 128)), "PNG")
+
+    image_bytes, mime_type = vision.prepare_image(io.BytesIO(original), max_long_edge=500, formats=["JPEG"])
+
+    assert mime_type == "image/png"
+    assert Image.open(io.BytesIO(image_bytes)).mode == "RGBA"
+
+
+def test_files_over_the_pass_through_size_are_re_encoded():
+    original = _encoded(Image.effect_noise((256, 256), 64).convert("RGB"), "PNG")
+
+    image_bytes, _ = vision.prepare_image(io.BytesIO(original), pass_through_bytes=len(original) - 1)
+
+    assert image_bytes != original
+
+
+def test_capture_details_stay_out_of_descriptions(mock_gemini):
+    mock_gemini()
+    image = Image.linear_gradient("L").convert("RGB")
+    exif = image.getexif()
+    exif[ExifTags.Base.Model] = "PrivateCam X100"
+    exif.get_ifd(ExifTags.IFD.Exif)[ExifTags.Base.DateTimeOriginal] = "2024:05:01 07:30:00"
+    image_file = io.BytesIO()
+    image.save(image_file, format="JPEG", exif=exif)
+
+    prompt, _ = vision.analysis_request(vision.ingest_image(image_file.getvalue()))
+    description = vision.analyze_image(io.BytesIO(image_file.getvalue()))
+
+    assert "PrivateCam X100" in prompt and "2024:05:01 07:30:00" in prompt
+    assert "Colours and visual style" in description
+    assert "PrivateCam" not in description and "2024:05:01" not in description
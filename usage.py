@@ -0,0 +1,310 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+
+import cache
+import metrics
+
+
+def _parse_budgets(value):
+    """
+    Parses "model=tokens,model=tokens" into a dict.
+    """
+    budgets = {}
+    for item in value.split(","):
+        if "=" in item:
+            model_name, tokens = item.split("=", 1)
+            budgets[model_name.strip()] = int(tokens)
+    return budgets
+
+
+# Token budgets per UTC day; 0 means no limit. Work that would go over them is refused.
+DAILY_TOKEN_BUDGET = int(os.getenv("GEMINI_BUDGET_DAILY_TOKENS", "0"))
+SESSION_TOKEN_BUDGET = int(os.getenv("GEMINI_BUDGET_SESSION_TOKENS", "0"))
+# Per-model daily budgets as "model=tokens,..."; a model over its budget is skipped
+MODEL_TOKEN_BUDGETS = _parse_budgets(os.getenv("GEMINI_BUDGET_MODEL_TOKENS", ""))
+# Past this fraction of the daily budget only the cheapest available model is used
+DOWNGRADE_AT = float(os.getenv("GEMINI_BUDGET_DOWNGRADE_AT", "0.8"))
+
+# USD per million input and output tokens: orders models by cost and estimates spend
+PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
+# Start of the error returned for calls refused by a budget
+BUDGET_ERROR = "Error: Token budget exceeded"
+
+TOTALS = ("calls", "prompt_tokens", "image_tokens", "output_tokens", "thoughts_tokens",
+          "total_tokens", "max_output_tokens", "truncated", "cost")
+
+
+@dataclass
+class Usage:
+    """
+    Token usage of one call, from the response's usageMetadata, with the
+    output budget it was given and why generation stopped.
+    """
+    model: str
+    prompt_tokens: int = 0
+    image_tokens: int = 0
+    output_tokens: int = 0
+    thoughts_tokens: int = 0
+    cached_tokens: int = 0
+    total_tokens: int = 0
+    max_output_tokens: int = 0
+    finish_reason: str = ""
+    model_version: str = ""
+
+    @classmethod
+    def from_response(cls, model_name, body, max_output_tokens=0):
+        metadata = body.get("usageMetadata") or {}
+        candidates = body.get("candidates") or [{}]
+        prompt_tokens = metadata.get("promptTokenCount", 0)
+        output_tokens = metadata.get("candidatesTokenCount", 0)
+        thoughts_tokens = metadata.get("thoughtsTokenCount", 0)
+        return cls(
+            model=model_name,
+            prompt_tokens=prompt_tokens,
+            image_tokens=sum(detail.get("tokenCount", 0) for detail in metadata.get("promptTokensDetails", [])
+                             if detail.get("modality") == "IMAGE"),
+            output_tokens=output_tokens,
+            thoughts_tokens=thoughts_tokens,
+            cached_tokens=metadata.get("cachedContentTokenCount", 0),
+            total_tokens=metadata.get("totalTokenCount") or prompt_tokens + output_tokens + thoughts_tokens,
+            max_output_tokens=max_output_tokens or 0,
+            finish_reason=candidates[0].get("finishReason", ""),
+            model_version=body.get("modelVersion", ""),
+        )
+
+    @property
+    def truncated(self):
+        """
+        Whether the output stopped at max_output_tokens.
+        """
+        return self.finish_reason == "MAX_TOKENS"
+
+    @property
+    def cost(self):
+        """
+        Estimated USD cost at PRICES, or 0.0 for an unknown model.
+        """
+        input_price, output_price = PRICES.get(self.model, (0.0, 0.0))
+        return (self.prompt_tokens * input_price + (self.output_tokens + self.thoughts_tokens) * output_price) / 1e6
+
+    def to_dict(self):
+        return dict(asdict(self), truncated=self.truncated, cost=self.cost)
+
+
+def today():
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class UsageLedger:
+    """
+    Token usage summed per UTC day, session and model in SQLite, so daily
+    budgets hold across restarts and across processes sharing CACHE_DIR.
+    """
+
+    def __init__(self, path=None):
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, timeout=10)
+        columns = ", ".join(f"{name} {'REAL' if name == 'cost' else 'INTEGER'} NOT NULL DEFAULT 0" for name in TOTALS)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            f" day TEXT NOT NULL, session TEXT NOT NULL, model TEXT NOT NULL, {columns},"
+            " PRIMARY KEY (day, session, model))"
+        )
+        self._db.commit()
+
+    def record(self, usage, session="", day=None):
+        values = (1, usage.prompt_tokens, usage.image_tokens, usage.output_tokens, usage.thoughts_tokens,
+                  usage.total_tokens, usage.max_output_tokens, int(usage.truncated), usage.cost)
+        with self._lock:
+            self._db.execute(
+                f"INSERT INTO usage (day, session, model, {', '.join(TOTALS)})"
+                f" VALUES (?, ?, ?, {', '.join('?' * len(TOTALS))})"
+                " ON CONFLICT (day, session, model) DO UPDATE SET "
+                + ", ".join(f"{name} = {name} + excluded.{name}" for name in TOTALS),
+                (day or today(), session or "", usage.model, *values)
+            )
+            self._db.commit()
+
+    def _where(self, day, session, model):
+        conditions, params = [], []
+        for column, value in (("day", day), ("session", session), ("model", model)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def totals(self, day=None, session=None, model=None):
+        """
+        Summed usage, optionally limited to one day, session and/or model.
+        """
+        where, params = self._where(day, session, model)
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {', '.join(f'COALESCE(SUM({name}), 0)' for name in TOTALS)} FROM usage{where}", params
+            ).fetchone()
+        return dict(zip(TOTALS, row))
+
+    def breakdown(self, by, day=None, session=None, model=None):
+        """
+        Summed usage grouped by "day", "session" or "model", as {value: totals}.
+        """
+        if by not in ("day", "session", "model"):
+            raise ValueError(f"cannot group usage by {by!r}")
+        where, params = self._where(day, session, model)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {by}, {', '.join(f'SUM({name})' for name in TOTALS)} FROM usage{where}"
+                f" GROUP BY {by} ORDER BY {by}", params
+            ).fetchall()
+        return {row[0]: dict(zip(TOTALS, row[1:])) for row in rows}
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM usage")
+            self._db.commit()
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_ledger():
+    """
+    Returns the process-wide usage ledger.
+    """
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                path = os.path.join(cache.CACHE_DIR, "usage.sqlite3") if cache.CACHE_DIR else None
+                _ledger = UsageLedger(path=path)
+    return _ledger
+
+
+class _Local(threading.local):
+    session = ""
+    calls = None
+
+
+_local = _Local()
+
+
+@contextmanager
+def session_scope(session):
+    """
+    Attributes the calls made on this thread to `session` for per-session
+    usage and budgets.
+    """
+    previous = _local.session
+    _local.session = session or ""
+    try:
+        yield
+    finally:
+        _local.session = previous
+
+
+def current_session():
+    return _local.session
+
+
+@contextmanager
+def collect_calls(calls=None):
+    """
+    Collects the Usage of every call recorded on this thread into a list, so
+    a request can report which models served it and what it cost.
+    """
+    previous = _local.calls
+    _local.calls = [] if calls is None else calls
+    try:
+        yield _local.calls
+    finally:
+        _local.calls = previous
+
+
+def current_calls():
+    return _local.calls
+
+
+def summarize(calls):
+    """
+    Returns (model, summary) for a request's calls: the model of the last
+    call, or None if none was made, and a JSON-serialisable dict with each
+    call's usage and their summed tokens and cost.
+    """
+    return calls[-1].model if calls else None, {
+        "calls": [call.to_dict() for call in calls],
+        "prompt_tokens": sum(call.prompt_tokens for call in calls),
+        "output_tokens": sum(call.output_tokens for call in calls),
+        "total_tokens": sum(call.total_tokens for call in calls),
+        "cost": sum(call.cost for call in calls),
+    }
+
+
+def is_budget_error(text):
+    return text.startswith(BUDGET_ERROR)
+
+
+def record(usage, session=None, calls=None):
+    """
+    Adds a call's usage to the ledger, to the metrics counters and to the
+    list collecting this request's calls (see collect_calls).
+    """
+    get_ledger().record(usage, current_session() if session is None else session)
+    calls = current_calls() if calls is None else calls
+    if calls is not None:
+        calls.append(usage)
+    metrics.incr("usage.prompt_tokens", usage.prompt_tokens)
+    metrics.incr("usage.output_tokens", usage.output_tokens)
+    if usage.truncated:
+        metrics.incr("usage.truncated")
+
+
+def plan(models, estimated_tokens, session=None):
+    """
+    Applies the budgets to a call expected to use about `estimated_tokens`.
+    Returns (models, error): the models it may use, cheapest only once the
+    day is past DOWNGRADE_AT of its budget, or an error string starting
+    with BUDGET_ERROR if the call would go over a budget.
+    """
+    if not (DAILY_TOKEN_BUDGET or SESSION_TOKEN_BUDGET or MODEL_TOKEN_BUDGETS):
+        return models, None
+
+    ledger = get_ledger()
+    day = today()
+    session = current_session() if session is None else session
+    if SESSION_TOKEN_BUDGET:
+        used = ledger.totals(day=day, session=session)["total_tokens"]
+        if used + estimated_tokens > SESSION_TOKEN_BUDGET:
+            metrics.incr("usage.refused")
+            return [], f"{BUDGET_ERROR}: this session has used {used} of its {SESSION_TOKEN_BUDGET} tokens today."
+
+    by_model = ledger.breakdown("model", day=day)
+    used_today = sum(totals["total_tokens"] for totals in by_model.values())
+    if DAILY_TOKEN_BUDGET and used_today + estimated_tokens > DAILY_TOKEN_BUDGET:
+        metrics.incr("usage.refused")
+        return [], f"{BUDGET_ERROR}: {used_today} of the {DAILY_TOKEN_BUDGET} tokens for today are used."
+
+    allowed = [
+        model_name for model_name in models
+        if model_name not in MODEL_TOKEN_BUDGETS
+        or by_model.get(model_name, {}).get("total_tokens", 0) + estimated_tokens <= MODEL_TOKEN_BUDGETS[model_name]
+    ]
+    if not allowed:
+        metrics.incr("usage.refused")
+        return [], f"{BUDGET_ERROR}: every model has used its tokens for today."
+
+    if DAILY_TOKEN_BUDGET and used_today >= DOWNGRADE_AT * DAILY_TOKEN_BUDGET and len(allowed) > 1:
+        metrics.incr("usage.downgrades")
+        allowed = [min(allowed, key=lambda model_name: PRICES.get(model_name, (float("inf"),) * 2)[1])]
+    return allowed, None
@@ -1,51 +1,231 @@
+import json
 import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 import requests
+import config
+import gemini_client
+import cache
+import image_features
+import image_index
+import metrics
+from single_flight import SingleFlight
 import base64
-from dotenv import load_dotenv
-from PIL import Image
+from PIL import ExifTags, Image, ImageOps
 import io
 
-load_dotenv()
-API_KEY = os.getenv("GOOGLE_API_KEY")
+API_KEY = config.API_KEY
 
+# Images larger than this (long edge or total pixels) are downscaled before upload
+MAX_LONG_EDGE = int(os.getenv("GEMINI_IMAGE_MAX_EDGE", "1536"))
+MAX_PIXELS = int(os.getenv("GEMINI_IMAGE_MAX_PIXELS", str(1536 * 1536)))
+# Originals within the pixel budget and under this size are sent untouched
+PASS_THROUGH_BYTES = int(os.getenv("GEMINI_IMAGE_PASS_THROUGH_BYTES", str(4 * 1024 * 1024)))
+# Candidate re-encode formats; the smallest result is sent
+OUTPUT_FORMATS = [f.strip().upper() for f in os.getenv("GEMINI_IMAGE_FORMATS", "JPEG,WEBP").split(",") if f.strip()]
+JPEG_QUALITY = int(os.getenv("GEMINI_IMAGE_QUALITY", "85"))
+# How images reach the API: "inline" (base64 in the request), "file" (Files API
+# upload referenced by URI) or "auto" (upload images above FILE_TRANSPORT_BYTES)
+TRANSPORT = os.getenv("GEMINI_IMAGE_TRANSPORT", "auto")
+FILE_TRANSPORT_BYTES = int(os.getenv("GEMINI_FILE_TRANSPORT_BYTES", str(2 * 1024 * 1024)))
 
-def analyze_image(image_file):
+# Carousel mode: most images per request and cap on their combined prepared size
+CAROUSEL_MAX_IMAGES = int(os.getenv("GEMINI_CAROUSEL_MAX_IMAGES", "10"))
+CAROUSEL_MAX_BYTES = int(os.getenv("GEMINI_CAROUSEL_MAX_BYTES", str(16 * 1024 * 1024)))
+# Carousel images are shrunk together, but never below this long edge, to fit the cap
+CAROUSEL_MIN_EDGE = 512
+
+# Previews shown in the browser are downscaled to this long edge
+PREVIEW_EDGE = int(os.getenv("GEMINI_PREVIEW_EDGE", "800"))
+PREVIEW_QUALITY = 80
+# Ingested uploads kept in memory, so the app's preview and the analysis share one decode
+INGEST_CACHE_ENTRIES = int(os.getenv("GEMINI_INGEST_CACHE_ENTRIES", "16"))
+
+MIME_TYPES = {
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+    "WEBP": "image/webp",
+}
+
+
+def _target_size(size, max_long_edge, max_pixels):
     """
-    Analyzes an image using the Google AI Gemini API endpoint.
+    Returns the size that fits both the long-edge and pixel budgets, keeping aspect ratio.
     """
-    if not API_KEY:
-        return "Error: GOOGLE_API_KEY is not set."
+    width, height = size
+    scale = min(1.0, max_long_edge / max(width, height), (max_pixels / (width * height)) ** 0.5)
+    return max(1, int(width * scale)), max(1, int(height * scale))
 
-    # Updated list to match the WORKING models from your test
-    models_to_try = [
-        "gemini-2.0-flash",
-        "gemini-2.5-flash",
-        "gemini-2.5-pro"
-    ]
 
-    try:
-        # Reset file pointer to beginning
+@dataclass
+class _Prepared:
+    """
+    What _prepare made of an upload: the (image_bytes, mime_type) for the
+    API, the upright decoded image (None if the original was passed through
+    without decoding), its EXIF and the upright size of the original.
+    """
+    prepared: tuple
+    image: Image.Image
+    has_alpha: bool
+    exif: Image.Exif
+    size: tuple
+
+
+def _prepare(image_file, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS, formats=None,
+             pass_through_bytes=PASS_THROUGH_BYTES, decode_edge=None):
+    """
+    Prepares an upload for the API, the one place that decides between
+    passing it through and re-encoding it. An original passed through is
+    still decoded, to about `decode_edge`, when `decode_edge` is given.
+    """
+    formats = formats or OUTPUT_FORMATS
+
+    image_file.seek(0, io.SEEK_END)
+    file_size = image_file.tell()
+    image_file.seek(0)
+    image = Image.open(image_file)
+    image_format = image.format
+    exif = image.getexif()
+    orientation = exif.get(ExifTags.Base.Orientation, 1)
+    width, height = image.size
+    if orientation in image_features.ROTATED_ORIENTATIONS:
+        width, height = height, width
+
+    target = _target_size(image.size, max_long_edge, max_pixels)
+    # Photos stored on their side are turned upright, so only upright ones are sent as-is
+    pass_through = (orientation == 1 and target == image.size and image_format in MIME_TYPES
+                    and file_size <= pass_through_bytes)
+    if pass_through:
+        metrics.incr("image.pass_through")
         image_file.seek(0)
-        image = Image.open(image_file)
-
-        # Convert image to bytes with proper format detection
-        byte_arr = io.BytesIO()
-
-        # Determine the correct format and mime type
-        if image.format == 'PNG':
-            image.save(byte_arr, format='PNG')
-            mime_type = "image/png"
-        else:
-            # Convert to RGB if necessary (for JPEG compatibility)
-            if image.mode in ('RGBA', 'P'):
-                image = image.convert('RGB')
-            image.save(byte_arr, format='JPEG', quality=85)
-            mime_type = "image/jpeg"
-
-        image_bytes = byte_arr.getvalue()
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-
-        prompt = """Analyze this image for social media content creation. Please provide:
+        prepared = image_file.read(), MIME_TYPES[image_format]
+        if decode_edge is None:
+            return _Prepared(prepared, None, False, exif, (width, height))
+
+    with metrics.span("image.decode"):
+        if image_format == 'JPEG':
+            # Let the decoder scale down by a power of two instead of decoding every pixel;
+            # an original sent as-is is only decoded for display, so it can be decoded smaller still
+            image.draft('RGB', _target_size(image.size, decode_edge, decode_edge ** 2) if pass_through else target)
+        has_alpha = _has_alpha(image)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    if not pass_through:
+        if image.size != target:
+            with metrics.span("image.resize"):
+                image.thumbnail(target, Image.LANCZOS)
+        if orientation != 1:
+            image = ImageOps.exif_transpose(image)
+        prepared = _encode_smallest(image, formats, has_alpha)
+
+    return _Prepared(prepared, image, has_alpha, exif, (width, height))
+
+
+def prepare_image(image_file, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS,
+                  formats=None, pass_through_bytes=PASS_THROUGH_BYTES):
+    """
+    Prepares an uploaded image for the API and returns (image_bytes, mime_type).
+
+    Upright images already within budget in a supported format are passed
+    through unchanged. Anything else is downscaled (using JPEG reduce-on-decode
+    where possible), turned upright and re-encoded in whichever of `formats`
+    comes out smallest.
+    """
+    return _prepare(image_file, max_long_edge, max_pixels, formats, pass_through_bytes).prepared
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def _encode_smallest(image, formats, has_alpha):
+    candidates = [f for f in formats if not (has_alpha and f == 'JPEG')] or ['PNG']
+    best_bytes, best_format = None, None
+    with metrics.span("image.encode"):
+        for image_format in candidates:
+            byte_arr = io.BytesIO()
+            image.save(byte_arr, format=image_format, quality=JPEG_QUALITY)
+            if best_bytes is None or byte_arr.tell() < len(best_bytes):
+                best_bytes, best_format = byte_arr.getvalue(), image_format
+
+    return best_bytes, MIME_TYPES[best_format]
+
+
+@dataclass
+class IngestedImage:
+    """
+    An upload decoded once: the prepared image for the API, a bounded
+    preview for display, the upright dimensions of the original, its
+    perceptual hash and its measured features.
+    """
+    image_bytes: bytes
+    mime_type: str
+    preview: bytes
+    width: int
+    height: int
+    perceptual_hash: int
+    features: image_features.ImageFeatures
+
+
+_ingested = OrderedDict()
+_ingested_lock = threading.Lock()
+
+
+def read_image_file(image_file):
+    image_file.seek(0)
+    image_bytes = image_file.read()
+    image_file.seek(0)
+    return image_bytes
+
+
+def _ingest(image_bytes):
+    result = _prepare(io.BytesIO(image_bytes), decode_edge=PREVIEW_EDGE)
+    image = result.image
+
+    # The preview is cut from the prepared image rather than decoded again
+    with metrics.span("image.preview"):
+        image.thumbnail((PREVIEW_EDGE, PREVIEW_EDGE))
+        preview = io.BytesIO()
+        image.save(preview, format='PNG' if result.has_alpha else 'JPEG', quality=PREVIEW_QUALITY)
+
+    with metrics.span("image.features"):
+        features = image_features.extract_features(image, exif=result.exif, size=result.size)
+
+    return IngestedImage(
+        image_bytes=result.prepared[0],
+        mime_type=result.prepared[1],
+        preview=preview.getvalue(),
+        width=result.size[0],
+        height=result.size[1],
+        perceptual_hash=image_index.dhash(image),
+        features=features,
+    )
+
+
+def ingest_image(image_bytes):
+    """
+    Decodes an upload once and returns its IngestedImage. Recent uploads are
+    kept by content hash, so the app's preview and a later analysis of the
+    same bytes don't decode it again.
+    """
+    key = cache.content_hash(image_bytes)
+    with _ingested_lock:
+        ingested = _ingested.get(key)
+        if ingested is not None:
+            _ingested.move_to_end(key)
+            metrics.incr("image.ingest_reuses")
+            return ingested
+
+    ingested = _ingest(image_bytes)
+    with _ingested_lock:
+        _ingested[key] = ingested
+        while len(_ingested) > INGEST_CACHE_ENTRIES:
+            _ingested.popitem(last=False)
+    return ingested
+
+
+ANALYSIS_PROMPT = """Analyze this image for social media content creation. Please provide:
         
         1. A detailed description of what you see in the image 
         2. The overall mood and atmosphere  
@@ -56,81 +236,336 @@ def analyze_image(image_file):
         
         Make your analysis engaging and suitable for social media content creation."""
 
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": mime_type,
-                                "data": base64_image
-                            }
-                        }
-                    ]
-                }
-            ],
-            "generationConfig": {
-                "temperature": 0.7,
-                "topK": 40,
-                "topP": 0.95,
-                "maxOutputTokens": 1024,
-            },
-            "safetySettings": [
-                {
-                    "category": "HARM_CATEGORY_HARASSMENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_HATE_SPEECH",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                },
-                {
-                    "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-                    "threshold": "BLOCK_MEDIUM_AND_ABOVE"
-                }
-            ]
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 1024,
+}
+
+# Give the model measured colours, tone, framing and capture details (see
+# image_features) as facts, so it only writes what it alone can see
+IMAGE_FEATURES = os.getenv("GEMINI_IMAGE_FEATURES", "1") == "1"
+
+FEATURES_PROMPT = """Analyze this image for social media content creation. These facts were measured from the image file; treat them as accurate and don't describe its colours, lighting or camera details yourself:
+
+{facts}
+
+Please provide:
+
+1. A detailed description of what you see in the image
+2. The overall mood and atmosphere
+3. Key objects, people, or elements present
+4. The setting or environment
+5. Any emotions or feelings the image conveys
+
+Make your analysis engaging and suitable for social media content creation."""
+
+FEATURES_GENERATION_CONFIG = dict(
+    GENERATION_CONFIG,
+    maxOutputTokens=int(os.getenv("GEMINI_FEATURES_MAX_OUTPUT_TOKENS", "640")),
+)
+
+
+CAROUSEL_PROMPT = """These {count} images form one social media carousel post, shown in order.
+
+For each image, in "descriptions", write an analysis for social media content creation: what you see, the mood and atmosphere, key objects or people, the setting, and the colours and visual style.
+
+Then, in "summary", describe the set as a whole: the story the images tell together, their shared mood and style, and what ties them together. Make it engaging and suitable for social media content creation."""
+
+# Output budget of carousel analyses: the summary plus a share per image
+CAROUSEL_SUMMARY_TOKENS = 512
+CAROUSEL_TOKENS_PER_IMAGE = 384
+
+
+def _inline_part(image_bytes, mime_type):
+    with metrics.span("image.base64"):
+        data = base64.b64encode(image_bytes).decode('utf-8')
+    return {
+        "inline_data": {
+            "mime_type": mime_type,
+            "data": data
+        }
+    }
+
+
+def _upload_key(image_bytes):
+    return cache.upload_key(image_bytes, gemini_client.API_BASE, gemini_client.API_KEY)
+
+
+def _file_part(image_bytes, mime_type):
+    """
+    Uploads the image once per content hash and API key and references it by URI.
+    """
+    upload_cache = cache.get_upload_cache()
+    upload_key = _upload_key(image_bytes)
+    file_uri = upload_cache.get(upload_key)
+    if file_uri is None:
+        file_uri = gemini_client.upload_file(io.BytesIO(image_bytes), len(image_bytes), mime_type)
+        upload_cache.set(upload_key, file_uri)
+    else:
+        metrics.incr("api.upload_reuses")
+    return {
+        "file_data": {
+            "mime_type": mime_type,
+            "file_uri": file_uri
         }
+    }
+
+
+def image_part(image_bytes, mime_type, transport=None):
+    """
+    Builds the request part that carries the image, either inline as base64
+    or as a reference to an uploaded file. A failed upload falls back to inline.
+    """
+    transport = transport or TRANSPORT
+    if transport == "file" or (transport == "auto" and len(image_bytes) > FILE_TRANSPORT_BYTES):
+        try:
+            return _file_part(image_bytes, mime_type)
+        except (requests.exceptions.RequestException, KeyError, ValueError):
+            metrics.incr("api.upload_failures")
+    return _inline_part(image_bytes, mime_type)
+
+
+def generate_with_images(build_payload, images):
+    """
+    Sends the request `build_payload(transport)` returns, whose images (the
+    bytes in `images`) are added with image_part. If the API refuses an
+    uploaded file, having expired or been uploaded with another key, the
+    images' uploads are forgotten and the request is sent once more with
+    every image inline. Returns a gemini_client.GenerationResult.
+    """
+    payload = build_payload(None)
+    result = gemini_client.generate_result(payload)
+    if gemini_client.is_file_error(result.text):
+        metrics.incr("api.stale_uploads")
+        upload_cache = cache.get_upload_cache()
+        for image_bytes in images:
+            upload_cache.delete(_upload_key(image_bytes))
+        result = gemini_client.generate_result(build_payload("inline"))
+    return result
+
+
+def prepare_images(image_files, max_bytes=CAROUSEL_MAX_BYTES):
+    """
+    Prepares carousel images, reusing their ingested images (see
+    ingest_image) and shrinking them all until their combined size is
+    within `max_bytes`. Returns a list of (image_bytes, mime_type), or None
+    if they don't fit even at CAROUSEL_MIN_EDGE.
+    """
+    ingested = [ingest_image(read_image_file(image_file)) for image_file in image_files]
+    prepared = [(image.image_bytes, image.mime_type) for image in ingested]
+    max_long_edge = MAX_LONG_EDGE
+    while sum(len(image_bytes) for image_bytes, _ in prepared) > max_bytes:
+        if max_long_edge <= CAROUSEL_MIN_EDGE:
+            return None
+        max_long_edge = max(CAROUSEL_MIN_EDGE, int(max_long_edge * 0.7))
+        # Shrinking the prepared images, already upright and within budget, is cheaper than decoding the originals
+        prepared = [
+            prepare_image(io.BytesIO(image.image_bytes), max_long_edge=max_long_edge,
+                          max_pixels=min(MAX_PIXELS, max_long_edge ** 2),
+                          pass_through_bytes=max_bytes // len(image_files))
+            for image in ingested
+        ]
+    return prepared
+
+
+def carousel_parts(prompt, prepared, transport=None):
+    """
+    Request parts for a carousel: the prompt, then each image after a label.
+    """
+    parts = [{"text": prompt}]
+    for number, (image_bytes, mime_type) in enumerate(prepared, 1):
+        parts.append({"text": f"Image {number}:"})
+        parts.append(image_part(image_bytes, mime_type, transport))
+    return parts
+
+
+def carousel_config(count, extra_properties=None, extra_tokens=0):
+    """
+    Generation config asking for JSON with one description per image and a
+    summary, plus any `extra_properties` (name to schema).
+    """
+    properties = {
+        "descriptions": {"type": "ARRAY", "items": {"type": "STRING"}, "minItems": count, "maxItems": count},
+        "summary": {"type": "STRING"},
+        **(extra_properties or {}),
+    }
+    return dict(
+        GENERATION_CONFIG,
+        maxOutputTokens=CAROUSEL_SUMMARY_TOKENS + CAROUSEL_TOKENS_PER_IMAGE * count + extra_tokens,
+        responseMimeType="application/json",
+        responseSchema={
+            "type": "OBJECT",
+            "properties": properties,
+            "required": list(properties),
+            "propertyOrdering": list(properties),
+        },
+    )
+
+
+def parse_carousel(text, count):
+    """
+    Decodes a carousel response, checking it has `count` descriptions and a
+    summary. Raises ValueError otherwise.
+    """
+    data = json.loads(text)
+    descriptions = data.get("descriptions") if isinstance(data, dict) else None
+    if not isinstance(descriptions, list) or not all(isinstance(item, str) for item in descriptions):
+        raise ValueError("missing image descriptions")
+    if len(descriptions) != count:
+        raise ValueError(f"expected {count} image descriptions, got {len(descriptions)}")
+    if not isinstance(data.get("summary"), str):
+        raise ValueError("missing carousel summary")
+    return data
+
+
+def check_carousel(image_files):
+    """
+    Returns the error for a carousel that can't be sent, or None.
+    """
+    if not API_KEY:
+        return "Error: GOOGLE_API_KEY is not set."
+    if not image_files:
+        return "Error: No images were provided."
+    if len(image_files) > CAROUSEL_MAX_IMAGES:
+        return f"Error: A carousel can have at most {CAROUSEL_MAX_IMAGES} images."
+    return None
+
+
+def analyze_images(image_files):
+    """
+    Analyzes the images of a carousel post in a single request. Returns
+    (descriptions, summary) with one description per image; on failure the
+    descriptions are empty and the summary is the error string.
+    """
+    error = check_carousel(image_files)
+    if error:
+        return [], error
+
+    try:
+        prepared = prepare_images(image_files)
+        if prepared is None:
+            return [], f"Error: The images don't fit in {CAROUSEL_MAX_BYTES // (1024 * 1024)} MB even when downscaled."
+
+        prompt = CAROUSEL_PROMPT.format(count=len(image_files))
+        generation_config = carousel_config(len(image_files))
+
+        analysis_cache = cache.get_analysis_cache()
+        cache_key = cache.make_key(
+            "".join(cache.content_hash(image_bytes) for image_bytes, _ in prepared).encode("ascii"),
+            prompt, generation_config
+        )
+        text = analysis_cache.get(cache_key)
+        if text is not None:
+            metrics.incr("cache.hits")
+            data = parse_carousel(text, len(image_files))
+            return data["descriptions"], data["summary"]
+        metrics.incr("cache.misses")
+
+        text = generate_with_images(
+            lambda transport: gemini_client.build_payload(carousel_parts(prompt, prepared, transport),
+                                                          generation_config),
+            [image_bytes for image_bytes, _ in prepared]
+        ).text
+        if text.startswith("Error"):
+            return [], text
+
+        data = parse_carousel(text, len(image_files))
+        analysis_cache.set(cache_key, text)
+        return data["descriptions"], data["summary"]
+
+    except requests.exceptions.Timeout:
+        return [], "Error: Request timed out. Please try again."
+    except requests.exceptions.RequestException as e:
+        return [], f"Error making API request: {str(e)}"
+    except (KeyError, IndexError, ValueError) as e:
+        return [], f"Error parsing API response: {str(e)}"
+    except Exception as e:
+        return [], f"An unexpected error occurred: {str(e)}"
+
+
+# Concurrent analyses of the same image share one upstream request
+analyses_in_flight = SingleFlight()
+
+
+def analysis_request(ingested):
+    """
+    Returns the (prompt, generation_config) used to analyze an ingested image.
+    """
+    if IMAGE_FEATURES:
+        return FEATURES_PROMPT.format(facts=ingested.features.to_facts()), FEATURES_GENERATION_CONFIG
+    return ANALYSIS_PROMPT, GENERATION_CONFIG
+
+
+def _with_features(description, ingested):
+    if not IMAGE_FEATURES or description.startswith("Error"):
+        return description
+    return f"{description}\n\n{ingested.features.to_markdown()}"
+
+
+def _similar_scope(generation_config):
+    # The prompt template, not the prompt: its measured facts differ between near-identical images
+    template = FEATURES_PROMPT if IMAGE_FEATURES else ANALYSIS_PROMPT
+    return cache.make_key(b"", template, generation_config)
+
+
+def _analyze_uncached(ingested, prompt, generation_config, cache_key):
+    analysis_cache = cache.get_analysis_cache()
+
+    # Re-crops, re-compressions and burst shots reuse the analysis of a near-identical
+    # image, if it was made with the same prompt and config (see image_index.SIMILAR_REUSE)
+    index = image_index.get_image_index()
+    perceptual_hash = ingested.perceptual_hash
+    indexable = index.threshold >= 0 and image_index.has_detail(perceptual_hash)
+    scope = _similar_scope(generation_config)
+    if indexable:
+        match = index.find(perceptual_hash, scope=scope)
+        if match is not None:
+            metrics.incr("similar.hits")
+            analysis_cache.set(cache_key, match[0])
+            return match[0]
+
+    description = generate_with_images(
+        lambda transport: gemini_client.build_payload(
+            [{"text": prompt}, image_part(ingested.image_bytes, ingested.mime_type, transport)],
+            generation_config
+        ),
+        [ingested.image_bytes]
+    ).text
+    if not description.startswith("Error"):
+        analysis_cache.set(cache_key, description)
+        if indexable:
+            index.add(perceptual_hash, description, scope=scope)
+    return description
+
+
+def analyze_image(image_file):
+    """
+    Analyzes an image using the Google AI Gemini API endpoint.
+    """
+    if not API_KEY:
+        return "Error: GOOGLE_API_KEY is not set."
+
+    try:
+        ingested = ingest_image(read_image_file(image_file))
+        prompt, generation_config = analysis_request(ingested)
+
+        # Skip the API call entirely if this exact image was analyzed before
+        analysis_cache = cache.get_analysis_cache()
+        cache_key = cache.make_key(ingested.image_bytes, prompt, generation_config)
+        cached_description = analysis_cache.get(cache_key)
+        if cached_description is not None:
+            metrics.incr("cache.hits")
+            return _with_features(cached_description, ingested)
+        metrics.incr("cache.misses")
 
-        # Try each model until one works
-        for model_name in models_to_try:
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={API_KEY}"
-
-            try:
-                response = requests.post(
-                    url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"},
-                    timeout=30
-                )
-
-                if response.status_code == 200:
-                    result = response.json()
-                    if 'candidates' in result and result['candidates']:
-                        if 'content' in result['candidates'][0]:
-                            return result['candidates'][0]['content']['parts'][0]['text']
-                    continue  # Try next model if this one doesn't return content
-
-                elif response.status_code == 404:
-                    continue  # Try next model
-                elif response.status_code == 403:
-                    return f"Error: Access forbidden. Your API key may not have permission to use Generative Language API. Please check that your API key from Google AI Studio has proper permissions."
-                elif response.status_code == 503:
-                    return f"Error: Google's Gemini API service is temporarily unavailable (503). This is usually temporary - please try again in a few minutes. The servers may be overloaded or under maintenance."
-                elif response.status_code == 429:
-                    return f"Error: Rate limit exceeded. Please wait a moment before trying again."
-                else:
-                    continue  # Try next model
-
-            except requests.exceptions.RequestException:
-                continue  # Try next model
-
-        # If all models failed
-        return f"Error: All available Gemini models failed to respond. Please verify your API key is from Google AI Studio (ai.google.dev) and try again later. Models tried: {', '.join(models_to_try)}"
+        description = analyses_in_flight.do(
+            cache_key,
+            lambda: _analyze_uncached(ingested, prompt, generation_config, cache_key),
+            recheck=lambda: analysis_cache.get(cache_key)
+        )
+        return _with_features(description, ingested)
 
     except requests.exceptions.Timeout:
         return "Error: Request timed out. Please try again."